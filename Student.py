@@ -1,19 +1,22 @@
+from startup import STARTUP
 import sys
 import threading
-import json
 import os
-import base64
-from pathlib import Path
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                             QHBoxLayout, QTextEdit, QTreeWidget, QTreeWidgetItem, 
-                             QPushButton, QLabel, QFileDialog, QMessageBox, QGroupBox)
-from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, Qt
-from network import PeerNetwork
+                             QHBoxLayout, QListView, QTreeView, 
+                             QPushButton, QLabel, QFileDialog, QMessageBox, QGroupBox,
+                             QProgressBar)
+from PyQt5.QtCore import QObject, QTimer, QUrl, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QDesktopServices
+from models import FileTableModel, LogModel, follow_tail
+from guibridge import GuiBridge
+
+STARTUP.mark('imports')
+
+def format_size(size):
+    return f"{size // 1024} KB" if size >= 1024 else f"{size} bytes"
 
 class SignalHandler(QObject):
-    message_received = pyqtSignal(str)
-    file_received = pyqtSignal(str, str, str, int)
-    peer_discovered = pyqtSignal(str)
     show_message_box = pyqtSignal(str, str, int)
 
 class StudentWindow(QMainWindow):
@@ -23,25 +26,24 @@ class StudentWindow(QMainWindow):
         self.resize(800, 600)
 
         self.signal_handler = SignalHandler()
-        self.signal_handler.message_received.connect(self.update_messages)
-        self.signal_handler.file_received.connect(self.add_file_to_list)
-        self.signal_handler.peer_discovered.connect(self.update_messages)
         self.signal_handler.show_message_box.connect(self.display_message_box)
 
-        self.received_chunks = {}
-        self.expected_chunks = {}
-        self.received_files = {}
-        self.chunk_registry = {}
-
-        self.network = PeerNetwork(
-            on_file_received=self.handle_file_chunk,
-            on_peer_discovered=self.handle_peer_discovery,
-            on_message_received=self.handle_peer_message
-        )
+        # Chunk, announce and discovery events arrive in bursts; show them in batches at 20 Hz
+        self.ui = GuiBridge(rate=20, parent=self)
+        self.ui.subscribe('message', self.update_messages)
+        self.ui.subscribe('file', self.add_files_to_list)
+        self.ui.subscribe('progress', self.update_progress)
+        self.ui.subscribe('catalog', self.add_catalog_entries)
+        self.open_when_done = set()
+        self.stream_server = None
+        # Created with the rest of the network stack once the window is up (see _bring_up_network)
+        self.network = None
+        self.swarm = None
 
         self.init_ui()
-        self.start_listening()
-        self.join_session()
+        STARTUP.mark('window_built')
+        # Sockets and discovery come up once the window is on screen
+        QTimer.singleShot(0, self.start_network)
 
     def init_ui(self):
         central_widget = QWidget()
@@ -49,20 +51,33 @@ class StudentWindow(QMainWindow):
 
         messages_group = QGroupBox("Received Messages")
         messages_layout = QVBoxLayout(messages_group)
-        self.messages_text = QTextEdit()
-        self.messages_text.setReadOnly(True)
+        self.messages_model = LogModel(parent=self)
+        self.messages_text = QListView()
+        self.messages_text.setUniformItemSizes(True)
+        self.messages_text.setModel(self.messages_model)
+        follow_tail(self.messages_text)
         messages_layout.addWidget(self.messages_text)
         main_layout.addWidget(messages_group)
 
         files_group = QGroupBox("Shared Files")
         files_layout = QVBoxLayout(files_group)
-        self.files_tree = QTreeWidget()
-        self.files_tree.setHeaderLabels(["Name", "Size", "Shared By"])
+        self.files_model = FileTableModel(self)
+        self.files_tree = QTreeView()
+        self.files_tree.setRootIsDecorated(False)
+        self.files_tree.setUniformRowHeights(True)
+        self.files_tree.setModel(self.files_model)
         self.files_tree.setColumnWidth(0, 250)
         self.files_tree.setColumnWidth(1, 100)
         self.files_tree.setColumnWidth(2, 150)
+        self.files_tree.doubleClicked.connect(self.open_file)
         files_layout.addWidget(self.files_tree)
 
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        files_layout.addWidget(self.progress_bar)
+        self.progress_label = QLabel("Idle")
+        files_layout.addWidget(self.progress_label)
+
         download_btn = QPushButton("Download Selected")
         download_btn.clicked.connect(self.download_file)
         download_btn.setStyleSheet("background-color: #6C63FF; color: white;")
@@ -79,103 +94,21 @@ class StudentWindow(QMainWindow):
             QMessageBox.information(self, title, message)
 
     def handle_peer_discovery(self, message, addr):
-        self.signal_handler.peer_discovered.emit(f"Discovered peer: {addr[0]}")
+        self.ui.post('message', f"Discovered peer: {addr[0]}")
+
+    def handle_peer_lost(self, ip):
+        self.ui.post('message', f"Peer left: {ip}")
 
     def handle_peer_message(self, message, sender_address):
-        ip = sender_address[0]
-        try:
-            if message.startswith("CHUNK_ANNOUNCE"):
-                _, filename, chunk_idx = message.split("|")
-                chunk_idx = int(chunk_idx)
-                self.chunk_registry.setdefault(filename, {}).setdefault(chunk_idx, []).append(ip)
-                self.signal_handler.message_received.emit(f"📣 {ip} has chunk {chunk_idx} of {filename}")
-
-            elif message.startswith("REQUEST_CHUNK"):
-                _, filename, chunk_idx = message.split("|")
-                chunk_idx = int(chunk_idx)
-                if filename in self.received_chunks and chunk_idx in self.received_chunks[filename]:
-                    chunk_data = base64.b64encode(self.received_chunks[filename][chunk_idx]).decode('utf-8')
-                    reply = f"CHUNK_DATA|{filename}|{chunk_idx}|{chunk_data}"
-                    self.network.send_message(ip, reply)
-
-            elif message.startswith("CHUNK_DATA"):
-                _, filename, chunk_idx, chunk_data_b64 = message.split("|", 3)
-                chunk_idx = int(chunk_idx)
-                chunk_data = base64.b64decode(chunk_data_b64)
-                if filename not in self.received_chunks:
-                    self.received_chunks[filename] = {}
-                self.received_chunks[filename][chunk_idx] = chunk_data
-                self.signal_handler.message_received.emit(f"📥 Received missing chunk {chunk_idx} of {filename} from {ip}")
-                if filename in self.expected_chunks and len(self.received_chunks[filename]) == self.expected_chunks[filename]:
-                    self.assemble_file(filename, ip)
-            else:
-                self.signal_handler.message_received.emit(f" Message from {ip}: {message}")
-        except Exception as e:
-            self.signal_handler.message_received.emit(f"❌ Error handling peer message: {e}")
+        if not self.swarm.handle_peer_message(message, sender_address):
+            self.ui.post('message', f" Message from {sender_address[0]}: {message}")
 
     def handle_file_chunk(self, chunk_info, sender_address):
-        try:
-            required_keys = ['file_name', 'chunk_index', 'total_chunks', 'data']
-            for key in required_keys:
-                if key not in chunk_info:
-                    self.signal_handler.message_received.emit(f"❌ Missing key in chunk_info: {key}")
-                    return
-
-            file_name = chunk_info['file_name']
-            index = chunk_info['chunk_index']
-            total = chunk_info['total_chunks']
-            data = chunk_info['data']
-            sender_ip = sender_address[0]
-
-            if file_name not in self.received_chunks:
-                self.received_chunks[file_name] = {}
-                self.expected_chunks[file_name] = total
-
-            self.received_chunks[file_name][index] = data
-            self.chunk_registry.setdefault(file_name, {}).setdefault(index, []).append(sender_ip)
-
-            self.signal_handler.message_received.emit(f" Received chunk {index + 1}/{total} of {file_name} from {sender_ip}")
-
-            for peer in self.network.peers:
-                peer_ip = peer[0] if isinstance(peer, tuple) else peer
-                if peer_ip != sender_ip:
-                    self.network.send_message(peer_ip, f"CHUNK_ANNOUNCE|{file_name}|{index}")
-
-            if len(self.received_chunks[file_name]) < total:
-                missing = [i for i in range(total) if i not in self.received_chunks[file_name]]
-                for m in missing:
-                    if m in self.chunk_registry.get(file_name, {}):
-                        for peer_ip in self.chunk_registry[file_name][m]:
-                            self.network.send_message(peer_ip, f"REQUEST_CHUNK|{file_name}|{m}")
-
-            if len(self.received_chunks[file_name]) == total:
-                self.assemble_file(file_name, sender_ip)
-
-        except Exception as e:
-            self.signal_handler.message_received.emit(f"❌ Error handling chunk: {e}")
-
-    def assemble_file(self, file_name, sender_ip):
-        chunks = self.received_chunks[file_name]
-        if len(chunks) != self.expected_chunks[file_name]:
-            return
-
-        save_dir = Path.home() / "Downloads" / "GEHU_P2P_Received"
-        save_dir.mkdir(parents=True, exist_ok=True)
-        file_path = save_dir / file_name
+        self.swarm.handle_file_chunk(chunk_info, sender_address)
 
-        with open(file_path, 'wb') as f:
-            for i in range(len(chunks)):
-                f.write(chunks[i])
-
-        file_size = os.path.getsize(file_path)
-        self.received_files[file_name] = {
-            'path': str(file_path),
-            'size': file_size,
-            'sender': sender_ip
-        }
-
-        size_str = f"{file_size // 1024} KB" if file_size >= 1024 else f"{file_size} bytes"
-        self.signal_handler.file_received.emit(file_name, size_str, sender_ip, file_size)
+    def on_file_complete(self, file_name, file_path, file_size, sender_ip):
+        size_str = format_size(file_size)
+        self.ui.post('file', (file_name, size_str, sender_ip, file_size))
 
         self.signal_handler.show_message_box.emit(
             "File Reconstructed",
@@ -183,32 +116,98 @@ class StudentWindow(QMainWindow):
             QMessageBox.Information
         )
 
-    @pyqtSlot(str)
-    def update_messages(self, msg):
-        self.messages_text.append(msg)
-        scrollbar = self.messages_text.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
-
-    @pyqtSlot(str, str, str, int)
-    def add_file_to_list(self, name, size, sender, raw_size):
-        item = QTreeWidgetItem([name, size, sender])
-        item.setData(0, Qt.UserRole, raw_size)
-        self.files_tree.addTopLevelItem(item)
+    def update_progress(self, snapshots):
+        received = [s for s in snapshots if s['direction'] == 'receive']
+        if not received:
+            return
+        snapshot = received[-1]
+        self.progress_bar.setValue(int(snapshot['percent']))
+        if snapshot['done']:
+            self.progress_label.setText(f"{snapshot['file_name']}: done")
+        else:
+            eta = f", ETA {snapshot['eta']:.0f}s" if snapshot['eta'] is not None else ""
+            self.progress_label.setText(
+                f"{snapshot['file_name']} from {snapshot['peer']}: {snapshot['rate'] / 1024:.0f} KB/s{eta}")
+
+    def update_messages(self, lines):
+        self.messages_model.append(lines)
+
+    def add_files_to_list(self, files):
+        for name, size, sender, raw_size in files:
+            self.files_model.add_or_update(name, size, sender, raw_size, "Downloaded")
+            if name in self.open_when_done:
+                self.open_when_done.discard(name)
+                self.open_file_path(name)
+
+    def add_catalog_entries(self, entries):
+        """List files published in the session; nothing is downloaded until asked for"""
+        for entry in entries:
+            manifest = entry['manifest']
+            name = manifest['name']
+            if name in self.swarm.received_files or self.files_model.status(name) in ("Downloading", "Streaming"):
+                continue
+            sharer = entry['publisher'] or next(iter(entry['sources']), "")
+            self.files_model.add_or_update(name, format_size(manifest['size']), sharer, manifest['size'], "Available")
+
+    def fetch_file(self, file_name):
+        """Start an on-demand download of a catalog file"""
+        if self.swarm.fetch(file_name):
+            self.files_model.set_status(file_name, "Downloading")
+            return True
+        self.signal_handler.show_message_box.emit("Unavailable", f"No peer is sharing {file_name} right now", QMessageBox.Warning)
+        return False
+
+    def network_ready(self):
+        """Whether the network is up; tells the student to wait if it isn't"""
+        if self.network is not None:
+            return True
+        self.signal_handler.show_message_box.emit("Connecting", "Still joining the session, try again in a moment", QMessageBox.Warning)
+        return False
+
+    def open_file(self, index):
+        """Open a downloaded file; play media while it streams in, download anything else first"""
+        from streaming import is_media
+
+        file_name = self.files_model.file_name(index.row())
+        if not self.network_ready():
+            return
+        if self.swarm.received_files.get(file_name):
+            self.open_file_path(file_name)
+        elif is_media(file_name) and self.network.catalog.get(file_name):
+            self.stream_file(file_name)
+        elif self.fetch_file(file_name):
+            self.open_when_done.add(file_name)
+
+    def stream_file(self, file_name):
+        """Hand the player a loopback URL that serves the file as its chunks arrive"""
+        if self.stream_server is None:
+            from streaming import StreamServer
+            self.stream_server = StreamServer(self.swarm)
+        self.files_model.set_status(file_name, "Streaming")
+        QDesktopServices.openUrl(QUrl(self.stream_server.url_for(file_name)))
+
+    def open_file_path(self, file_name):
+        QDesktopServices.openUrl(QUrl.fromLocalFile(self.swarm.received_files[file_name]['path']))
 
     def download_file(self):
-        selected_items = self.files_tree.selectedItems()
-        if not selected_items:
+        selected_rows = self.files_tree.selectionModel().selectedRows()
+        if not selected_rows:
             self.signal_handler.show_message_box.emit("Warning", "Please select a file to download", QMessageBox.Warning)
             return
 
-        selected_item = selected_items[0]
-        file_name = selected_item.text(0)
+        file_name = self.files_model.file_name(selected_rows[0].row())
+        if not self.network_ready():
+            return
 
-        if file_name not in self.received_files:
-            self.signal_handler.show_message_box.emit("Error", "File information not found", QMessageBox.Warning)
+        file_info = self.swarm.received_files.get(file_name)
+        if not file_info:
+            if self.network.catalog.get(file_name):
+                self.fetch_file(file_name)
+            else:
+                self.signal_handler.show_message_box.emit("Error", "File information not found", QMessageBox.Warning)
             return
 
-        source_path = self.received_files[file_name]['path']
+        source_path = file_info['path']
         if not os.path.exists(source_path):
             self.signal_handler.show_message_box.emit("Error", f"Source file not found at {source_path}", QMessageBox.Warning)
             return
@@ -223,6 +222,44 @@ class StudentWindow(QMainWindow):
             except Exception as e:
                 self.signal_handler.show_message_box.emit("Error", f"Failed to save file: {e}", QMessageBox.Warning)
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if STARTUP.elapsed('window_shown') is None:
+            STARTUP.mark('window_shown')
+
+    def start_network(self):
+        STARTUP.mark('interactive')
+        threading.Thread(target=self._bring_up_network, name='p2p-startup', daemon=True).start()
+
+    def _bring_up_network(self):
+        # Imported here, off the GUI thread, so they don't delay the first paint
+        from network import PeerNetwork
+        from swarm import ChunkSwarm
+
+        network = PeerNetwork(
+            on_file_received=self.handle_file_chunk,
+            on_peer_discovered=self.handle_peer_discovery,
+            on_message_received=self.handle_peer_message,
+            on_peer_lost=self.handle_peer_lost,
+            on_transfer_progress=lambda snapshot: self.ui.latest('progress', snapshot['transfer_id'], snapshot),
+            on_catalog_change=lambda entry: self.ui.post('catalog', entry)
+        )
+        # Catalog files are only downloaded when the student asks for them
+        self.swarm = ChunkSwarm(
+            network,
+            on_event=lambda text: self.ui.post('message', text),
+            on_file_complete=self.on_file_complete,
+            auto_fetch=False
+        )
+        self.network = network
+        self.start_listening()
+        self.join_session()
+        metrics_port = os.environ.get('GEHU_P2P_METRICS_PORT')
+        if metrics_port:
+            self.network.start_metrics_server(int(metrics_port))
+        STARTUP.mark('network_ready')
+        STARTUP.finish('student')
+
     def start_listening(self):
         threading.Thread(target=self.network.listen_for_peers, daemon=True).start()
         threading.Thread(target=self.network.listen_for_files, daemon=True).start()
@@ -230,11 +267,10 @@ class StudentWindow(QMainWindow):
         try:
             threading.Thread(target=self.network.listen_for_acks, daemon=True).start()
         except Exception as e:
-            self.signal_handler.message_received.emit(f"⚠️ Could not start ACK listener: {e}")
+            self.ui.post('message', f"⚠️ Could not start ACK listener: {e}")
 
     def join_session(self):
         self.network.discover_peers()
-        QApplication.instance().processEvents()
         self.signal_handler.show_message_box.emit("Success", "Connected to the session", QMessageBox.Information)
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+"""Loopback benchmark for PeerNetwork transfer paths.
+
+Spins up one sender and N receiver PeerNetwork nodes, each bound to its own
+127.0.0.x address, and times send_file, send_file_chunks, the swarm repair
+path (partial delivery recovered from peers via REQUEST_CHUNK) and relay-tree
+distribution (the sender uploads to two relays that forward). Every mode runs
+in a fresh child process so CPU time and peak RSS are not mixed between modes.
+
+    python bench.py --peers 4 --sizes 1M,16M --modes file,chunks,swarm,tree --repeat 3
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+MODES = ('file', 'chunks', 'swarm', 'tree')
+PORTS = dict(port=18080, file_port=18081, message_port=18008, ack_port=18010)
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size):
+    for unit, scale in (('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024)):
+        if size >= scale:
+            return f"{size / scale:g}{unit}"
+    return str(size)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class Node:
+    """A receiving PeerNetwork plus the swarm logic a student would run"""
+
+    def __init__(self, host, save_dir):
+        from network import PeerNetwork
+        from swarm import ChunkSwarm
+
+        self.host = host
+        self.completed = {}
+        self.done = threading.Condition()
+        self.network = PeerNetwork(
+            host=host,
+            on_file_received=self._on_file,
+            on_message_received=self._on_message,
+            peer_cache=False,
+            **PORTS
+        )
+        self.swarm = ChunkSwarm(self.network, save_dir=save_dir, on_file_complete=self._on_complete)
+        for listener in (self.network.listen_for_files, self.network.listen_for_messages,
+                         self.network.listen_for_acks):
+            threading.Thread(target=listener, daemon=True).start()
+
+    def _on_file(self, info, addr):
+        self.swarm.handle_file_chunk(info, addr)
+
+    def _on_message(self, message, addr):
+        self.swarm.handle_peer_message(message, addr)
+
+    def _on_complete(self, file_name, path, size, sender):
+        with self.done:
+            self.completed[file_name] = time.perf_counter()
+            self.done.notify_all()
+
+    def wait_for(self, file_name, deadline):
+        with self.done:
+            while file_name not in self.completed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.done.wait(remaining)
+            return self.completed[file_name]
+
+
+def run_once(mode, sender, nodes, path, drop, rng):
+    from relay import TreeDistributor
+
+    file_name = os.path.basename(path)
+    size = os.path.getsize(path)
+    total_chunks = max(1, -(-size // sender.chunk_size))
+    ips = [node.host for node in nodes]
+    start = time.perf_counter()
+
+    if mode == 'file':
+        for ip in ips:
+            sender.send_file(path, ip)
+    elif mode == 'chunks':
+        for ip in ips:
+            sender.send_file_chunks(path, ip)
+    elif mode == 'swarm':
+        # The first receiver gets everything and seeds; the rest miss a share of the
+        # chunks and have to repair them from their peers
+        sender.send_file_chunks(path, ips[0])
+        for ip in ips[1:]:
+            keep = [i for i in range(total_chunks) if rng.random() >= drop]
+            if not keep:
+                keep = [0]
+            sender.send_file_chunks(path, ip, indices=keep)
+    elif mode == 'tree':
+        TreeDistributor(sender, fanout=2).distribute(path, ips)
+
+    deadline = time.perf_counter() + 120
+    latencies = []
+    for node in nodes:
+        finished = node.wait_for(file_name, deadline)
+        if finished is not None:
+            latencies.append(finished - start)
+    wall = time.perf_counter() - start
+
+    for node in nodes:
+        # Saved files serve their chunks to slower peers, so they go only once everyone is done
+        info = node.swarm.received_files.get(file_name)
+        node.swarm.discard(file_name)
+        if info:
+            os.remove(info['path'])
+    return wall, latencies
+
+
+def run_mode(mode, sizes, peers, repeat, drop, seed):
+    """Run one mode in this process and return result rows"""
+    from netlog import configure_logging
+    from network import PeerNetwork
+
+    configure_logging(level='WARNING')
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix='gehu_bench_')
+    sender = PeerNetwork(host='127.0.0.2', peer_cache=False, **PORTS)
+    # Acks come back batched over the message port (older clients use the ack port)
+    for listener in (sender.listen_for_acks, sender.listen_for_messages):
+        threading.Thread(target=listener, daemon=True).start()
+    nodes = [Node(f"127.0.0.{10 + i}", os.path.join(workdir, f"node{i}")) for i in range(peers)]
+    for node in nodes:
+        for other in nodes:
+            if other is not node:
+                node.network.add_peer(other.host)
+    time.sleep(0.2)
+
+    rows = []
+    for size in sizes:
+        path = os.path.join(workdir, f"bench_{mode}_{format_size(size)}.bin")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+
+        latencies = []
+        walls = []
+        failures = 0
+        cpu_start = time.process_time()
+        for r in range(repeat):
+            run_path = f"{path}.{r}"
+            os.link(path, run_path)
+            wall, done = run_once(mode, sender, nodes, run_path, drop, rng)
+            os.remove(run_path)
+            walls.append(wall)
+            latencies.extend(done)
+            failures += peers - len(done)
+        cpu = time.process_time() - cpu_start
+        os.remove(path)
+
+        delivered = size * (peers * repeat - failures)
+        rows.append({
+            'mode': mode,
+            'size': size,
+            'peers': peers,
+            'repeat': repeat,
+            'throughput_mb_s': delivered / sum(walls) / 1024 ** 2 if sum(walls) else 0.0,
+            'p50_s': percentile(latencies, 0.5),
+            'p90_s': percentile(latencies, 0.9),
+            'p99_s': percentile(latencies, 0.99),
+            'cpu_s': cpu,
+            'failures': failures,
+            'chunk_latency_p50_s': sender.chunk_latency_seconds.quantile(0.5),
+            'chunk_retries': sender.chunk_retries.total(),
+        })
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == 'darwin':
+        peak_rss_mb /= 1024  # ru_maxrss is in bytes there, kilobytes on Linux
+    for row in rows:
+        row['peak_rss_mb'] = peak_rss_mb
+    shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+
+def print_table(rows):
+    header = f"{'mode':<7}{'size':>7}{'peers':>6}{'MB/s':>9}{'p50 s':>8}{'p90 s':>8}{'p99 s':>8}{'cpu s':>8}{'rss MB':>8}{'fail':>5}"
+    print(header)
+    print('-' * len(header))
+    fmt = lambda v: f"{v:8.3f}" if v is not None else f"{'-':>8}"
+    for row in rows:
+        print(f"{row['mode']:<7}{format_size(row['size']):>7}{row['peers']:>6}{row['throughput_mb_s']:9.1f}"
+              f"{fmt(row['p50_s'])}{fmt(row['p90_s'])}{fmt(row['p99_s'])}{row['cpu_s']:8.2f}"
+              f"{row['peak_rss_mb']:8.1f}{row['failures']:>5}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PeerNetwork transfer paths on loopback")
+    parser.add_argument('--peers', type=int, default=4, help="number of receiving nodes")
+    parser.add_argument('--sizes', default='256K,4M,32M', help="comma separated file sizes (K/M/G suffixes)")
+    parser.add_argument('--modes', default=','.join(MODES), help="comma separated subset of: " + ', '.join(MODES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--drop', type=float, default=0.25, help="share of chunks withheld per peer in swarm mode")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help="also write the results as JSON")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sizes = [parse_size(s) for s in args.sizes.split(',') if s]
+    modes = [m for m in args.modes.split(',') if m]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}")
+
+    if args.child:
+        rows = run_mode(modes[0], sizes, args.peers, args.repeat, args.drop, args.seed)
+        json.dump(rows, sys.stdout)
+        return 0
+
+    rows = []
+    for mode in modes:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', '--modes', mode,
+               '--sizes', args.sizes, '--peers', str(args.peers), '--repeat', str(args.repeat),
+               '--drop', str(args.drop), '--seed', str(args.seed)]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if result.returncode != 0:
+            print(f"{mode}: benchmark child failed with exit code {result.returncode}", file=sys.stderr)
+            continue
+        rows.extend(json.loads(result.stdout))
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from netlog import get_logger
+
+log = get_logger('catalog')
+
+PUBLISH_PREFIX = "CATALOG_PUBLISH|"
+MANIFESTS_PREFIX = "MANIFESTS|"
+
+
+def is_safe_file_name(name):
+    """Whether a file name from the network is a plain name that stays inside the save directory"""
+    return (isinstance(name, str) and name not in ('', '.', '..') and os.path.basename(name) == name
+            and '\\' not in name and '\0' not in name)
+
+
+def build_manifest(file_path, chunk_size, on_block=None):
+    """Describe a file for the catalog: name, size, SHA-256 and one SHA-256 per chunk.
+
+    ``on_block(index, data)`` is called with each chunk as it is read.
+    """
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+            if on_block:
+                on_block(len(chunks), block)
+            chunks.append(hashlib.sha256(block).hexdigest())
+            size += len(block)
+    return {
+        'name': os.path.basename(file_path),
+        'size': size,
+        'sha256': digest.hexdigest(),
+        'chunk_size': chunk_size,
+        'total_chunks': len(chunks),
+        'chunks': chunks,
+        'published': time.time(),
+    }
+
+
+class FileCatalog:
+    """The files shared in the session, as manifests, and which peers hold them.
+
+    ``publish(path)`` adds a local file and broadcasts its manifest to every
+    peer; peers that join later ask for the manifests we know with a MANIFESTS
+    request as soon as they see us. Nothing is transferred until a receiver
+    asks for the chunks (see ChunkSwarm.fetch), so only files someone opens
+    cost bandwidth.
+
+    Each entry records the manifest, the ``publisher`` (the peer that published
+    the file, where completion acks go) and ``sources``, the peers known to
+    hold the whole file. Peers listing a file they hold name its publisher, so
+    a file first heard of from another student is still credited to the
+    teacher. ``on_change(entry)`` is called whenever an entry is added or
+    gains a source.
+    """
+
+    def __init__(self, network, on_change=None):
+        self.network = network
+        self.on_change = on_change
+        self._local = {}  # file_name -> path of a file we publish
+        self._entries = {}  # file_name -> {'manifest', 'publisher', 'sources'}
+        self._lock = threading.Lock()
+        network.register_request_handler(MANIFESTS_PREFIX, self._list_manifests)
+        network.peers.subscribe(self._on_peer_change)
+
+    def publish(self, file_path):
+        """Share a local file: build its manifest and announce it to every peer"""
+        # Hashed once per version of the file (see ChunkCache), stamped afresh for each publish
+        manifest = dict(self.network.chunk_cache.manifest(file_path), published=time.time())
+        with self._lock:
+            self._local[manifest['name']] = str(file_path)
+            self._entries[manifest['name']] = {'manifest': manifest, 'publisher': None, 'sources': set()}
+        log.info("file_published", file=manifest['name'], size=manifest['size'], chunks=manifest['total_chunks'])
+        self.network.broadcast(PUBLISH_PREFIX + json.dumps(manifest))
+        self._changed(manifest['name'])
+        return manifest
+
+    def hold(self, file_name):
+        """Note that we now hold a catalog file in full, so we list it for others"""
+        with self._lock:
+            if file_name not in self._entries:
+                return False
+            self._entries[file_name]['held'] = True
+        return True
+
+    def add(self, manifest, peer_ip):
+        """Record that ``peer_ip`` offers the file described by ``manifest``"""
+        name = manifest.get('name')
+        if not is_safe_file_name(name) or 'total_chunks' not in manifest:
+            log.warning("manifest_invalid", peer=peer_ip, file=name)
+            return False
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry['manifest'].get('sha256') != manifest.get('sha256'):
+                if manifest.get('published', 0) <= entry['manifest'].get('published', 0):
+                    return False
+                entry = None  # a newer version under the same name replaces the old one
+            if entry is None:
+                publisher = manifest.get('publisher') or peer_ip
+                entry = self._entries[name] = {'manifest': manifest, 'publisher': publisher, 'sources': set()}
+            elif peer_ip in entry['sources']:
+                return False
+            entry['sources'].add(peer_ip)
+        self._changed(name)
+        return True
+
+    def get(self, file_name):
+        with self._lock:
+            entry = self._entries.get(file_name)
+            return dict(entry, sources=set(entry['sources'])) if entry else None
+
+    def manifest(self, file_name):
+        with self._lock:
+            entry = self._entries.get(file_name)
+            return entry['manifest'] if entry else None
+
+    def entries(self):
+        with self._lock:
+            return [dict(entry, sources=set(entry['sources'])) for entry in self._entries.values()]
+
+    def local_path(self, file_name):
+        with self._lock:
+            return self._local.get(file_name)
+
+    def verify(self, file_name, index, data):
+        """False only if the catalog has a hash for this chunk and ``data`` doesn't match it"""
+        manifest = self.manifest(file_name)
+        if not manifest or manifest.get('chunk_size') != self.network.chunk_size:
+            return True
+        chunks = manifest.get('chunks') or []
+        if index >= len(chunks):
+            return True
+        return hashlib.sha256(data).hexdigest() == chunks[index]
+
+    def handle_peer_message(self, message, sender_address):
+        """Record a published manifest, returning False for any other message"""
+        if not message.startswith(PUBLISH_PREFIX):
+            return False
+        try:
+            self.add(json.loads(message[len(PUBLISH_PREFIX):]), sender_address[0])
+        except ValueError as e:
+            log.warning("manifest_decode_failed", peer=sender_address[0], error=e)
+        return True
+
+    def _list_manifests(self, message, sender_address):
+        with self._lock:
+            manifests = [entry['manifest'] if name in self._local else dict(entry['manifest'], publisher=entry['publisher'])
+                         for name, entry in self._entries.items() if name in self._local or entry.get('held')]
+        return json.dumps(manifests)
+
+    def _on_peer_change(self, event, info):
+        if event in ('added', 'up'):
+            threading.Thread(target=self.refresh_from, args=(info.ip,), daemon=True).start()
+
+    def refresh_from(self, peer_ip):
+        """Ask a peer for the manifests of the files it can serve"""
+        try:
+            manifests = json.loads(self.network.request(peer_ip, MANIFESTS_PREFIX) or '[]')
+        except Exception as e:
+            log.debug("manifests_unavailable", peer=peer_ip, error=e)
+            return 0
+        return sum(1 for manifest in manifests if self.add(manifest, peer_ip))
+
+    def _changed(self, file_name):
+        if self.on_change:
+            entry = self.get(file_name)
+            if entry:
+                self.on_change(entry)
@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from collections import deque
+
+from netlog import get_logger
+
+log = get_logger('choking')
+
+
+class UploadScheduler:
+    """Serves peers' chunk requests through a fixed number of upload slots.
+
+    At most ``slots`` uploads run at once, however many peers ask, so a student
+    holding a rare chunk cannot have their uplink flooded. Requests wait in a
+    per-peer queue and only unchoked peers are served, round robin between them.
+
+    Every ``rechoke_interval`` seconds the unchoked set is recomputed among the
+    peers with queued requests: ``slots - 1`` go to the peers that uploaded the
+    most to us in the last interval (tit-for-tat), with the rate we served them
+    at as the tie-break, which is what a seed with nothing to download ends up
+    ranking by. One more slot is an optimistic unchoke that rotates to a random
+    choked peer every ``optimistic_every`` rechokes, so newcomers with nothing
+    to trade yet still get started. A peer that becomes interested while a slot
+    is free, or held by a peer with nothing queued, is unchoked at once rather
+    than waiting for the next round.
+
+    Requests queued longer than ``max_wait`` are dropped, since by then the
+    requester has asked someone else.
+    """
+
+    def __init__(self, network, slots=4, rechoke_interval=10.0, optimistic_every=3,
+                 max_queue=64, max_wait=10.0):
+        self.network = network
+        self.slots = slots
+        self.rechoke_interval = rechoke_interval
+        self.optimistic_every = optimistic_every
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._queues = {}  # peer_ip -> deque of (queued_at, job, key)
+        self._unchoked = set()
+        self._optimistic = None
+        self._rounds = 0
+        self._downloaded = {}  # bytes received from each peer this interval
+        self._uploaded = {}  # bytes sent to each peer this interval
+        self._turn = deque()
+        self._cond = threading.Condition()
+        self._started = False
+
+        m = network.metrics
+        self.uploads = m.counter('p2p_uploads_total', 'Chunk uploads served to peers')
+        self.uploads_dropped = m.counter('p2p_uploads_dropped_total', 'Chunk requests dropped, by reason')
+        self.unchoked_peers = m.gauge('p2p_unchoked_peers', 'Peers currently allowed to download from us')
+
+    def _start(self):
+        self._started = True
+        for n in range(self.slots):
+            threading.Thread(target=self._worker, name=f'p2p-upload-{n}', daemon=True).start()
+        threading.Thread(target=self._rechoke_loop, daemon=True).start()
+
+    def submit(self, peer_ip, job, key=None):
+        """Queue ``job()`` (an upload to ``peer_ip`` returning the bytes sent) for a slot.
+
+        ``key`` identifies the request for ``cancel``.
+        """
+        with self._cond:
+            if not self._started:
+                self._start()
+            queue = self._queues.setdefault(peer_ip, deque())
+            if len(queue) >= self.max_queue:
+                self.uploads_dropped.inc(reason='queue_full')
+                return False
+            queue.append((time.monotonic(), job, key))
+            if peer_ip not in self._unchoked:
+                idle = [ip for ip in self._unchoked if not self._queues.get(ip)]
+                if len(self._unchoked) >= self.slots and idle:
+                    self._unchoked.discard(idle[0])
+                if len(self._unchoked) < self.slots:
+                    self._unchoke(peer_ip)
+            self._cond.notify()
+        return True
+
+    def cancel(self, peer_ip, key):
+        """Drop a queued request that the peer no longer needs"""
+        with self._cond:
+            queue = self._queues.get(peer_ip)
+            if not queue:
+                return False
+            for item in queue:
+                if item[2] == key:
+                    queue.remove(item)
+                    self.uploads_dropped.inc(reason='cancelled')
+                    return True
+        return False
+
+    def record_download(self, peer_ip, nbytes):
+        """Credit a peer for data it sent us (the tit-for-tat half of the ranking)"""
+        with self._cond:
+            self._downloaded[peer_ip] = self._downloaded.get(peer_ip, 0) + nbytes
+
+    def is_choked(self, peer_ip):
+        with self._cond:
+            return peer_ip not in self._unchoked
+
+    def _unchoke(self, peer_ip):
+        self._unchoked.add(peer_ip)
+        if peer_ip not in self._turn:
+            self._turn.append(peer_ip)
+        self.unchoked_peers.set(len(self._unchoked))
+
+    def _next_job(self):
+        """Pop the next request from an unchoked peer in round-robin order"""
+        now = time.monotonic()
+        for _ in range(len(self._turn)):
+            peer_ip = self._turn[0]
+            self._turn.rotate(-1)
+            if peer_ip not in self._unchoked:
+                continue
+            queue = self._queues.get(peer_ip)
+            while queue:
+                queued_at, job, _ = queue.popleft()
+                if now - queued_at <= self.max_wait:
+                    return peer_ip, job
+                self.uploads_dropped.inc(reason='stale')
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                picked = self._next_job()
+                while picked is None:
+                    self._cond.wait(1.0)
+                    picked = self._next_job()
+            peer_ip, job = picked
+            try:
+                sent = job() or 0
+            except Exception as e:
+                log.warning("upload_failed", peer=peer_ip, error=e)
+                continue
+            self.uploads.inc()
+            with self._cond:
+                self._uploaded[peer_ip] = self._uploaded.get(peer_ip, 0) + sent
+
+    def _rechoke_loop(self):
+        while True:
+            time.sleep(self.rechoke_interval)
+            self.rechoke()
+
+    def rechoke(self):
+        """Recompute the unchoked set from the last interval's transfer rates"""
+        with self._cond:
+            self._rounds += 1
+            interested = [ip for ip, queue in self._queues.items() if queue]
+            ranked = sorted(interested, key=lambda ip: (self._downloaded.get(ip, 0), self._uploaded.get(ip, 0)),
+                            reverse=True)
+            regular = ranked[:max(0, self.slots - 1)]
+            choked = [ip for ip in interested if ip not in regular]
+            if (self._optimistic not in choked or self._rounds % self.optimistic_every == 0) and choked:
+                self._optimistic = random.choice(choked)
+            elif not choked:
+                self._optimistic = None
+
+            unchoked = set(regular)
+            if self._optimistic is not None:
+                unchoked.add(self._optimistic)
+            for ip in ranked:
+                if len(unchoked) >= self.slots:
+                    break
+                unchoked.add(ip)
+
+            newly = unchoked - self._unchoked
+            self._unchoked = set()
+            self._turn = deque(ip for ip in self._turn if ip in unchoked)
+            for ip in unchoked:
+                self._unchoked.add(ip)
+                if ip in newly:
+                    self._turn.append(ip)
+            self.unchoked_peers.set(len(self._unchoked))
+            for ip in [ip for ip, queue in self._queues.items() if not queue]:
+                del self._queues[ip]
+            self._downloaded.clear()
+            self._uploaded.clear()
+            self._cond.notify_all()
+        if newly:
+            log.debug("rechoke", unchoked=','.join(sorted(unchoked)), optimistic=self._optimistic)
@@ -0,0 +1,176 @@
+import base64
+import os
+import threading
+from collections import OrderedDict
+
+from catalog import build_manifest
+from netlog import get_logger
+
+log = get_logger('chunkcache')
+
+
+class ChunkCache:
+    """Prepared chunks of local files, shared by every transfer that sends them.
+
+    Sending a file to 60 peers used to open and read it 60 times and base64
+    the same chunks 60 times. Here chunks are kept under (file version, chunk
+    index) in an LRU bounded by ``budget`` bytes (raw plus encoded), where the
+    version is the file's path, mtime and size, so an edited file is read
+    afresh and nothing has to be hashed before a plain send can start.
+
+    Manifests (the file and per-chunk SHA-256 the catalog publishes) are
+    cached on the same version. Building one reads the whole file, so the
+    chunks read then are kept as well while they fit: a published file within
+    the budget is read from disk once however many peers get it.
+
+    Concurrent callers wanting the same manifest or chunk wait for the one
+    read already in progress instead of starting their own.
+    """
+
+    def __init__(self, network, budget=64 * 1024 * 1024, max_manifests=256):
+        self.network = network
+        self.budget = budget
+        self.max_manifests = max_manifests
+        self._manifests = OrderedDict()  # version -> manifest
+        self._chunks = OrderedDict()  # (version, index) -> [data, encoded or None, key]
+        self._size = 0
+        self._loading = {}  # manifest or chunk key -> [Event set when ready, loaded value]
+        self._lock = threading.Lock()
+        m = network.metrics
+        self.hits = m.counter('p2p_chunk_cache_hits_total', 'Chunk reads served from memory, by kind')
+        self.misses = m.counter('p2p_chunk_cache_misses_total', 'Chunk reads that went to disk, by kind')
+        self.evictions = m.counter('p2p_chunk_cache_evictions_total', 'Chunks dropped to stay within the budget')
+        self.cached_bytes = m.gauge('p2p_chunk_cache_bytes', 'Memory held by cached chunks')
+
+    def version(self, file_path):
+        """(path, mtime_ns, size, chunk_size): what cached data of a file is keyed on"""
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size, self.network.chunk_size
+
+    def manifest(self, file_path):
+        """The manifest of a local file (see catalog.build_manifest), hashed once per version.
+
+        The returned dict is shared; copy it before changing it.
+        """
+        version = self.version(file_path)
+        manifest = self._wait_for(version, self._manifests, 'manifest')
+        if manifest is not None:
+            return manifest
+        blocks = []
+        kept = [0]
+
+        def keep(index, block):
+            # Hold on to what the hashing pass read, up to the budget
+            if kept[0] + len(block) <= self.budget:
+                blocks.append((index, block))
+                kept[0] += len(block)
+
+        try:
+            manifest = build_manifest(version[0], version[3], on_block=keep)
+            with self._lock:
+                self._manifests[version] = manifest
+                while len(self._manifests) > self.max_manifests:
+                    self._manifests.popitem(last=False)
+                for index, block in blocks:
+                    self._store([block, None, (version, index)])
+        finally:
+            self._done(version, manifest)
+        log.debug("manifest_built", file=manifest['name'], size=manifest['size'], cached_chunks=len(blocks))
+        return manifest
+
+    def chunk(self, file_path, index):
+        """Chunk ``index`` of a local file as bytes, or None past its end"""
+        entry = self._entry(file_path, index)
+        return entry[0] if entry else None
+
+    def encoded(self, file_path, index):
+        """Chunk ``index`` of a local file as base64 text, or None past its end"""
+        entry = self._entry(file_path, index)
+        if entry is None:
+            return None
+        if entry[1] is not None:
+            self.hits.inc(kind='encoded')
+            return entry[1]
+        self.misses.inc(kind='encoded')
+        encoded = base64.b64encode(entry[0]).decode('ascii')
+        with self._lock:
+            if entry[1] is None:
+                entry[1] = encoded
+                if self._chunks.get(entry[2]) is entry:
+                    self._size += len(encoded)
+                    self._evict()
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._manifests.clear()
+            self._chunks.clear()
+            self._size = 0
+        self.cached_bytes.set(0)
+
+    def _entry(self, file_path, index):
+        version = self.version(file_path)
+        chunk_size = version[3]
+        if not 0 <= index * chunk_size < version[2]:
+            return None
+        key = (version, index)
+        entry = self._wait_for(key, self._chunks, 'chunk')
+        if entry is not None:
+            return entry
+        self.misses.inc(kind='chunk')
+        try:
+            with open(version[0], 'rb') as f:
+                f.seek(index * chunk_size)
+                entry = [f.read(chunk_size), None, key]
+            with self._lock:
+                self._store(entry)
+        finally:
+            self._done(key, entry)
+        return entry
+
+    def _wait_for(self, key, cache, kind):
+        """The cached value for ``key``, or None after claiming the job of loading it"""
+        while True:
+            with self._lock:
+                value = cache.get(key)
+                if value is not None:
+                    cache.move_to_end(key)
+                    if kind == 'chunk':
+                        self.hits.inc(kind=kind)
+                    return value
+                loading = self._loading.get(key)
+                if loading is None:
+                    self._loading[key] = [threading.Event(), None]
+                    return None
+            loading[0].wait()
+            # Loaded but not kept (larger than the budget) still serves those who waited for it
+            if loading[1] is not None:
+                return loading[1]
+            # The load failed: the next pass claims it
+
+    def _done(self, key, value=None):
+        with self._lock:
+            loading = self._loading.pop(key, None)
+        if loading is not None:
+            loading[1] = value
+            loading[0].set()
+
+    def _store(self, entry):
+        """Add a chunk entry; the caller holds the lock"""
+        size = len(entry[0]) + len(entry[1] or '')
+        if size > self.budget:
+            return
+        previous = self._chunks.pop(entry[2], None)
+        if previous is not None:
+            self._size -= len(previous[0]) + len(previous[1] or '')
+        self._chunks[entry[2]] = entry
+        self._size += size
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.budget and self._chunks:
+            _, old = self._chunks.popitem(last=False)
+            self._size -= len(old[0]) + len(old[1] or '')
+            self.evictions.inc()
+        self.cached_bytes.set(self._size)
@@ -0,0 +1,223 @@
+import base64
+import json
+import threading
+import time
+
+from netlog import get_logger
+
+log = get_logger('delivery')
+
+ACK_PREFIX = "FILE_ACKS|"
+STATE_PREFIX = "CHUNK_STATE|"
+
+PENDING, PARTIAL, COMPLETE, FAILED = 'pending', 'partial', 'complete', 'failed'
+
+
+def _normalise_status(status):
+    """Map legacy ack statuses ('success', 'failed: ...') onto tracker states"""
+    if status in (PENDING, PARTIAL, COMPLETE, FAILED):
+        return status
+    if status == 'success':
+        return COMPLETE
+    if str(status).startswith('failed'):
+        return FAILED
+    return PARTIAL
+
+
+def encode_chunk_set(indices, total):
+    """Chunk numbers as a base64 bitmap, one bit per chunk of the file"""
+    bits = bytearray((total + 7) // 8)
+    for i in indices:
+        if 0 <= i < total:
+            bits[i // 8] |= 1 << (i % 8)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+
+def decode_chunk_set(encoded, total):
+    bits = base64.b64decode(encoded or '')
+    return {i for i in range(min(total, len(bits) * 8)) if bits[i // 8] >> (i % 8) & 1}
+
+
+class AckBatcher:
+    """Coalesces file acknowledgements per destination into one message.
+
+    ``ack(peer_ip, file_name, status, have, total)`` only records the newest
+    status for that file; every ``delay`` seconds the pending acks for each
+    peer go out as a single ``FILE_ACKS|<json list>`` over the pooled message
+    connection, instead of one TCP connection to the ack port per file.
+    Progress acks (``partial`` with chunk counts) therefore cost at most one
+    message per peer per interval however many chunks arrive.
+
+    Batches that cannot be delivered are kept and retried on the next flush,
+    unless a newer status for the same file has been queued meanwhile, until
+    they are ``max_age`` seconds old.
+    """
+
+    def __init__(self, network, delay=0.5, max_age=60.0):
+        self.network = network
+        self.delay = delay
+        self.max_age = max_age
+        self._pending = {}  # peer_ip -> {file_name: ack dict}
+        self._cond = threading.Condition()
+        self._started = False
+        self.acks_sent = network.metrics.counter('p2p_acks_sent_total', 'File acks sent, by status')
+        self.ack_batches = network.metrics.counter('p2p_ack_batches_total', 'FILE_ACKS messages sent')
+
+    def ack(self, peer_ip, file_name, status, have=None, total=None):
+        entry = {'file': file_name, 'status': _normalise_status(status), 'ts': time.time()}
+        if have is not None:
+            entry['have'] = have
+        if total is not None:
+            entry['total'] = total
+        if entry['status'] == FAILED and status != FAILED:
+            entry['reason'] = str(status)
+        with self._cond:
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._flush_loop, name='p2p-acks', daemon=True).start()
+            self._pending.setdefault(peer_ip, {})[file_name] = entry
+            self._cond.notify()
+        return True
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let more acks for the same peers accumulate before sending
+            time.sleep(self.delay)
+            self.flush()
+
+    def flush(self):
+        with self._cond:
+            pending, self._pending = self._pending, {}
+        for peer_ip, entries in pending.items():
+            batch = list(entries.values())
+            if self.network.send_message(peer_ip, ACK_PREFIX + json.dumps(batch)):
+                self.ack_batches.inc()
+                for entry in batch:
+                    self.acks_sent.inc(status=entry['status'])
+                log.debug("acks_sent", peer=peer_ip, count=len(batch))
+                continue
+            cutoff = time.time() - self.max_age
+            with self._cond:
+                queued = self._pending.setdefault(peer_ip, {})
+                for entry in batch:
+                    if entry['ts'] >= cutoff and entry['file'] not in queued:
+                        queued[entry['file']] = entry
+                if not queued:
+                    del self._pending[peer_ip]
+
+
+class DeliveryTracker:
+    """Which student has which file: a per-file x per-peer completion matrix.
+
+    ``expect(file_name, peers)`` is called when a file is sent and marks each
+    peer pending. Acks move entries to ``partial`` (with chunk counts),
+    ``complete`` or ``failed``; they arrive as FILE_ACKS messages through
+    ``handle_peer_message`` or from the legacy ack port through ``record``.
+    ``completion`` and ``stragglers`` summarise a file so it can be re-sent to
+    just the peers that still lack it. ``on_change(file_name, summary)`` is
+    called after every update.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self._files = {}  # file_name -> {'expected_at': t, 'peers': {ip: entry}}
+        self._lock = threading.Lock()
+
+    def expect(self, file_name, peers):
+        now = time.time()
+        with self._lock:
+            record = self._files.setdefault(file_name, {'expected_at': now, 'peers': {}})
+            record['expected_at'] = now
+            for peer_ip in peers:
+                entry = record['peers'].get(peer_ip)
+                if entry is None or entry['state'] != COMPLETE:
+                    record['peers'][peer_ip] = {'state': PENDING, 'have': 0, 'total': None, 'updated': now}
+        self._changed(file_name)
+
+    def record(self, file_name, peer_ip, status, have=None, total=None):
+        state = _normalise_status(status)
+        with self._lock:
+            record = self._files.setdefault(file_name, {'expected_at': time.time(), 'peers': {}})
+            entry = record['peers'].setdefault(peer_ip, {'state': PENDING, 'have': 0, 'total': None})
+            if entry['state'] == COMPLETE and state == PARTIAL:
+                return  # a late progress ack overtaken by the completion
+            entry['state'] = state
+            if total is not None:
+                entry['total'] = total
+            if state == COMPLETE and entry['total'] is not None:
+                entry['have'] = entry['total']
+            elif have is not None:
+                entry['have'] = have
+            entry['updated'] = time.time()
+        log.sample("delivery_ack", every=20, peer=peer_ip, file=file_name, state=state)
+        self._changed(file_name)
+
+    def handle_peer_message(self, message, sender_address):
+        """Record a FILE_ACKS batch, returning False for any other message"""
+        if not message.startswith(ACK_PREFIX):
+            return False
+        try:
+            batch = json.loads(message[len(ACK_PREFIX):])
+        except ValueError as e:
+            log.warning("ack_batch_invalid", peer=sender_address[0], error=e)
+            return True
+        for entry in batch:
+            self.record(entry.get('file', 'unknown'), sender_address[0], entry.get('status'),
+                        entry.get('have'), entry.get('total'))
+        return True
+
+    def forget_peer(self, peer_ip):
+        """Stop expecting files for a peer that left the session"""
+        with self._lock:
+            files = [name for name, record in self._files.items() if record['peers'].pop(peer_ip, None)]
+        for file_name in files:
+            self._changed(file_name)
+
+    def matrix(self):
+        """{file_name: {peer_ip: state}}"""
+        with self._lock:
+            return {name: {ip: entry['state'] for ip, entry in record['peers'].items()}
+                    for name, record in self._files.items()}
+
+    def completion(self, file_name):
+        """Fraction of the expected peers holding the whole file (chunk-weighted for partial ones)"""
+        with self._lock:
+            record = self._files.get(file_name)
+            if not record or not record['peers']:
+                return 0.0
+            done = 0.0
+            for entry in record['peers'].values():
+                if entry['state'] == COMPLETE:
+                    done += 1
+                elif entry['state'] == PARTIAL and entry['total']:
+                    done += entry['have'] / entry['total']
+            return done / len(record['peers'])
+
+    def stragglers(self, file_name, min_age=0.0):
+        """Peers without the whole file ``min_age`` seconds after it was sent"""
+        with self._lock:
+            record = self._files.get(file_name)
+            if not record or time.time() - record['expected_at'] < min_age:
+                return []
+            return sorted(ip for ip, entry in record['peers'].items() if entry['state'] != COMPLETE)
+
+    def summary(self, file_name):
+        with self._lock:
+            record = self._files.get(file_name) or {'peers': {}}
+            states = [entry['state'] for entry in record['peers'].values()]
+        return {
+            'file_name': file_name,
+            'peers': len(states),
+            'complete': states.count(COMPLETE),
+            'partial': states.count(PARTIAL),
+            'pending': states.count(PENDING),
+            'failed': states.count(FAILED),
+            'percent': self.completion(file_name) * 100,
+        }
+
+    def _changed(self, file_name):
+        if self.on_change:
+            self.on_change(file_name, self.summary(file_name))
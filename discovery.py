@@ -0,0 +1,181 @@
+import random
+import threading
+import time
+import uuid
+
+from netlog import get_logger
+
+log = get_logger('discovery')
+
+
+class DiscoveryService:
+    """Announces this node on the LAN and turns announcements and replies into peers.
+
+    Announcements (``DISCOVER_PEER|<node id>``) go out from the discovery socket so
+    the ``PEER_ACK`` replies come back to it and populate the peer table: a node
+    that just started learns the whole class from one broadcast round trip.
+
+    The announce loop starts at ``base_interval`` and doubles the (jittered) gap
+    each round the peer set stays unchanged, up to ``max_interval``; any change in
+    membership or an explicit ``trigger()`` drops it back to the base. Announces
+    closer together than ``min_gap`` are coalesced, and each peer gets at most one
+    PEER_ACK per ``reply_interval`` however often it announces.
+    """
+
+    def __init__(self, network, base_interval=1.0, max_interval=60.0, min_gap=0.5,
+                 reply_interval=1.0, jitter=0.2):
+        self.network = network
+        self.node_id = uuid.uuid4().hex[:12]
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.min_gap = min_gap
+        self.reply_interval = reply_interval
+        self.jitter = jitter
+        self.interval = base_interval
+
+        self._changed = True
+        self._last_announce = 0.0
+        self._last_reply = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+
+        m = network.metrics
+        self.announces_sent = m.counter('p2p_discovery_announces_total', 'Discovery announcements sent')
+        self.datagrams_received = m.counter('p2p_discovery_received_total', 'Discovery datagrams received, by kind')
+        self.replies_suppressed = m.counter('p2p_discovery_replies_suppressed_total', 'PEER_ACK replies skipped as duplicates')
+
+        network.peers.subscribe(self._on_peer_change)
+
+    def _on_peer_change(self, event, info):
+        if event in ('added', 'expired', 'removed'):
+            with self._lock:
+                self._changed = True
+
+    def start(self):
+        """Run the periodic announce loop in a daemon thread (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def trigger(self):
+        """Announce now and restart the backoff, e.g. when the user clicks refresh"""
+        with self._lock:
+            self._changed = True
+        if not self._started:
+            self.announce()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self.announce()
+            with self._lock:
+                changed, self._changed = self._changed, False
+            if changed:
+                self.interval = self.base_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * 2)
+            delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def broadcast_targets(self):
+        """Directed broadcast address of every local interface (or of the bound one)"""
+        port = self.network.port
+        interfaces = self.network.interfaces
+        if self.network.host:
+            interface = interfaces.by_address(self.network.host)
+            if interface is not None and not interface.loopback:
+                return [(interface.broadcast, port)]
+            return [("<broadcast>", port)]
+        targets = [(address, port) for address in interfaces.broadcast_targets()]
+        return targets or [("<broadcast>", port)]
+
+    def announce(self):
+        """Broadcast DISCOVER_PEER unless we already did within ``min_gap``"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_announce < self.min_gap:
+                return False
+            self._last_announce = now
+        payload = f"DISCOVER_PEER|{self.node_id}".encode('utf-8')
+        sent = 0
+        for target in self.broadcast_targets():
+            try:
+                self.network.socket.sendto(payload, target)
+                sent += 1
+            except Exception as e:
+                log.warning("announce_failed", target=target[0], error=e)
+        self.announces_sent.inc(sent)
+        log.debug("announce", targets=sent, interval=round(self.interval, 2), peers=len(self.network.peers))
+        return sent > 0
+
+    def heartbeat(self):
+        """Tell every known peer we are alive with one datagram per broadcast domain.
+
+        Peers on a subnet we broadcast to hear the broadcast; only the ones
+        outside those subnets (routed peers added by hand, loopback) get a
+        unicast copy, so a lab of N laptops sends N heartbeats per interval
+        rather than N * N.
+        """
+        payload = f"HEARTBEAT|{self.node_id}".encode('utf-8')
+        targets = self.broadcast_targets()
+        broadcasts = {address for address, _ in targets}
+        for peer_ip in self.network.peers.ips(include_down=True):
+            interface = self.network.interfaces.for_ip(peer_ip)
+            if interface is None or interface.loopback or interface.broadcast not in broadcasts:
+                targets.append((peer_ip, self.network.port))
+        sent = 0
+        for target in targets:
+            try:
+                self.network.socket.sendto(payload, target)
+                sent += 1
+            except Exception as e:
+                log.debug("heartbeat_failed", target=target[0], error=e)
+        return sent
+
+    def probe(self, targets):
+        """Unicast DISCOVER_PEER to known addresses, bypassing the broadcast rate limit"""
+        payload = f"DISCOVER_PEER|{self.node_id}".encode('utf-8')
+        sent = 0
+        for target in targets:
+            try:
+                self.network.socket.sendto(payload, target)
+                sent += 1
+            except Exception as e:
+                log.debug("probe_failed", target=target[0], error=e)
+        self.announces_sent.inc(sent)
+        log.info("probe", targets=sent)
+        return sent
+
+    def _should_reply(self, peer_ip):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_reply.get(peer_ip, 0.0) < self.reply_interval:
+                return False
+            self._last_reply[peer_ip] = now
+            if len(self._last_reply) > 4096:
+                cutoff = now - self.reply_interval
+                self._last_reply = {ip: t for ip, t in self._last_reply.items() if t >= cutoff}
+        return True
+
+    def handle_datagram(self, message, address):
+        """Process one datagram received on the discovery socket"""
+        kind, _, node_id = message.partition('|')
+        self.datagrams_received.inc(kind=kind if kind in ('DISCOVER_PEER', 'PEER_ACK', 'HEARTBEAT') else 'other')
+        if node_id == self.node_id:
+            return  # our own broadcast looping back
+
+        if kind == "DISCOVER_PEER":
+            self.network._peer_seen(kind, address, node_id or None)
+            if self._should_reply(address[0]):
+                # Send response to let the peer know we exist
+                self.network.socket.sendto(f"PEER_ACK|{self.node_id}".encode('utf-8'), address)
+            else:
+                self.replies_suppressed.inc()
+        elif kind in ("PEER_ACK", "HEARTBEAT"):
+            self.network._peer_seen(kind, address, node_id or None)
+        else:
+            self.network.peers.refresh(address[0])
@@ -0,0 +1,57 @@
+import threading
+
+from PyQt5.QtCore import QObject, QTimer
+
+
+class GuiBridge(QObject):
+    """Hands network events to the GUI thread in batches at a fixed frame rate.
+
+    Network threads call ``post(kind, payload)`` for events that all need
+    showing (log lines, peers coming and going) and ``latest(kind, key, payload)``
+    for state where only the newest value per key matters (transfer progress).
+    Both only append to a buffer under a lock; no Qt signal is emitted per event.
+    A timer in the GUI thread flushes every ``1000 / rate`` ms, calling each
+    handler registered with ``subscribe(kind, handler)`` once with the list of
+    payloads gathered since the last frame, in arrival order.
+
+    Create it from the GUI thread.
+    """
+
+    def __init__(self, rate=20, parent=None):
+        super().__init__(parent)
+        self._handlers = {}
+        self._events = []
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(1000 / rate))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def subscribe(self, kind, handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def post(self, kind, payload):
+        """Queue an event; safe to call from any thread"""
+        with self._lock:
+            self._events.append((kind, payload))
+
+    def latest(self, kind, key, payload):
+        """Queue a value that replaces any not yet flushed one for the same key"""
+        with self._lock:
+            self._latest[(kind, key)] = payload
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+            latest, self._latest = self._latest, {}
+        if not events and not latest:
+            return
+        batches = {}
+        for kind, payload in events:
+            batches.setdefault(kind, []).append(payload)
+        for (kind, _), payload in latest.items():
+            batches.setdefault(kind, []).append(payload)
+        for kind, payloads in batches.items():
+            for handler in self._handlers.get(kind, []):
+                handler(payloads)
@@ -0,0 +1,170 @@
+import ipaddress
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from netlog import get_logger
+
+log = get_logger('interfaces')
+
+# Linux ioctl request numbers and interface flags
+SIOCGIFFLAGS = 0x8913
+SIOCGIFADDR = 0x8915
+SIOCGIFBRDADDR = 0x8919
+SIOCGIFNETMASK = 0x891b
+IFF_UP = 0x1
+IFF_BROADCAST = 0x2
+IFF_LOOPBACK = 0x8
+
+
+class Interface:
+    """One local IPv4 interface with its real netmask and broadcast address"""
+
+    def __init__(self, name, address, netmask, broadcast=None, wireless=False, speed=None, loopback=False):
+        self.name = name
+        self.address = address
+        self.netmask = netmask
+        self.network = ipaddress.IPv4Network(f"{address}/{netmask}", strict=False)
+        self.broadcast = broadcast or str(self.network.broadcast_address)
+        self.wireless = wireless
+        self.speed = speed  # Mbit/s when the OS reports it
+        self.loopback = loopback
+
+    @property
+    def rank(self):
+        """Sort key for link preference: wired before wireless, then faster first"""
+        return (self.wireless, -(self.speed or 0))
+
+    def contains(self, ip):
+        try:
+            return ipaddress.IPv4Address(ip) in self.network
+        except ValueError:
+            return False
+
+    def __repr__(self):
+        kind = 'wifi' if self.wireless else 'wired'
+        return f"Interface({self.name} {self.address}/{self.network.prefixlen} brd {self.broadcast} {kind} {self.speed})"
+
+
+def _read_sys(name, field):
+    try:
+        with open(f"/sys/class/net/{name}/{field}") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _linux_interfaces():
+    import fcntl
+
+    result = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            ifreq = struct.pack('256s', name.encode('utf-8')[:15])
+
+            def query(request):
+                return fcntl.ioctl(s.fileno(), request, ifreq)
+
+            try:
+                flags = struct.unpack('H', query(SIOCGIFFLAGS)[16:18])[0]
+                if not flags & IFF_UP:
+                    continue
+                address = socket.inet_ntoa(query(SIOCGIFADDR)[20:24])
+                netmask = socket.inet_ntoa(query(SIOCGIFNETMASK)[20:24])
+                broadcast = socket.inet_ntoa(query(SIOCGIFBRDADDR)[20:24]) if flags & IFF_BROADCAST else None
+            except OSError:
+                continue  # no IPv4 address on this interface
+            speed = _read_sys(name, 'speed')
+            result.append(Interface(
+                name, address, netmask, broadcast,
+                wireless=os.path.isdir(f"/sys/class/net/{name}/wireless"),
+                speed=int(speed) if speed and speed.lstrip('-').isdigit() and int(speed) > 0 else None,
+                loopback=bool(flags & IFF_LOOPBACK),
+            ))
+    return result
+
+
+def _psutil_interfaces():
+    import psutil
+
+    stats = psutil.net_if_stats()
+    result = []
+    for name, addrs in psutil.net_if_addrs().items():
+        stat = stats.get(name)
+        if stat is not None and not stat.isup:
+            continue
+        for addr in addrs:
+            if addr.family != socket.AF_INET or not addr.netmask:
+                continue
+            lowered = name.lower()
+            result.append(Interface(
+                name, addr.address, addr.netmask, addr.broadcast,
+                wireless=any(tag in lowered for tag in ('wi-fi', 'wifi', 'wlan', 'wireless', 'airport')),
+                speed=stat.speed if stat is not None and stat.speed > 0 else None,
+                loopback=addr.address.startswith('127.'),
+            ))
+    return result
+
+
+def _guessed_interfaces():
+    # Last resort, the old behaviour: assume the host address sits on a /24
+    try:
+        address = socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return []
+    return [Interface('default', address, '255.255.255.0', loopback=address.startswith('127.'))]
+
+
+def list_interfaces():
+    """Enumerate up IPv4 interfaces using sysfs/ioctl on Linux, psutil if installed, or a /24 guess"""
+    if sys.platform.startswith('linux'):
+        try:
+            return _linux_interfaces()
+        except Exception as e:
+            log.debug("ioctl_enumeration_failed", error=e)
+    try:
+        return _psutil_interfaces()
+    except ImportError:
+        pass
+    except Exception as e:
+        log.debug("psutil_enumeration_failed", error=e)
+    return _guessed_interfaces()
+
+
+class InterfaceTable:
+    """Cached view of local interfaces, refreshed every ``ttl`` seconds"""
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self._interfaces = []
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+
+    def all(self):
+        with self._lock:
+            if time.monotonic() - self._loaded > self.ttl:
+                self._interfaces = list_interfaces()
+                self._loaded = time.monotonic()
+                log.debug("interfaces", found=len(self._interfaces),
+                          names=','.join(i.name for i in self._interfaces))
+            return list(self._interfaces)
+
+    def broadcast_targets(self):
+        """Directed broadcast address of every non-loopback interface"""
+        return sorted({i.broadcast for i in self.all() if not i.loopback and i.broadcast})
+
+    def for_ip(self, ip):
+        """Best local interface on the same subnet as ``ip`` (None if it is routed)"""
+        matches = [i for i in self.all() if i.contains(ip)]
+        if not matches:
+            return None
+        return min(matches, key=lambda i: i.rank)
+
+    def by_address(self, address):
+        for interface in self.all():
+            if interface.address == address:
+                return interface
+        return None
@@ -0,0 +1,168 @@
+from collections import deque
+
+from PyQt5.QtCore import QAbstractListModel, QAbstractTableModel, QModelIndex, Qt, QTimer
+
+
+class PeerListModel(QAbstractListModel):
+    """Peer addresses for a QListView, with O(1) membership checks"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._peers = []
+        self._rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._peers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self._peers[index.row()]
+        return None
+
+    def __contains__(self, ip):
+        return ip in self._rows
+
+    def __len__(self):
+        return len(self._peers)
+
+    def add(self, ip):
+        """Append a peer, returning False if it is already listed"""
+        if ip in self._rows:
+            return False
+        row = len(self._peers)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._peers.append(ip)
+        self._rows[ip] = row
+        self.endInsertRows()
+        return True
+
+    def remove(self, ip):
+        row = self._rows.pop(ip, None)
+        if row is None:
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._peers[row]
+        for later in self._peers[row:]:
+            self._rows[later] -= 1
+        self.endRemoveRows()
+        return True
+
+
+class FileTableModel(QAbstractTableModel):
+    """Shared files (name, size, sender, status) indexed by name.
+
+    The raw size in bytes is available under ``Qt.UserRole`` on every column.
+    """
+
+    HEADERS = ("Name", "Size", "Shared By", "Status")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._files = []
+        self._rows = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._files)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self._files[index.row()]
+        if role == Qt.DisplayRole:
+            return entry[index.column()]
+        if role == Qt.UserRole:
+            return entry[4]
+        return None
+
+    def file_name(self, row):
+        return self._files[row][0]
+
+    def status(self, name):
+        row = self._rows.get(name)
+        return self._files[row][3] if row is not None else None
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def add_or_update(self, name, size, sender, raw_size, status=""):
+        """Add a file, or refresh its row if a file of that name is already listed"""
+        entry = (name, size, sender, status, raw_size)
+        row = self._rows.get(name)
+        if row is not None:
+            self._files[row] = entry
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+            return
+        row = len(self._files)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._files.append(entry)
+        self._rows[name] = row
+        self.endInsertRows()
+
+    def set_status(self, name, status):
+        row = self._rows.get(name)
+        if row is None:
+            return
+        self._files[row] = self._files[row][:3] + (status,) + self._files[row][4:]
+        column = self.HEADERS.index("Status")
+        self.dataChanged.emit(self.index(row, column), self.index(row, column))
+
+
+class LogModel(QAbstractListModel):
+    """Ring buffer of the last ``max_lines`` log lines for a QListView"""
+
+    def __init__(self, max_lines=5000, parent=None):
+        super().__init__(parent)
+        self._lines = deque(maxlen=max_lines)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._lines)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self._lines[index.row()]
+        return None
+
+    def append(self, lines):
+        """Append one line or a batch of lines, dropping the oldest past ``max_lines``"""
+        if isinstance(lines, str):
+            lines = [lines]
+        lines = list(lines)[-self._lines.maxlen:]
+        if not lines:
+            return
+        overflow = len(self._lines) + len(lines) - self._lines.maxlen
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for _ in range(overflow):
+                self._lines.popleft()
+            self.endRemoveRows()
+        first = len(self._lines)
+        self.beginInsertRows(QModelIndex(), first, first + len(lines) - 1)
+        self._lines.extend(lines)
+        self.endInsertRows()
+
+
+def follow_tail(view):
+    """Keep ``view`` scrolled to its newest row while the user is at the bottom.
+
+    Scrolling lays the view out again, so it happens at most once per pass of
+    the event loop however many rows were inserted.
+    """
+    timer = QTimer(view)
+    timer.setSingleShot(True)
+    timer.setInterval(0)
+    timer.timeout.connect(view.scrollToBottom)
+
+    def on_rows_inserted(*_):
+        bar = view.verticalScrollBar()
+        if bar.value() >= bar.maximum() - 1 and not timer.isActive():
+            timer.start()
+
+    view.model().rowsInserted.connect(on_rows_inserted)
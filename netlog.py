@@ -0,0 +1,163 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+ROOT_LOGGER = 'gehu_p2p'
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    """Renders the event name followed by its fields, as key=value pairs or a JSON object"""
+
+    def __init__(self, as_json=False):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s %(message)s')
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        if self.as_json:
+            payload = {
+                'ts': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'event': record.getMessage(),
+            }
+            payload.update(fields)
+            if record.exc_info:
+                payload['exc'] = self.formatException(record.exc_info)
+            elif record.exc_text:
+                payload['exc'] = record.exc_text
+            return json.dumps(payload, default=str)
+        line = super().format(record)
+        if fields:
+            # Fields belong on the event's line, ahead of any traceback
+            head, newline, rest = line.partition('\n')
+            line = head + ' ' + ' '.join(f"{k}={v}" for k, v in fields.items()) + newline + rest
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queues records with the traceback kept as text in ``exc_text``.
+
+    The stock handler folds the traceback into the message and clears the
+    exception before queueing, which left the JSON ``exc`` field empty.
+    """
+
+    _exceptions = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exceptions.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def configure_logging(level=None, stream=None, as_json=None):
+    """Route all PeerNetwork logging through a queue drained by a background thread.
+
+    Network threads only pay for putting a record on the queue; formatting and
+    the actual write happen on the listener thread. Level and format default to
+    the GEHU_P2P_LOG_LEVEL and GEHU_P2P_LOG_FORMAT (``text``/``json``) variables.
+    """
+    global _listener
+    with _setup_lock:
+        if level is None:
+            level = os.environ.get('GEHU_P2P_LOG_LEVEL', 'INFO')
+        if as_json is None:
+            as_json = os.environ.get('GEHU_P2P_LOG_FORMAT', 'text') == 'json'
+
+        root = logging.getLogger(ROOT_LOGGER)
+        invalid_level = None
+        try:
+            root.setLevel(level.upper() if isinstance(level, str) else level)
+        except (ValueError, TypeError):
+            # A typo in the environment must not stop the application from starting
+            invalid_level = level
+            root.setLevel(logging.INFO)
+        root.propagate = False
+
+        if _listener is not None:
+            _listener.stop()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+
+        output = logging.StreamHandler(stream)
+        output.setFormatter(StructuredFormatter(as_json=as_json))
+        records = queue.SimpleQueue()
+        root.addHandler(_QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+    if invalid_level is not None:
+        StructLogger('netlog').warning("log_level_invalid", value=invalid_level, using='INFO')
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+class StructLogger:
+    """Thin wrapper over a stdlib logger taking an event name plus keyword fields.
+
+    Fields are only attached when the level is enabled, and ``sample`` lets
+    per-chunk events be logged once every N occurrences instead of every time.
+    """
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+
+    def is_enabled(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def log(self, level, event, exc_info=False, **fields):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def sample(self, event, every=100, level=logging.DEBUG, **fields):
+        """Log the first occurrence of ``event`` and then one in every ``every``"""
+        if not self._logger.isEnabledFor(level):
+            return
+        with self._counts_lock:
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+        if count % every == 0:
+            fields['seen'] = count + 1
+            self._logger.log(level, event, extra={'fields': fields})
+
+
+def get_logger(name):
+    if _listener is None:
+        configure_logging()
+    return StructLogger(name)
@@ -1,26 +1,152 @@
+import atexit
 import socket
 import threading
 import os
 import json
 import time
 import base64
+from pacing import AIMDPacer, make_pacer
+from telemetry import ProgressTracker
+from netlog import get_logger
+from metrics import MetricsRegistry, start_metrics_server
+from peers import PeerTable, PeerUnreachableError
+from concurrent.futures import ThreadPoolExecutor
+from discovery import DiscoveryService
+from interfaces import InterfaceTable
+from peercache import PeerCache
+from relay import RelayForwarder
+from delivery import AckBatcher, STATE_PREFIX, decode_chunk_set
+from catalog import FileCatalog
+from chunkcache import ChunkCache
+from pool import (ConnectionPool, SocketReader, MAGIC, FRAME_MESSAGE, FRAME_REQUEST,
+                  encode_reply, gather)
+
+log = get_logger('network')
 
 class PeerNetwork:
-    def __init__(self, port=8080, file_port=8081, on_peer_discovered=None, on_file_received=None, on_message_received=None, on_file_ack=None):
+    def __init__(self, port=8080, file_port=8081, on_peer_discovered=None, on_file_received=None, on_message_received=None, on_file_ack=None, pacing='adaptive',
+                 on_transfer_progress=None, progress_interval=0.25, metrics=None,
+                 host='', message_port=50008, ack_port=50010,
+                 on_peer_lost=None, heartbeat_interval=5.0, peer_expiry=20.0, peer_cache=None,
+                 on_catalog_change=None, chunk_cache_budget=64 * 1024 * 1024):
+        self.host = host  # Local address to bind and send from, '' for all interfaces
         self.port = port
         self.file_port = file_port
-        self.message_port = 50008
-        self.ack_port = 50010
+        self.message_port = message_port
+        self.ack_port = ack_port
         self.on_peer_discovered = on_peer_discovered
         self.on_file_received = on_file_received
         self.on_message_received = on_message_received
         self.on_file_ack = on_file_ack
-        self.peers = []
+        self.on_peer_lost = on_peer_lost
+        self.heartbeat_interval = heartbeat_interval
+        self.peers = PeerTable(expiry=peer_expiry)
+        self.peers.subscribe(self._on_peer_change)
+        self.pool = ConnectionPool(self)
+        self.request_handlers = {}
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='p2p-send')
         self.chunk_size = 1024 * 512
+        self.pacing = pacing
+        self._pacers = {}  # peer_ip -> AIMDPacer kept across transfers to that peer
+        self._pacers_lock = threading.Lock()
+        self.progress = ProgressTracker(callback=on_transfer_progress, interval=progress_interval)
+        self.transfer_idle_timeout = 120.0  # transfers without progress for this long are finished as stalled
+        self.metrics = metrics or MetricsRegistry()
+        self._init_metrics()
 
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(('', self.port))
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.socket.bind((self.host, self.port))
+        self.interfaces = InterfaceTable()
+        self.discovery = DiscoveryService(self)
+        self.relay = RelayForwarder(self)
+        self.acks = AckBatcher(self)
+        self.chunk_cache = ChunkCache(self, budget=chunk_cache_budget)
+        self.catalog = FileCatalog(self, on_change=on_catalog_change)
+
+        # peer_cache: None for the default file, a path, a PeerCache, or False to disable
+        if peer_cache is None or isinstance(peer_cache, (str, os.PathLike)):
+            peer_cache = PeerCache(peer_cache)
+        self.peer_cache = peer_cache or None
+        if self.peer_cache:
+            atexit.register(self.peer_cache.save, self.peers, True)
+
+    def _init_metrics(self):
+        m = self.metrics
+        self.bytes_sent = m.counter('p2p_bytes_sent_total', 'Payload bytes sent, by transfer kind')
+        self.bytes_received = m.counter('p2p_bytes_received_total', 'Payload bytes received, by transfer kind')
+        self.chunks_sent = m.counter('p2p_chunks_sent_total', 'File chunks acknowledged by a peer')
+        self.chunks_received = m.counter('p2p_chunks_received_total', 'File chunks received')
+        self.chunk_retries = m.counter('p2p_chunk_retries_total', 'Chunk send attempts after a failure')
+        self.connection_failures = m.counter('p2p_connection_failures_total', 'Outgoing TCP connects that failed, by purpose')
+        self.breaker_skips = m.counter('p2p_breaker_skips_total', 'Connects skipped because the peer was marked unreachable')
+        self.handshake_seconds = m.histogram('p2p_handshake_seconds', 'TCP connect time to a peer, by purpose')
+        self.chunk_latency_seconds = m.histogram('p2p_chunk_latency_seconds', 'Time from chunk connect to peer ack')
+        self.handler_seconds = m.histogram('p2p_handler_seconds', 'Time spent handling an incoming connection, by handler')
+        self.assembly_seconds = m.histogram('p2p_assembly_seconds', 'Time to assemble a file from its chunks')
+
+    def start_metrics_server(self, port=9464, host='127.0.0.1'):
+        """Expose this node's metrics over HTTP (/metrics in Prometheus text, /metrics.json)"""
+        server = start_metrics_server(self.metrics, port=port, host=host)
+        log.info("metrics_server_started", host=host, port=port)
+        return server
+
+    def _connect(self, peer_ip, port, timeout, purpose):
+        """Open a TCP connection to a peer, recording handshake time and failures.
+
+        The connect itself uses the peer's adaptive timeout (``timeout`` at most);
+        ``timeout`` then applies to I/O on the returned socket. Peers whose circuit
+        breaker is open are refused straight away with PeerUnreachableError.
+        """
+        if not self.peers.is_reachable(peer_ip):
+            self.breaker_skips.inc(purpose=purpose)
+            raise PeerUnreachableError(f"{peer_ip} is marked unreachable")
+        start = time.perf_counter()
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.settimeout(self.peers.connect_timeout(peer_ip, timeout))
+        try:
+            if self.host:
+                s.bind((self.host, 0))
+            else:
+                # Leave through the interface the peer was discovered on
+                info = self.peers.get(peer_ip)
+                if info is not None and info.local_address:
+                    s.bind((info.local_address, 0))
+            s.connect((peer_ip, port))
+        except Exception:
+            s.close()
+            self.connection_failures.inc(purpose=purpose)
+            self.peers.record_failure(peer_ip)
+            raise
+        rtt = time.perf_counter() - start
+        self.handshake_seconds.observe(rtt, purpose=purpose)
+        self.peers.record_rtt(peer_ip, rtt)
+        s.settimeout(timeout)
+        return s
+
+    def fan_out(self, func, peers=None, max_workers=16):
+        """Call ``func(peer_ip)`` for every reachable peer concurrently, returning {peer_ip: result}.
+
+        Exceptions are returned as the peer's result. Dead peers only cost their own
+        (adaptive) connect timeout instead of adding up one after another.
+        """
+        targets = list(self.peers if peers is None else peers)
+        if not targets:
+            return {}
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as pool:
+            futures = {peer_ip: pool.submit(func, peer_ip) for peer_ip in targets}
+            for peer_ip, future in futures.items():
+                try:
+                    results[peer_ip] = future.result()
+                except Exception as e:
+                    results[peer_ip] = e
+        return results
+
+    def _run_handler(self, name, handler, conn, addr):
+        with self.handler_seconds.time(handler=name):
+            handler(conn, addr)
 
     def split_file_into_chunks(self, file_path):
         with open(file_path, 'rb') as f:
@@ -29,14 +155,48 @@ class PeerNetwork:
         return chunks
     
 
+    def send_message(self, peer_ip, message, timeout=5):
+        """Send a message to a specific peer over a pooled TCP connection"""
+        try:
+            data = message.encode('utf-8')
+            self.pool.exchange(peer_ip, FRAME_MESSAGE, data, timeout)
+            self.bytes_sent.inc(len(data), kind='message')
+            log.sample("message_sent", every=50, peer=peer_ip, size=len(data), kind=message[:16].split('|', 1)[0])
+            return True
+        except Exception as e:
+            log.warning("message_send_failed", peer=peer_ip, error=e)
+            return False
+
+    def request(self, peer_ip, message, timeout=5):
+        """Send a message and wait for the peer's reply (see register_request_handler)"""
+        data = message.encode('utf-8')
+        reply = self.pool.exchange(peer_ip, FRAME_REQUEST, data, timeout)
+        self.bytes_sent.inc(len(data), kind='message')
+        self.bytes_received.inc(len(reply), kind='message')
+        return reply.decode('utf-8')
+
+    def register_request_handler(self, prefix, handler):
+        """Answer requests starting with ``prefix`` with ``handler(message, addr) -> str``"""
+        self.request_handlers[prefix] = handler
+
+    def broadcast(self, message, peers=None, timeout=5):
+        """Send a message to every reachable peer concurrently without blocking the caller.
+
+        Returns a Future resolving to a BroadcastResult.
+        """
+        targets = list(self.peers if peers is None else peers)
+        futures = {peer_ip: self._executor.submit(self.send_message, peer_ip, message, timeout)
+                   for peer_ip in targets}
+        return gather(futures)
+
     def listen_for_messages(self):
-        print(f" Listening for messages on TCP port {self.message_port}...")
+        log.info("listening_messages", port=self.message_port)
         msg_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         msg_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         try:
-            msg_socket.bind(('', self.message_port))
-            msg_socket.listen(5)
+            msg_socket.bind((self.host, self.message_port))
+            msg_socket.listen(64)
 
             while True:
                 try:
@@ -45,172 +205,396 @@ class PeerNetwork:
                     thread.daemon = True
                     thread.start()
                 except Exception as e:
-                    print(f" Error accepting message connection: {e}")
+                    log.error("message_accept_failed", error=e)
         except Exception as e:
-            print(f" Error setting up message listener: {e}")
+            log.error("message_listener_failed", port=self.message_port, error=e)
+
+    def _dispatch_message(self, data, addr, is_request=False):
+        """Hand one message to the application, returning the reply for requests"""
+        self.bytes_received.inc(len(data), kind='message')
+        message = data.decode('utf-8')
+        log.sample("message_received", every=50, peer=addr[0], size=len(data), kind=message[:16].split('|', 1)[0])
+        with self.handler_seconds.time(handler='message'):
+            if is_request:
+                for prefix, handler in self.request_handlers.items():
+                    if message.startswith(prefix):
+                        return handler(message, addr) or ''
+            elif self.catalog.handle_peer_message(message, addr):
+                return ''
+            if self.on_message_received:
+                reply = self.on_message_received(message, addr)
+                return reply if is_request and isinstance(reply, str) else ''
+        return ''
 
     def _handle_message(self, conn, addr):
         try:
-            data = conn.recv(4096)
+            # Idle pooled connections are closed by the sender; this only reclaims abandoned ones
+            conn.settimeout(300)
+            reader = SocketReader(conn)
+            head = b''
+            while len(head) < len(MAGIC):
+                part = conn.recv(len(MAGIC) - len(head))
+                if not part:
+                    break
+                head += part
+                if not MAGIC.startswith(head):
+                    break
+
+            if head == MAGIC:
+                while True:
+                    frame = reader.read_frame()
+                    if frame is None:
+                        break
+                    kind, payload = frame
+                    if kind == FRAME_REQUEST:
+                        try:
+                            reply = self._dispatch_message(payload, addr, is_request=True)
+                        except Exception as e:
+                            log.error("request_handler_failed", peer=addr[0], error=e)
+                            reply = ''
+                        conn.sendall(encode_reply(reply.encode('utf-8')))
+                    else:
+                        # Ack on receipt so the sender isn't held up by our handler
+                        conn.sendall(encode_reply())
+                        try:
+                            self._dispatch_message(payload, addr)
+                        except Exception as e:
+                            log.error("message_handler_failed", peer=addr[0], error=e)
+                return
+
+            # Legacy format: one message per connection, delimited by the sender closing it
+            parts = [head]
+            while True:
+                part = conn.recv(65536)
+                if not part:
+                    break
+                parts.append(part)
+            data = b''.join(parts)
             if data:
-                message = data.decode('utf-8')
-                print(f" Received message from {addr[0]}: {message}")
-                if self.on_message_received:
-                    self.on_message_received(message, addr)
+                self._dispatch_message(data, addr)
         except Exception as e:
-            print(f" Error handling message: {e}")
+            log.error("message_handler_failed", peer=addr[0], error=e)
         finally:
             conn.close()
 
+    def send_file_chunks(self, file_path, peer_ip, pacing=None, retries=2, indices=None, relay=None):
+        """Send a file to a peer one chunk per connection, paced from chunk ack latency.
 
-    def send_file_chunks(self, file_path, peer_ip):
+        ``indices`` limits the transfer to a subset of chunk numbers. ``relay`` is
+        the peer's subtree in a distribution tree (see relay.TreeDistributor); the
+        peer forwards each chunk to it as it arrives.
+        """
         file_name = os.path.basename(file_path)
-        chunks = self.split_file_into_chunks(file_path)
-        total_chunks = len(chunks)
+        # Chunks come from the shared cache, so a fan-out reads and encodes the file once
+        file_size = os.path.getsize(file_path)
+        total_chunks = -(-file_size // self.chunk_size)
+        selected = range(total_chunks) if indices is None else sorted(i for i in set(indices) if 0 <= i < total_chunks)
+        pacer = self._pacer_for(peer_ip, pacing)
+        delivered = 0
+        transfer_id = self.progress.start('send', peer_ip, file_name,
+                                          total_bytes=sum(self._chunk_length(file_size, i) for i in selected),
+                                          total_chunks=len(selected))
+
+        for n, i in enumerate(selected):
+            chunk_size = self._chunk_length(file_size, i)
+            chunk_data = self.chunk_cache.encoded(file_path, i)
+            if chunk_data is None:
+                break  # the file shrank while we were sending it
+            fields = {
+                'file_name': file_name,
+                'chunk_index': i,
+                'total_chunks': total_chunks,
+                'chunk_size': chunk_size,
+                'chunk_data': chunk_data,
+                'timestamp': time.time()
+            }
+            if relay:
+                fields['relay'] = relay
+            header = json.dumps(fields).encode('utf-8') + b'\n'
 
-        for i, chunk in enumerate(chunks):
             try:
-                header = json.dumps({
-                    'file_name': file_name,
-                    'chunk_index': i,
-                    'total_chunks': total_chunks,
-                    'chunk_size': len(chunk),
-                    'chunk_data': base64.b64encode(chunk).decode('utf-8'),
-                    'timestamp': time.time()
-                })
-
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(10)
-                    s.connect((peer_ip, self.file_port))
-                    s.sendall(header.encode('utf-8') + b'\n')
-
-                print(f" Sent chunk {i+1}/{total_chunks} to {peer_ip}")
-                time.sleep(0.1)
-
-            except Exception as e:
-                print(f" Error sending chunk {i} to {peer_ip}: {e}")
-
-    def _handle_file_connection(self, conn, addr):
+                rtt = self._send_chunk(peer_ip, header, chunk_size, retries, on_loss=pacer.on_loss,
+                                       file=file_name, chunk=i)
+            except Exception:
+                continue
+            pacer.on_ack(len(header), rtt)
+            delivered += 1
+            self.progress.update(transfer_id, chunk_size, 1)
+            log.sample("chunk_sent", every=50, peer=peer_ip, file=file_name, chunk=i, total=total_chunks, rtt=round(rtt, 4))
+
+            pause = pacer.delay(len(header), rtt)
+            if pause > 0 and n < len(selected) - 1:
+                time.sleep(pause)
+
+        complete = delivered == len(selected)
+        self.progress.finish(transfer_id, None if complete else f"{len(selected) - delivered} chunk(s) not delivered")
+        return complete
+
+    def _pacer_for(self, peer_ip, pacing=None):
+        """The pacer for a transfer; adaptive pacing carries its rate over between transfers"""
+        option = pacing if pacing is not None else self.pacing
+        if option is None or option == 'adaptive':
+            with self._pacers_lock:
+                pacer = self._pacers.get(peer_ip)
+                if pacer is None:
+                    pacer = self._pacers[peer_ip] = AIMDPacer()
+                return pacer
+        return make_pacer(option)
+
+    def _chunk_length(self, file_size, index):
+        return min(self.chunk_size, file_size - index * self.chunk_size)
+
+    def chunk_state(self, peer_ip, file_name, total_chunks, timeout=5):
+        """Which chunks of a file a peer holds, as a set of chunk numbers.
+
+        Asks with a CHUNK_STATE request (answered by ChunkSwarm). Raises if the
+        peer cannot be reached or does not answer.
+        """
+        reply = json.loads(self.request(peer_ip, f"{STATE_PREFIX}{file_name}", timeout) or '{}')
+        if reply.get('complete'):
+            return set(range(total_chunks))
+        if reply.get('total') not in (None, total_chunks):
+            return set()  # a different file under the same name
+        return decode_chunk_set(reply.get('have'), total_chunks)
+
+    def _total_chunks(self, file_path):
+        return max(1, -(-os.path.getsize(file_path) // self.chunk_size))
+
+    def missing_chunks(self, peer_ip, file_path, total_chunks=None):
+        """The chunk numbers of a local file a peer lacks.
+
+        A peer that is reachable but doesn't answer the query (an older client)
+        lacks them all; one that can't be reached raises.
+        """
+        file_name = os.path.basename(file_path)
+        total_chunks = total_chunks or self._total_chunks(file_path)
         try:
-            header_data = b''
-            while True:
-                chunk = conn.recv(1024)
-                if not chunk or b'\n' in chunk:
-                    header_data += chunk.split(b'\n')[0]
-                    break
-                header_data += chunk
-                if b'\n' in header_data:
-                    header_data = header_data.split(b'\n')[0]
-                    break
-
-            if not header_data:
-                print(f"⚠️ Empty header received from {addr[0]}")
-                return
-
-            print(f"📦 Raw header data from {addr[0]}: {header_data}")
+            return set(range(total_chunks)) - self.chunk_state(peer_ip, file_name, total_chunks)
+        except Exception as e:
+            # Connect errors mean the peer is gone; a timeout or bad reply, an older client
+            refused = isinstance(e, OSError) and not isinstance(e, TimeoutError)
+            if refused or not self.peers.is_reachable(peer_ip):
+                raise
+            log.info("chunk_state_unavailable", peer=peer_ip, file=file_name, error=e)
+            return set(range(total_chunks))
+
+    def repair(self, file_path, peers=None, pacing=None):
+        """Send each peer only the chunks of a file it is missing, returning {peer_ip: outcome}.
+
+        Every peer is asked for its chunk state first, then only peers lacking
+        chunks get them, in parallel. A peer that is reachable but doesn't
+        answer the query (an older client) gets the whole file. The outcome is
+        True once the peer has every chunk, False if some were not delivered, or
+        the exception that stopped the transfer.
+        """
+        file_name = os.path.basename(file_path)
+        total_chunks = self._total_chunks(file_path)
+        missing_total = []
 
+        def repair_peer(peer_ip):
+            missing = self.missing_chunks(peer_ip, file_path, total_chunks)
+            missing_total.append(len(missing))
+            if not missing:
+                return True
+            log.debug("repair_peer", peer=peer_ip, file=file_name, missing=len(missing), total=total_chunks)
+            return self.send_file_chunks(file_path, peer_ip, pacing=pacing, indices=missing)
+
+        results = self.fan_out(repair_peer, peers)
+        log.info("repair_finished", file=file_name, peers=len(results),
+                 repaired=sum(1 for n in missing_total if n), chunks=sum(missing_total),
+                 failed=sum(1 for outcome in results.values() if outcome is not True))
+        return results
+
+    def _send_chunk(self, peer_ip, header, size, retries=2, on_loss=None, **context):
+        """Deliver one encoded chunk header, retrying on failure; returns the ack RTT or raises"""
+        error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                self.chunk_retries.inc()
             try:
-                header = json.loads(header_data.decode('utf-8'))
-                required_keys = ['file_name', 'chunk_index', 'total_chunks', 'chunk_data']
-                for key in required_keys:
-                    if key not in header:
-                        print(f"⚠️ Missing key in received chunk header from {addr[0]}: {key}")
-                        return
-
-                file_name = header['file_name']
-                chunk_index = header['chunk_index']
-                total_chunks = header['total_chunks']
-                chunk_data = base64.b64decode(header['chunk_data'])
-                print(f" 📥 Chunk {chunk_index + 1}/{total_chunks} received from {addr[0]}: {file_name}")
-
-                if self.on_file_received:
-                    file_chunk_info = {
-                        'file_name': file_name,
-                        'chunk_index': chunk_index,
-                        'total_chunks': total_chunks,
-                        'data': chunk_data,
-                        'sender': addr[0]
-                    }
-                    self.on_file_received(file_chunk_info, addr)
-
-            except json.JSONDecodeError as jde:
-                print(f"❌ JSON decode error from {addr[0]}: {jde}")
+                start = time.monotonic()
+                with self._connect(peer_ip, self.file_port, 10, 'chunk') as s:
+                    s.sendall(header)
+                    # Receivers answer with a short ack line; older ones just close,
+                    # which still tells us the chunk has been read
+                    s.recv(16)
+                rtt = time.monotonic() - start
+                self.chunk_latency_seconds.observe(rtt)
+                self.chunks_sent.inc()
+                self.bytes_sent.inc(size, kind='chunk')
+                return rtt
+            except PeerUnreachableError as e:
+                error = e
+                break
             except Exception as e:
-                print(f"❌ Error parsing chunk header from {addr[0]}: {e}")
+                error = e
+                if on_loss:
+                    on_loss()
+                log.warning("chunk_send_failed", peer=peer_ip, attempt=attempt + 1, error=e, **context)
+        raise error
+
+    def _recv_header(self, conn):
+        """Read the newline-terminated JSON header, returning it and any bytes received after it"""
+        buffer = bytearray()
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return bytes(buffer), b''
+            newline = data.find(b'\n')
+            if newline != -1:
+                buffer += data[:newline]
+                return bytes(buffer), data[newline + 1:]
+            buffer += data
+
+    def _handle_chunk(self, conn, addr, header):
+        """Handle a single chunk sent by send_file_chunks"""
+        required_keys = ['file_name', 'chunk_index', 'total_chunks', 'chunk_data']
+        for key in required_keys:
+            if key not in header:
+                log.warning("chunk_header_invalid", peer=addr[0], missing=key)
+                return
+
+        file_name = header['file_name']
+        chunk_index = header['chunk_index']
+        total_chunks = header['total_chunks']
+        chunk_data = base64.b64decode(header['chunk_data'])
+        self.chunks_received.inc()
+        self.bytes_received.inc(len(chunk_data), kind='chunk')
+        log.sample("chunk_received", every=50, peer=addr[0], file=file_name, chunk=chunk_index, total=total_chunks)
 
+        # Ack before handing the chunk to the application so the sender's pacing
+        # reflects the network path rather than UI work
+        try:
+            conn.sendall(b'ACK\n')
         except Exception as e:
-            print(f"❌ Error receiving chunk from {addr[0]}: {e}")
+            log.warning("chunk_ack_failed", peer=addr[0], error=e)
 
-        finally:
-            conn.close()
+        # The node that started the transfer, which relays pass along so acks go back to it
+        origin = header.setdefault('origin', addr[0])
+        if header.get('relay'):
+            # Pass the chunk down our subtree right away rather than after the whole file
+            self.relay.forward(header, header['relay'])
 
-    # Other methods remain unchanged (listen_for_peers, discover_peers, send_message, etc.)
+        transfer_id = self.progress.start('receive', addr[0], file_name, total_chunks=total_chunks)
+        self.progress.update(transfer_id, len(chunk_data), 1, chunk=chunk_index)
+        if self.progress.get(transfer_id)['chunks_done'] >= total_chunks:
+            self.progress.finish(transfer_id)
 
+        if self.on_file_received:
+            file_chunk_info = {
+                'file_name': file_name,
+                'chunk_index': chunk_index,
+                'total_chunks': total_chunks,
+                'data': chunk_data,
+                'sender': addr[0],
+                'origin': origin
+            }
+            self.on_file_received(file_chunk_info, addr)
+
+    def add_peer(self, peer_ip, port=None):
+        """Add a peer by hand (e.g. one not reachable by broadcast)"""
+        return self.peers.touch(peer_ip, port)
+
+    def _on_peer_change(self, event, info):
+        if event == 'added' and self.peer_cache:
+            cached = self.peer_cache.get(info.ip)
+            if cached and cached.get('srtt'):
+                # Start from the RTT we measured last session instead of the default timeout
+                self.peers.record_rtt(info.ip, cached['srtt'])
+        if event == 'down':
+            log.warning("peer_unreachable", peer=info.ip, failures=info.failures)
+        elif event == 'up':
+            log.info("peer_reachable", peer=info.ip)
+        elif event in ('expired', 'removed'):
+            self.pool.drop(info.ip)
+            with self._pacers_lock:
+                self._pacers.pop(info.ip, None)
+            log.info("peer_lost", peer=info.ip, reason=event)
+            if self.on_peer_lost:
+                self.on_peer_lost(info.ip)
+
+    def _heartbeat_loop(self):
+        """Periodically tell known peers we are alive and drop the ones that went quiet"""
+        while True:
+            time.sleep(self.heartbeat_interval)
+            self.discovery.heartbeat()
+            self.peers.expire()
+            self.progress.expire(self.transfer_idle_timeout)
+            if self.peer_cache:
+                self.peer_cache.save(self.peers)
+
+    def _probe_cached_peers(self):
+        """Unicast DISCOVER_PEER to last session's peers; the ones that answer rejoin at once"""
+        entries = self.peer_cache.load()
+        targets = [(ip, entry.get('port') or self.port) for ip, entry in entries.items()]
+        if targets:
+            self.discovery.probe(targets)
+
+    def _peer_seen(self, message, address, node_id=None):
+        """Record a discovery datagram from a peer, reporting it if it is new"""
+        interface = self.interfaces.for_ip(address[0])
+        if self.peers.touch(address[0], address[1], node_id=node_id, interface=interface):
+            log.info("peer_discovered", peer=address[0], via=message,
+                     interface=interface.name if interface else None)
+            if self.on_peer_discovered:
+                self.on_peer_discovered(message, address)
 
     def listen_for_peers(self):
-        """Listen for incoming peer broadcasts"""
-        print(f" Listening for peer discovery on UDP port {self.port}...")
+        """Listen for peer announcements, replies and heartbeats, and start announcing ourselves"""
+        log.info("listening_discovery", port=self.port)
+        if self.heartbeat_interval:
+            threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        self.discovery.start()
+        if self.peer_cache:
+            self._probe_cached_peers()
         while True:
             try:
                 message, address = self.socket.recvfrom(1024)
-                message = message.decode('utf-8')
-                if message == "DISCOVER_PEER":
-                    peer_ip = address[0]
-                    # Only add peer if not already in list (comparing just IP)
-                    if peer_ip not in [p[0] if isinstance(p, tuple) else p for p in self.peers]:
-                        self.peers.append(address)
-                        print(f"Discovered new peer: {peer_ip}")
-                        if self.on_peer_discovered:
-                            self.on_peer_discovered(message, address)
-                    # Send response to let the peer know we exist
-                    self.socket.sendto(b"PEER_ACK", address)
+                self.discovery.handle_datagram(message.decode('utf-8'), address)
             except Exception as e:
-                print(f" Error in listening for peers: {e}")
+                log.error("discovery_listener_failed", error=e)
 
     def discover_peers(self):
-        """Broadcast to discover peers"""
+        """Broadcast to discover peers now (rate limited, see DiscoveryService)"""
         try:
-            print(" Broadcasting peer discovery...")
-            broadcast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            broadcast_socket.sendto(b"DISCOVER_PEER", ("<broadcast>", self.port))
-            broadcast_socket.close()
+            log.info("discovery_broadcast", port=self.port)
+            self.discovery.trigger()
         except Exception as e:
-            print(f" Error broadcasting discovery: {e}")
+            log.error("discovery_broadcast_failed", error=e)
 
     def listen_for_files(self):
         """Listen for incoming file transfers over TCP"""
-        print(f" Listening for incoming files on TCP port {self.file_port}...")
+        log.info("listening_files", port=self.file_port)
         file_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         file_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        file_socket.bind(('', self.file_port))
+        file_socket.bind((self.host, self.file_port))
         file_socket.listen(5)
 
         while True:
             try:
                 conn, addr = file_socket.accept()
-                thread = threading.Thread(target=self._handle_file_connection, args=(conn, addr))
+                thread = threading.Thread(target=self._run_handler, args=('file', self._handle_file_connection, conn, addr))
                 thread.daemon = True
                 thread.start()
             except Exception as e:
-                print(f" Error in file listener: {e}")
+                log.error("file_accept_failed", error=e)
 
     def listen_for_acks(self):
         """Listen for file reception acknowledgements"""
-        print(f" Listening for file ACKs on TCP port {self.ack_port}...")
+        log.info("listening_acks", port=self.ack_port)
         ack_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         ack_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        ack_socket.bind(('', self.ack_port))
+        ack_socket.bind((self.host, self.ack_port))
         ack_socket.listen(5)
 
         while True:
             try:
                 conn, addr = ack_socket.accept()
-                thread = threading.Thread(target=self._handle_ack, args=(conn, addr))
+                thread = threading.Thread(target=self._run_handler, args=('ack', self._handle_ack, conn, addr))
                 thread.daemon = True
                 thread.start()
             except Exception as e:
-                print(f" Error in ACK listener: {e}")
+                log.error("ack_accept_failed", error=e)
 
     def _handle_ack(self, conn, addr):
         """Handle incoming file acknowledgement"""
@@ -220,88 +604,77 @@ class PeerNetwork:
                 ack_data = json.loads(data.decode('utf-8'))
                 file_name = ack_data.get('file_name', 'unknown')
                 status = ack_data.get('status', 'unknown')
-                print(f" Received ACK from {addr[0]} for file {file_name}: {status}")
+                log.info("ack_received", peer=addr[0], file=file_name, status=status)
                 if self.on_file_ack:
                     self.on_file_ack(file_name, status, addr)
         except Exception as e:
-            print(f" Error handling ACK: {e}")
+            log.error("ack_handler_failed", peer=addr[0], error=e)
         finally:
             conn.close()
 
-    def send_file_ack(self, peer_ip, file_name, status):
-        """Send acknowledgement for received file"""
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(5)  # Set timeout for connection
-                s.connect((peer_ip, self.ack_port))
-                
-                ack_data = json.dumps({
-                    'file_name': file_name,
-                    'status': status,
-                    'timestamp': time.time()
-                })
-                
-                s.sendall(ack_data.encode('utf-8'))
-                print(f" ACK sent to {peer_ip} for file {file_name}")
-                return True
-        except Exception as e:
-            print(f" Error sending ACK to {peer_ip}: {e}")
-            return False
+    def send_file_ack(self, peer_ip, file_name, status, have=None, total=None):
+        """Acknowledge a received file, or progress on one (``have`` of ``total`` chunks).
+
+        Acks are batched per peer and sent as one FILE_ACKS message over the
+        pooled connection (see delivery.AckBatcher); listen_for_acks is kept
+        for older clients that still connect to the ack port.
+        """
+        return self.acks.ack(peer_ip, file_name, status, have, total)
 
     def _handle_file_connection(self, conn, addr):
-        """Handle incoming file connection"""
+        """Handle incoming file connection (a whole file or a single chunk)"""
         try:
-            print(f" Incoming file connection from {addr[0]}...")
+            log.sample("file_connection", every=50, peer=addr[0])
             # First receive the header with metadata
-            header_data = b''
-            while True:
-                chunk = conn.recv(1024)
-                if not chunk or b'\n' in chunk:
-                    header_data += chunk.split(b'\n')[0]
-                    break
-                header_data += chunk
-                if b'\n' in header_data:
-                    header_data = header_data.split(b'\n')[0]
-                    break
-            
+            header_data, leftover = self._recv_header(conn)
+
             if not header_data:
-                print(f" Empty header from {addr[0]}")
+                log.warning("empty_header", peer=addr[0])
                 return
-            
+
             # Parse header
             try:
                 header = json.loads(header_data.decode('utf-8'))
+            except json.JSONDecodeError as jde:
+                log.warning("header_decode_failed", peer=addr[0], error=jde)
+                return
+
+            if 'chunk_data' in header:
+                self._handle_chunk(conn, addr, header)
+                return
+
+            try:
                 file_name = header['file_name']
                 file_size = int(header['file_size'])
-                print(f" Receiving file: {file_name} ({file_size} bytes) from {addr[0]}")
+                log.info("file_receiving", peer=addr[0], file=file_name, size=file_size)
             except Exception as e:
-                print(f" Error parsing file header: {e}")
+                log.warning("file_header_invalid", peer=addr[0], error=e)
                 return
-            
+
             # Receive file data
-            received_data = b''
+            transfer_id = self.progress.start('receive', addr[0], file_name, total_bytes=file_size)
+            received_data = bytearray()
             remaining = file_size
             
             # Receive any data that might have come with the header
-            if b'\n' in chunk:
-                received_data += chunk.split(b'\n', 1)[1]
-                remaining -= len(received_data)
+            if leftover:
+                received_data += leftover
+                remaining -= len(leftover)
+                self.progress.update(transfer_id, len(leftover))
             
             # Continue receiving data
             while remaining > 0:
-                chunk = conn.recv(min(4096, remaining))
+                chunk = conn.recv(min(65536, remaining))
                 if not chunk:
                     break
                 received_data += chunk
                 remaining -= len(chunk)
-                
-                # Print progress for large files
-                if file_size > 1000000:  # 1MB
-                    percent = int((file_size - remaining) / file_size * 100)
-                    if percent % 10 == 0:
-                        print(f" Receiving {file_name}: {percent}% complete")
-            
-            print(f"📦 Received file: {file_name} ({len(received_data)} bytes) from {addr[0]}")
+                self.progress.update(transfer_id, len(chunk))
+
+            received_data = bytes(received_data)
+            self.bytes_received.inc(len(received_data), kind='file')
+            self.progress.finish(transfer_id, None if remaining <= 0 else "connection closed early")
+            log.info("file_received", peer=addr[0], file=file_name, size=len(received_data))
 
             # Send acknowledgement
             self.send_file_ack(addr[0], file_name, "success")
@@ -318,7 +691,7 @@ class PeerNetwork:
                 self.on_file_received(file_data, addr)
 
         except Exception as e:
-            print(f" Error receiving file: {e}")
+            log.error("file_receive_failed", peer=addr[0], error=e)
             # Try to send a failure acknowledgement
             try:
                 self.send_file_ack(addr[0], "unknown", f"failed: {str(e)}")
@@ -331,28 +704,34 @@ class PeerNetwork:
         """Send a file to a specific peer via TCP"""
         try:
             file_name = os.path.basename(file_path)
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-                file_size = len(file_data)
-
-            print(f" Connecting to {peer_ip}:{self.file_port} to send {file_name}...")
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.settimeout(10)  # Set timeout for connection
-            peer_socket.connect((peer_ip, self.file_port))
+            file_size = os.path.getsize(file_path)
 
-            # Send metadata header as JSON followed by newline
-            header = json.dumps({
-                'file_name': file_name,
-                'file_size': file_size,
-                'timestamp': time.time()
-            })
-            peer_socket.sendall(header.encode('utf-8') + b'\n')
+            log.debug("file_connecting", peer=peer_ip, port=self.file_port, file=file_name)
+            with self._connect(peer_ip, self.file_port, 10, 'file') as peer_socket:
+                # Send metadata header as JSON followed by newline
+                header = json.dumps({
+                    'file_name': file_name,
+                    'file_size': file_size,
+                    'timestamp': time.time()
+                })
+                peer_socket.sendall(header.encode('utf-8') + b'\n')
 
-            # Send file data
-            peer_socket.sendall(file_data)
-            peer_socket.close()
-            print(f" File sent to {peer_ip}: {file_name} ({file_size} bytes)")
+                # Send file data in slices so progress can be reported while it goes out
+                transfer_id = self.progress.start('send', peer_ip, file_name, total_bytes=file_size)
+                try:
+                    for index in range(-(-file_size // self.chunk_size)):
+                        view = memoryview(self.chunk_cache.chunk(file_path, index))
+                        for offset in range(0, len(view), 65536):
+                            piece = view[offset:offset + 65536]
+                            peer_socket.sendall(piece)
+                            self.bytes_sent.inc(len(piece), kind='file')
+                            self.progress.update(transfer_id, len(piece))
+                except Exception as e:
+                    self.progress.finish(transfer_id, str(e))
+                    raise
+                self.progress.finish(transfer_id)
+            log.info("file_sent", peer=peer_ip, file=file_name, size=file_size)
             return True
         except Exception as e:
-            print(f" Error sending file to {peer_ip}: {e}")
+            log.error("file_send_failed", peer=peer_ip, file=file_name, error=e)
             return False
@@ -0,0 +1,273 @@
+"""Headless front-end for PeerNetwork: no Qt, no display.
+
+    python p2pd.py send notes.pdf slides.zip --min-peers 30 --wait 5
+    python p2pd.py receive --save-dir /srv/incoming
+    python p2pd.py seed dataset.tar --metrics-port 9464
+    python p2pd.py status [--metrics-port 9464]
+
+``send`` discovers peers and pushes files as chunks (through the relay tree
+when the class is large), ``receive`` runs a student node that saves whatever
+arrives or is published in the catalog, ``seed`` publishes files in the
+catalog, pushes them to every peer that joins and relays for the others, and
+``status`` lists the peers on the LAN or, with ``--metrics-port``, the
+counters of a running node.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+
+def add_node_arguments(parser, serve_metrics=True):
+    parser.add_argument('--host', default='', help="local address to bind (default: all interfaces)")
+    parser.add_argument('--port', type=int, default=8080, help="discovery UDP port")
+    parser.add_argument('--file-port', type=int, default=8081)
+    parser.add_argument('--message-port', type=int, default=50008)
+    parser.add_argument('--ack-port', type=int, default=50010)
+    parser.add_argument('--peer', action='append', default=[], metavar='IP',
+                        help="add a peer by address (repeatable), e.g. across routed subnets")
+    parser.add_argument('--no-peer-cache', action='store_true', help="don't read or write the peer cache")
+    if serve_metrics:
+        parser.add_argument('--metrics-port', type=int, help="serve /metrics on this port")
+    parser.add_argument('--log-level', default=None, help="DEBUG, INFO, WARNING (default: GEHU_P2P_LOG_LEVEL or INFO)")
+
+
+class Node:
+    """A PeerNetwork plus ChunkSwarm with all listeners running"""
+
+    def __init__(self, args, save_dir=None, on_file_complete=None, on_catalog_change=None, serve_metrics=True):
+        from netlog import configure_logging
+        from network import PeerNetwork
+        from swarm import ChunkSwarm
+
+        configure_logging(level=args.log_level)
+        self.network = PeerNetwork(
+            host=args.host,
+            port=args.port,
+            file_port=args.file_port,
+            message_port=args.message_port,
+            ack_port=args.ack_port,
+            on_file_received=lambda info, addr: self.swarm.handle_file_chunk(info, addr),
+            on_message_received=self._on_message,
+            peer_cache=False if args.no_peer_cache else None,
+            on_catalog_change=on_catalog_change,
+        )
+        self.swarm = ChunkSwarm(self.network, save_dir=save_dir, on_file_complete=on_file_complete)
+        self.static_peers = args.peer
+        self.discovery_port = args.port
+        if serve_metrics and args.metrics_port:
+            self.network.start_metrics_server(args.metrics_port)
+
+    def _on_message(self, message, address):
+        if not self.swarm.handle_peer_message(message, address):
+            print(f"message from {address[0]}: {message}", flush=True)
+
+    def start(self):
+        for listener in (self.network.listen_for_peers, self.network.listen_for_files,
+                         self.network.listen_for_messages, self.network.listen_for_acks):
+            threading.Thread(target=listener, daemon=True).start()
+        for peer_ip in self.static_peers:
+            self.network.add_peer(peer_ip, self.discovery_port)
+        self.network.discover_peers()
+
+    def wait_for_peers(self, count, timeout):
+        """Wait until ``count`` peers are known or ``timeout`` passes; returns the peer count"""
+        deadline = time.monotonic() + timeout
+        while len(self.network.peers) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return len(self.network.peers)
+
+
+def cmd_send(args):
+    from relay import TreeDistributor
+
+    for path in args.files:
+        if not os.path.isfile(path):
+            print(f"not a file: {path}", file=sys.stderr)
+            return 2
+    node = Node(args)
+    node.start()
+    found = node.wait_for_peers(args.min_peers, args.wait)
+    if not found:
+        print("no peers found", file=sys.stderr)
+        return 1
+    print(f"{found} peer(s) found", flush=True)
+
+    distributor = TreeDistributor(node.network, fanout=args.fanout)
+    failed = 0
+    for path in args.files:
+        start = time.monotonic()
+        if args.repair:
+            results = node.network.repair(path)
+        elif args.tree or (not args.direct and found > args.fanout):
+            results = distributor.distribute(path)
+        else:
+            results = node.network.fan_out(lambda peer_ip: node.network.send_file_chunks(path, peer_ip))
+        ok = [ip for ip, outcome in results.items() if outcome is True]
+        failed += len(results) - len(ok)
+        print(f"{os.path.basename(path)}: sent to {len(ok)}/{len(results)} direct peer(s) "
+              f"in {time.monotonic() - start:.2f}s", flush=True)
+        for ip, outcome in results.items():
+            if outcome is not True:
+                print(f"  {ip}: {outcome if isinstance(outcome, Exception) else 'incomplete'}", flush=True)
+    # Give relays a moment to drain their queues before our listeners go away
+    time.sleep(args.linger)
+    return 1 if failed else 0
+
+
+def cmd_receive(args):
+    done = threading.Event()
+    received = []
+
+    def on_complete(file_name, path, size, sender_ip):
+        received.append(file_name)
+        print(f"received {file_name} ({size} bytes) from {sender_ip} -> {path}", flush=True)
+        if args.count and len(received) >= args.count:
+            done.set()
+
+    seen = set()
+    seen_lock = threading.Lock()
+
+    def on_catalog_change(entry):
+        # A headless receiver wants everything that is published, fetched once per
+        # version; later changes to an entry (new sources) don't start another fetch
+        manifest = entry['manifest']
+        key = (manifest['name'], manifest.get('sha256'))
+        with seen_lock:
+            if key in seen:
+                return
+            seen.add(key)
+        if node.swarm.has_or_wants(manifest['name']):
+            return
+        threading.Thread(target=node.swarm.fetch, args=(manifest['name'],), daemon=True).start()
+
+    node = Node(args, save_dir=args.save_dir, on_file_complete=on_complete, on_catalog_change=on_catalog_change)
+    node.start()
+    print(f"receiving into {node.swarm.save_dir}", flush=True)
+    return 0 if _run_until(done, args.timeout) or not args.count else 1
+
+
+def cmd_seed(args):
+    from concurrent.futures import ThreadPoolExecutor
+
+    pusher = ThreadPoolExecutor(max_workers=args.uploads, thread_name_prefix='p2p-seed')
+    seeded = set()
+    lock = threading.Lock()
+
+    def push_to(peer_ip):
+        for path in args.files:
+            with lock:
+                if (peer_ip, path) in seeded:
+                    continue
+            ok = node.network.send_file_chunks(path, peer_ip)
+            if ok:
+                with lock:
+                    seeded.add((peer_ip, path))
+            print(f"seeded {os.path.basename(path)} to {peer_ip}: {'ok' if ok else 'incomplete'}", flush=True)
+
+    def on_peer_change(event, info):
+        # New peers, and ones coming back after being unreachable, get whatever they lack
+        if event in ('added', 'up'):
+            pusher.submit(push_to, info.ip)
+
+    for path in args.files:
+        if not os.path.isfile(path):
+            print(f"not a file: {path}", file=sys.stderr)
+            return 2
+    node = Node(args, save_dir=args.save_dir)
+    node.network.peers.subscribe(on_peer_change)
+    for path in args.files:
+        node.swarm.share(path)
+    # Peers given with --peer are added by start() and pushed to like discovered ones
+    node.start()
+    print(f"seeding {len(args.files)} file(s); Ctrl-C to stop", flush=True)
+    _run_until(threading.Event(), None)
+    return 0
+
+
+def cmd_status(args):
+    if args.metrics_port:
+        url = f"http://{args.host or '127.0.0.1'}:{args.metrics_port}/metrics.json"
+        try:
+            with urllib.request.urlopen(url, timeout=3) as response:
+                snapshot = json.load(response)
+        except Exception as e:
+            print(f"cannot reach {url}: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(snapshot, indent=2) if args.json else _format_metrics(snapshot))
+        return 0
+
+    node = Node(args, serve_metrics=False)
+    node.start()
+    time.sleep(args.wait)
+    peers = node.network.peers.snapshot()
+    if args.json:
+        print(json.dumps(peers, indent=2))
+        return 0
+    print(f"{'peer':<16}{'node':<14}{'interface':<11}{'rtt ms':>8}  reachable")
+    for peer in sorted(peers, key=lambda p: p['ip']):
+        rtt = f"{peer['srtt'] * 1000:.1f}" if peer['srtt'] is not None else '-'
+        print(f"{peer['ip']:<16}{peer['node_id'] or '-':<14}{peer['interface'] or '-':<11}{rtt:>8}  {peer['reachable']}")
+    return 0
+
+
+def _format_metrics(snapshot):
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"{name}: {json.dumps(metric, default=str)}")
+    return '\n'.join(lines)
+
+
+def _run_until(event, timeout):
+    try:
+        return event.wait(timeout)
+    except KeyboardInterrupt:
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless GEHU P2P node")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    send = commands.add_parser('send', help="send files to the peers on the LAN")
+    send.add_argument('files', nargs='+')
+    send.add_argument('--min-peers', type=int, default=1, help="peers to wait for before sending")
+    send.add_argument('--wait', type=float, default=3.0, help="seconds to wait for --min-peers")
+    send.add_argument('--fanout', type=int, default=3, help="relays per node in the distribution tree")
+    mode = send.add_mutually_exclusive_group()
+    mode.add_argument('--tree', action='store_true', help="always distribute through the relay tree")
+    mode.add_argument('--direct', action='store_true', help="always send to every peer directly")
+    mode.add_argument('--repair', action='store_true', help="send each peer only the chunks it is missing")
+    send.add_argument('--linger', type=float, default=2.0, help="seconds to keep serving after sending")
+    send.set_defaults(handler=cmd_send)
+
+    receive = commands.add_parser('receive', help="run a receiving node")
+    receive.add_argument('--save-dir', help="where to store received files")
+    receive.add_argument('--count', type=int, default=0, help="exit after this many files")
+    receive.add_argument('--timeout', type=float, help="give up after this many seconds")
+    receive.set_defaults(handler=cmd_receive)
+
+    seed = commands.add_parser('seed', help="serve files to every peer that joins")
+    seed.add_argument('files', nargs='+')
+    seed.add_argument('--save-dir', help="where to store files received while seeding")
+    seed.add_argument('--uploads', type=int, default=4, help="peers pushed to in parallel")
+    seed.set_defaults(handler=cmd_seed)
+
+    status = commands.add_parser('status', help="list peers, or a running node's metrics")
+    status.add_argument('--wait', type=float, default=2.0, help="seconds to listen for peers")
+    status.add_argument('--json', action='store_true')
+    status.add_argument('--metrics-port', type=int, help="show the metrics of the node serving them on this port")
+    status.set_defaults(handler=cmd_status)
+
+    for sub in (send, receive, seed):
+        add_node_arguments(sub)
+    add_node_arguments(status, serve_metrics=False)
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
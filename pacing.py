@@ -0,0 +1,105 @@
+import time
+
+
+class FixedPacer:
+    """Waits a constant interval between chunks (the original 0.1 s behaviour)"""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+
+    def on_ack(self, nbytes, rtt):
+        pass
+
+    def on_loss(self):
+        pass
+
+    def delay(self, nbytes, elapsed):
+        return self.interval
+
+
+class AIMDPacer:
+    """Adapts the chunk send rate to measured ack latency.
+
+    Without an ``initial_rate`` the sender is not held back at all until the
+    first sign of congestion; with one, the rate doubles per ack until then
+    (slow start). Afterwards it grows additively while acks come back close to
+    the best RTT seen so far, and is cut multiplicatively when the RTT inflates
+    (queues building up on a congested link) or a chunk is lost. The sender only
+    sleeps when the current rate is lower than what the link is already
+    delivering, so a fast wired network runs at full speed while a busy Wi-Fi
+    cell gets breathing room.
+
+    PeerNetwork keeps one pacer per peer, so a transfer starts from the rate
+    the previous one settled on. RTT history older than ``idle_reset`` seconds
+    is forgotten, since the path may have changed in between.
+    """
+
+    def __init__(self, initial_rate=None, min_rate=64 * 1024, max_rate=None,
+                 increase=256 * 1024, decrease=0.5, rtt_tolerance=2.0, idle_reset=10.0):
+        self.rate = float(initial_rate) if initial_rate else float('inf')
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate) if max_rate else None
+        self.increase = increase
+        self.decrease = decrease
+        self.rtt_tolerance = rtt_tolerance
+        self.min_rtt = None
+        self.srtt = None
+        self.delivery_rate = 0.0
+        self.idle_reset = idle_reset
+        self.slow_start = True
+        self._last_decrease = 0.0
+        self._last_ack = None
+
+    def on_ack(self, nbytes, rtt):
+        rtt = max(rtt, 1e-6)
+        now = time.monotonic()
+        if self._last_ack is not None and now - self._last_ack > self.idle_reset:
+            self.min_rtt = self.srtt = None
+        self._last_ack = now
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.srtt = rtt if self.srtt is None else 0.875 * self.srtt + 0.125 * rtt
+        self.delivery_rate = nbytes / rtt
+
+        # Compare the smoothed RTT (with a few ms of slack) so scheduler jitter on an idle
+        # link isn't mistaken for a queue building up
+        if self.srtt > self.min_rtt * self.rtt_tolerance + 0.005:
+            self._decrease()
+        elif self.rate < self.delivery_rate * 2:
+            # Don't let the rate run away far beyond what the path actually delivers,
+            # otherwise a later decrease would take many round trips to bite
+            if self.slow_start:
+                self.rate *= 2
+            else:
+                self.rate += self.increase
+            if self.max_rate:
+                self.rate = min(self.rate, self.max_rate)
+
+    def on_loss(self):
+        self._decrease()
+
+    def _decrease(self):
+        # At most one cut per smoothed RTT, a single congestion event inflates several acks
+        now = time.monotonic()
+        if self.srtt is not None and now - self._last_decrease < self.srtt:
+            return
+        self._last_decrease = now
+        self.slow_start = False
+        # An unpaced sender has no rate yet: cut from what the path was delivering
+        current = self.rate if self.rate != float('inf') else (self.delivery_rate or self.min_rate)
+        self.rate = max(self.min_rate, current * self.decrease)
+
+    def delay(self, nbytes, elapsed):
+        return max(0.0, nbytes / self.rate - elapsed)
+
+
+def make_pacer(pacing):
+    """Build a pacer from a transfer option: 'adaptive', 'fixed', 'none' or a pacer instance"""
+    if pacing is None or pacing == 'adaptive':
+        return AIMDPacer()
+    if pacing == 'fixed':
+        return FixedPacer()
+    if pacing == 'none' or pacing is False:
+        return FixedPacer(interval=0)
+    if hasattr(pacing, 'on_ack') and hasattr(pacing, 'delay'):
+        return pacing
+    raise ValueError(f"Unknown pacing option: {pacing!r}")
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from netlog import get_logger
+
+log = get_logger('peercache')
+
+STATE_DIR = Path(os.environ.get('GEHU_P2P_STATE_DIR') or Path.home() / ".gehu_p2p")
+
+
+class PeerCache:
+    """Last-known peers kept on disk so a restarted node can rejoin without waiting on broadcast.
+
+    Entries (ip, discovery port, node id, interface, smoothed RTT, wall-clock last
+    seen) are written atomically at most every ``save_interval`` seconds and on
+    exit. At startup the entries younger than ``max_age`` are probed with unicast
+    DISCOVER_PEER alongside the normal broadcast; only peers that answer make it
+    into the peer table, and they come back with their old RTT estimate so the
+    first connects already use a tight timeout.
+    """
+
+    def __init__(self, path=None, max_age=7 * 24 * 3600.0, max_entries=512, save_interval=30.0):
+        self.path = Path(path) if path else STATE_DIR / "peers.json"
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._entries = {}
+        self._last_save = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read the cache file, returning the fresh entries keyed by IP"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            raw = []
+        except Exception as e:
+            log.warning("peer_cache_unreadable", path=str(self.path), error=e)
+            raw = []
+        cutoff = time.time() - self.max_age
+        entries = {}
+        for entry in raw if isinstance(raw, list) else []:
+            if isinstance(entry, dict) and entry.get('ip') and entry.get('last_seen', 0) >= cutoff:
+                entries[entry['ip']] = entry
+        with self._lock:
+            self._entries = entries
+        log.info("peer_cache_loaded", path=str(self.path), peers=len(entries))
+        return dict(entries)
+
+    def get(self, ip):
+        with self._lock:
+            return self._entries.get(ip)
+
+    def update(self, peer_table):
+        """Merge the live peers of ``peer_table`` into the cached entries"""
+        now = time.time()
+        with self._lock:
+            for info in peer_table.snapshot():
+                if not info['reachable']:
+                    continue
+                entry = self._entries.setdefault(info['ip'], {'ip': info['ip']})
+                entry.update(
+                    port=info['port'],
+                    node_id=info['node_id'] or entry.get('node_id'),
+                    interface=info['interface'],
+                    srtt=info['srtt'] if info['srtt'] is not None else entry.get('srtt'),
+                    last_seen=now - info['last_seen_ago'],
+                )
+            if len(self._entries) > self.max_entries:
+                newest = sorted(self._entries.values(), key=lambda e: e['last_seen'], reverse=True)
+                self._entries = {e['ip']: e for e in newest[:self.max_entries]}
+
+    def save(self, peer_table=None, force=False):
+        """Write the cache to disk (rate limited to ``save_interval`` unless ``force``)"""
+        now = time.monotonic()
+        if not force and now - self._last_save < self.save_interval:
+            return False
+        self._last_save = now
+        if peer_table is not None:
+            self.update(peer_table)
+        with self._lock:
+            entries = list(self._entries.values())
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            log.warning("peer_cache_save_failed", path=str(self.path), error=e)
+            return False
+        log.debug("peer_cache_saved", peers=len(entries))
+        return True
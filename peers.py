@@ -0,0 +1,228 @@
+import threading
+import time
+
+from netlog import get_logger
+
+log = get_logger('peers')
+
+
+class PeerUnreachableError(ConnectionError):
+    """Raised instead of connecting to a peer whose circuit breaker is open"""
+
+
+class PeerInfo:
+    """What we know about one peer"""
+
+    def __init__(self, ip, port=None):
+        self.ip = ip
+        self.port = port
+        self.first_seen = time.monotonic()
+        self.last_seen = self.first_seen
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.down_since = None
+        self.node_id = None
+        self.interface = None  # name of the local interface the peer is on
+        self.local_address = None  # our address on that interface
+        self.link_rank = (True, 0)
+
+    @property
+    def reachable(self):
+        return self.down_since is None
+
+    def age(self, now=None):
+        return (now or time.monotonic()) - self.last_seen
+
+    def as_dict(self):
+        return {
+            'ip': self.ip,
+            'port': self.port,
+            'last_seen_ago': round(self.age(), 3),
+            'srtt': self.srtt,
+            'reachable': self.reachable,
+            'node_id': self.node_id,
+            'interface': self.interface,
+        }
+
+
+class PeerTable:
+    """Thread-safe registry of live peers keyed by IP.
+
+    Every datagram from a peer refreshes its ``last_seen``; peers not heard from
+    for ``expiry`` seconds are dropped by ``expire()``. Listeners registered with
+    ``subscribe`` get ``(event, PeerInfo)`` for ``added``, ``expired``,
+    ``removed``, ``down`` and ``up``.
+
+    Connect RTTs feed a TCP-style smoothed RTT per peer, used to size connect
+    timeouts; they never go below ``min_timeout`` (1 s, as RFC 6298's minimum
+    RTO), so one lost SYN is retransmitted rather than failing the connect.
+    After ``failure_threshold`` consecutive failed connects a peer's circuit
+    breaker opens and it is skipped until it shows up again in discovery (no
+    sooner than ``hold_down`` seconds later).
+
+    Iterating the table yields the IPs of reachable peers, so code written against
+    the old list of addresses keeps working and skips dead laptops; ``in`` checks
+    whether a peer is known at all. A multi-homed peer seen on several addresses
+    (same node id) is listed once, on the address reached over our best link.
+    """
+
+    def __init__(self, expiry=30.0, failure_threshold=2, hold_down=5.0, min_timeout=1.0):
+        self.expiry = expiry
+        self.failure_threshold = failure_threshold
+        self.hold_down = hold_down
+        self.min_timeout = min_timeout
+        self._peers = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, event, info):
+        for callback in self._listeners:
+            try:
+                callback(event, info)
+            except Exception as e:
+                log.error("peer_listener_failed", change=event, peer=info.ip, error=e)
+
+    def touch(self, ip, port=None, node_id=None, interface=None):
+        """Record that a peer is alive, returning True if it was not known before.
+
+        ``interface`` is the local Interface the peer was seen on, if known.
+        """
+        with self._lock:
+            info = self._peers.get(ip)
+            if info is not None:
+                info.last_seen = time.monotonic()
+                if port is not None:
+                    info.port = port
+                self._set_link(info, node_id, interface)
+                revived = info.down_since is not None and info.last_seen - info.down_since >= self.hold_down
+                if revived:
+                    info.down_since = None
+                    info.failures = 0
+            else:
+                info = self._peers[ip] = PeerInfo(ip, port)
+                self._set_link(info, node_id, interface)
+                revived = None
+        if revived is None:
+            self._notify('added', info)
+            return True
+        if revived:
+            self._notify('up', info)
+        return False
+
+    @staticmethod
+    def _set_link(info, node_id, interface):
+        if node_id:
+            info.node_id = node_id
+        if interface is not None:
+            info.interface = interface.name
+            info.local_address = interface.address
+            info.link_rank = interface.rank
+
+    def refresh(self, ip):
+        """Update last_seen for a known peer without adding unknown ones"""
+        with self._lock:
+            info = self._peers.get(ip)
+            if info is None:
+                return False
+            info.last_seen = time.monotonic()
+            return True
+
+    def record_rtt(self, ip, rtt):
+        """Feed a successful connect time into the peer's RTT estimate"""
+        with self._lock:
+            info = self._peers.get(ip)
+            if info is None:
+                return
+            if info.srtt is None:
+                info.srtt = rtt
+                info.rttvar = rtt / 2
+            else:
+                info.rttvar = 0.75 * info.rttvar + 0.25 * abs(info.srtt - rtt)
+                info.srtt = 0.875 * info.srtt + 0.125 * rtt
+            revived = info.down_since is not None
+            info.failures = 0
+            info.down_since = None
+        if revived:
+            self._notify('up', info)
+
+    def record_failure(self, ip):
+        """Count a failed connect, opening the breaker once the threshold is reached"""
+        with self._lock:
+            info = self._peers.get(ip)
+            if info is None:
+                return False
+            info.failures += 1
+            tripped = info.down_since is None and info.failures >= self.failure_threshold
+            if tripped:
+                info.down_since = time.monotonic()
+        if tripped:
+            self._notify('down', info)
+        return tripped
+
+    def connect_timeout(self, ip, default):
+        """RTO-style connect timeout (srtt + 4 * rttvar), bounded by min_timeout and ``default``"""
+        info = self._peers.get(ip)
+        if info is None or info.srtt is None:
+            return default
+        return min(default, max(self.min_timeout, info.srtt + 4 * info.rttvar))
+
+    def is_reachable(self, ip):
+        info = self._peers.get(ip)
+        return info is None or info.reachable
+
+    def remove(self, ip):
+        with self._lock:
+            info = self._peers.pop(ip, None)
+        if info is not None:
+            self._notify('removed', info)
+        return info is not None
+
+    def expire(self):
+        """Drop peers that have been silent for longer than ``expiry``"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [info for info in self._peers.values() if info.age(now) > self.expiry]
+            for info in stale:
+                del self._peers[info.ip]
+        for info in stale:
+            self._notify('expired', info)
+        return [info.ip for info in stale]
+
+    def get(self, ip):
+        with self._lock:
+            return self._peers.get(ip)
+
+    def ips(self, include_down=False):
+        """Peer addresses, one per node (its best-link address) unless ``include_down`` is set"""
+        with self._lock:
+            if include_down:
+                return list(self._peers)
+            best = {}
+            for ip, info in self._peers.items():
+                if not info.reachable:
+                    continue
+                key = info.node_id or ip
+                current = best.get(key)
+                if current is None or info.link_rank < current.link_rank:
+                    best[key] = info
+            return [info.ip for info in best.values()]
+
+    def snapshot(self):
+        with self._lock:
+            return [info.as_dict() for info in self._peers.values()]
+
+    def __contains__(self, ip):
+        return ip in self._peers
+
+    def __len__(self):
+        return len(self.ips())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return iter(self.ips())
@@ -0,0 +1,227 @@
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+from netlog import get_logger
+
+log = get_logger('pool')
+
+# A pooled message connection starts with MAGIC and then carries frames of
+# <type:1><length:4><payload>. Every frame is answered with <length:4><payload>:
+# an empty reply as soon as a MESSAGE frame is read, or the handler's reply once
+# a REQUEST frame has been processed. Connections without MAGIC are the legacy
+# one-message-per-connection format.
+MAGIC = b'P2PM\x01'
+FRAME_MESSAGE = b'M'
+FRAME_REQUEST = b'R'
+_LENGTH = struct.Struct('!I')
+
+
+class SocketReader:
+    """Buffered exact reads from a socket"""
+
+    def __init__(self, sock, initial=b''):
+        self.sock = sock
+        self.buffer = bytearray(initial)
+
+    def read_exact(self, n):
+        while len(self.buffer) < n:
+            data = self.sock.recv(max(65536, n - len(self.buffer)))
+            if not data:
+                raise ConnectionError("connection closed mid-frame")
+            self.buffer += data
+        out = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return out
+
+    def read_frame(self):
+        """Read one request-side frame, returning (type, payload) or None at a clean EOF"""
+        if not self.buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            self.buffer += data
+        head = self.read_exact(1 + _LENGTH.size)
+        (length,) = _LENGTH.unpack(head[1:])
+        return head[:1], self.read_exact(length)
+
+
+def encode_frame(kind, payload):
+    return kind + _LENGTH.pack(len(payload)) + payload
+
+
+def encode_reply(payload=b''):
+    return _LENGTH.pack(len(payload)) + payload
+
+
+class StaleConnectionError(ConnectionError):
+    """A reused connection failed before the peer could have handled the frame"""
+
+
+class _PooledConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = SocketReader(sock)
+        self.last_used = time.monotonic()
+
+    def exchange(self, kind, payload, timeout):
+        """Send one frame and read its reply.
+
+        Raises StaleConnectionError only when the frame was certainly not
+        handled: the send failed, or the peer closed or reset the connection
+        without replying. A timeout may mean the peer is still working on it,
+        so it is raised as is.
+        """
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.sendall(encode_frame(kind, payload))
+        except TimeoutError:
+            raise
+        except OSError as e:
+            raise StaleConnectionError(f"send failed: {e}") from e
+        try:
+            head = self.reader.read_exact(_LENGTH.size)
+        except TimeoutError:
+            raise
+        except OSError as e:
+            if self.reader.buffer:
+                raise
+            raise StaleConnectionError(f"closed before replying: {e}") from e
+        (length,) = _LENGTH.unpack(head)
+        reply = self.reader.read_exact(length)
+        self.last_used = time.monotonic()
+        return reply
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """Reusable framed message connections to peers.
+
+    Idle connections are kept per peer and handed out LIFO, so concurrent senders
+    to the same peer each get their own socket while sequential ones reuse a warm
+    connection instead of paying a TCP handshake per message. A connection that
+    turns out dead on reuse (the peer restarted, an idle timeout on the other
+    side) is retried once on a fresh socket; any other failure, such as a slow
+    reply timing out, is raised rather than risk the peer handling it twice.
+    """
+
+    def __init__(self, network, idle_timeout=60.0, max_idle_per_peer=4):
+        self.network = network
+        self.idle_timeout = idle_timeout
+        self.max_idle_per_peer = max_idle_per_peer
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _open(self, peer_ip, timeout):
+        sock = self.network._connect(peer_ip, self.network.message_port, timeout, 'message')
+        try:
+            sock.sendall(MAGIC)
+        except Exception:
+            sock.close()
+            raise
+        return _PooledConnection(sock)
+
+    def _acquire(self, peer_ip):
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(peer_ip, [])
+            while idle:
+                conn = idle.pop()
+                if now - conn.last_used < self.idle_timeout:
+                    return conn
+                conn.close()
+        return None
+
+    def _release(self, peer_ip, conn):
+        with self._lock:
+            idle = self._idle.setdefault(peer_ip, [])
+            if len(idle) < self.max_idle_per_peer:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def exchange(self, peer_ip, kind, payload, timeout=5):
+        conn = self._acquire(peer_ip)
+        if conn is not None:
+            try:
+                reply = conn.exchange(kind, payload, timeout)
+                self._release(peer_ip, conn)
+                return reply
+            except StaleConnectionError as e:
+                # The peer never saw the frame, so sending it again can't duplicate it
+                conn.close()
+                log.debug("pooled_connection_stale", peer=peer_ip, error=e)
+            except Exception:
+                conn.close()
+                raise
+
+        conn = self._open(peer_ip, timeout)
+        try:
+            reply = conn.exchange(kind, payload, timeout)
+        except Exception:
+            conn.close()
+            raise
+        self._release(peer_ip, conn)
+        return reply
+
+    def drop(self, peer_ip):
+        """Close every idle connection to a peer"""
+        with self._lock:
+            idle = self._idle.pop(peer_ip, [])
+        for conn in idle:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            peers = list(self._idle)
+        for peer_ip in peers:
+            self.drop(peer_ip)
+
+
+class BroadcastResult:
+    """Outcome of a broadcast: peers that got the message and errors for the rest"""
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+
+    def __repr__(self):
+        return f"BroadcastResult(succeeded={len(self.succeeded)}, failed={len(self.failed)})"
+
+
+def gather(futures_by_peer):
+    """Combine per-peer futures into one Future resolving to a BroadcastResult"""
+    combined = Future()
+    result = BroadcastResult()
+    pending = [len(futures_by_peer)]
+    lock = threading.Lock()
+
+    if not futures_by_peer:
+        combined.set_result(result)
+        return combined
+
+    def on_done(peer_ip, future):
+        try:
+            ok = future.result()
+            error = None if ok else "send failed"
+        except Exception as e:
+            error = e
+        with lock:
+            if error is None:
+                result.succeeded.append(peer_ip)
+            else:
+                result.failed[peer_ip] = error
+            pending[0] -= 1
+            finished = pending[0] == 0
+        if finished:
+            combined.set_result(result)
+
+    for peer_ip, future in futures_by_peer.items():
+        future.add_done_callback(lambda f, peer_ip=peer_ip: on_done(peer_ip, f))
+    return combined
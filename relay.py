@@ -0,0 +1,173 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from netlog import get_logger
+
+log = get_logger('relay')
+
+
+def build_tree(peers, fanout=3):
+    """Arrange peers into a ``fanout``-ary distribution tree below the sender.
+
+    Returns the sender's children as nested ``[ip, [child, ...]]`` lists. Peers
+    come first in the order given, so callers pass the best-connected ones first
+    to make them the relays.
+    """
+    peers = list(peers)
+    nodes = [[ip, []] for ip in peers]
+    for j, node in enumerate(nodes):
+        first = fanout * (j + 1)
+        node[1] = nodes[first:first + fanout]
+    return nodes[:fanout]
+
+
+class RelayForwarder:
+    """Forwards relayed chunks to this node's children in the distribution tree.
+
+    A chunk whose header carries a ``relay`` list is passed on to each listed
+    subtree as soon as it has been acked upstream, so a relay streams chunks to
+    its children while the rest of the file is still arriving instead of storing
+    the whole file first. Each child has its own ordered queue and worker, so a
+    slow child does not hold up its siblings or the parent.
+
+    When a child cannot be reached after retries, its children are adopted:
+    this chunk and every later one for the dead relay go straight to them,
+    without trying the relay again, until it is seen again in discovery or
+    ``adopt_for`` seconds pass.
+    """
+
+    def __init__(self, network, idle_timeout=30.0, adopt_for=60.0):
+        self.network = network
+        self.idle_timeout = idle_timeout
+        self.adopt_for = adopt_for
+        self._queues = {}
+        self._dead = {}  # ip -> when it failed, for relays whose children we adopted
+        self._lock = threading.Lock()
+        network.peers.subscribe(self._on_peer_change)
+        m = network.metrics
+        self.chunks_relayed = m.counter('p2p_chunks_relayed_total', 'Chunks forwarded to children in the relay tree')
+        self.reparented = m.counter('p2p_relay_reparented_total', 'Subtrees adopted because their relay was unreachable')
+
+    def _on_peer_change(self, event, info):
+        if event in ('added', 'up'):
+            with self._lock:
+                self._dead.pop(info.ip, None)
+
+    def _adopted(self, ip):
+        with self._lock:
+            failed = self._dead.get(ip)
+            if failed is not None and time.monotonic() - failed >= self.adopt_for:
+                del self._dead[ip]
+                failed = None
+        return failed is not None
+
+    def forward(self, header, subtrees):
+        """Queue a received chunk (its decoded JSON header) for every child subtree"""
+        for subtree in subtrees:
+            self._enqueue(subtree, header)
+
+    def _enqueue(self, subtree, header):
+        ip = subtree[0]
+        with self._lock:
+            q = self._queues.get(ip)
+            if q is None:
+                q = self._queues[ip] = queue.Queue()
+                threading.Thread(target=self._worker, args=(ip, q), daemon=True).start()
+            q.put((subtree, header))
+
+    def _worker(self, ip, q):
+        while True:
+            try:
+                subtree, header = q.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if q.empty():
+                        del self._queues[ip]
+                        return
+                continue
+            children = subtree[1]
+            if self._adopted(ip):
+                self.forward(header, children)
+                continue
+            encoded = json.dumps(dict(header, relay=children)).encode('utf-8') + b'\n'
+            try:
+                self.network._send_chunk(ip, encoded, header.get('chunk_size', 0),
+                                         file=header['file_name'], chunk=header['chunk_index'])
+                self.chunks_relayed.inc()
+            except Exception as e:
+                if children:
+                    with self._lock:
+                        self._dead[ip] = time.monotonic()
+                    self.reparented.inc()
+                    log.warning("relay_reparent", peer=ip, adopted=len(children),
+                                file=header['file_name'], chunk=header['chunk_index'], error=e)
+                    self.forward(header, children)
+                else:
+                    log.warning("relay_forward_failed", peer=ip, file=header['file_name'],
+                                chunk=header['chunk_index'], error=e)
+
+
+class TreeDistributor:
+    """Sends a file down a relay tree instead of to every peer directly.
+
+    The sender only uploads to ``fanout`` relays, which forward chunk by chunk,
+    so time to reach the whole class grows with the depth of the tree (log of
+    its size) rather than with the number of peers. Relays are the peers with
+    the best link and lowest RTT. If a relay fails, the sender sends to that
+    relay's children directly, only the chunks each of them still lacks (they
+    may have got part of the file from the relay before it failed).
+    """
+
+    def __init__(self, network, fanout=3):
+        self.network = network
+        self.fanout = fanout
+
+    def order_peers(self, peers):
+        table = self.network.peers
+
+        def key(ip):
+            info = table.get(ip)
+            if info is None:
+                return ((True, 0), float('inf'))
+            return (info.link_rank, info.srtt if info.srtt is not None else float('inf'))
+
+        return sorted(peers, key=key)
+
+    def distribute(self, file_path, peers=None):
+        """Send ``file_path`` to ``peers`` (default all) through the tree.
+
+        Blocks until the sender's own uploads finish and returns ``{ip: bool}`` for
+        the peers the sender uploaded to directly (relays and any adopted children).
+        """
+        targets = self.order_peers(self.network.peers if peers is None else peers)
+        tree = build_tree(targets, self.fanout)
+        log.info("tree_distribute", file=file_path, peers=len(targets), relays=len(tree), fanout=self.fanout)
+        results = {}
+        self._send_subtrees(file_path, tree, results)
+        return results
+
+    def _send_subtrees(self, file_path, subtrees, results, repair=False):
+        children = {ip: kids for ip, kids in subtrees}
+
+        def send(ip):
+            if not repair:
+                return self.network.send_file_chunks(file_path, ip, relay=children[ip])
+            # An orphan forwarded what it got from its dead relay, so its own gaps are its subtree's
+            missing = self.network.missing_chunks(ip, file_path)
+            if not missing:
+                return True
+            return self.network.send_file_chunks(file_path, ip, relay=children[ip], indices=missing)
+
+        outcomes = self.network.fan_out(send, peers=list(children))
+        orphans = []
+        for ip, outcome in outcomes.items():
+            results[ip] = outcome is True
+            if outcome is not True and children[ip]:
+                log.warning("relay_reparent", peer=ip, adopted=len(children[ip]), file=file_path)
+                orphans.extend(children[ip])
+        if orphans:
+            log.info("tree_repair_orphans", file=os.path.basename(file_path), orphans=len(orphans))
+            self._send_subtrees(file_path, orphans, results, repair=True)
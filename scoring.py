@@ -0,0 +1,116 @@
+import threading
+import time
+
+from netlog import get_logger
+
+log = get_logger('scoring')
+
+
+class PeerStats:
+    """Observed serving behaviour of one peer"""
+
+    def __init__(self):
+        self.throughput = None  # EWMA bytes/s of chunk replies
+        self.outstanding = 0
+        self.timeouts = 0
+        self.last_update = time.monotonic()
+
+
+class PeerScorer:
+    """Ranks peers as chunk sources by expected time to deliver a chunk.
+
+    The estimate is ``rtt + chunk_size / throughput``, where throughput is an
+    EWMA of past replies from that peer and RTT comes from the peer table. It is
+    scaled up by the requests already outstanding to the peer (load), by
+    ``remote_penalty`` for peers outside our local subnets, and by
+    ``wireless_penalty`` for peers reached over Wi-Fi. Peers with no history are
+    scored with the best throughput seen so far, so new sources get tried.
+    Timeouts count as a sample of ``timeout_bytes_per_s``.
+    """
+
+    def __init__(self, network, alpha=0.3, remote_penalty=2.0, wireless_penalty=1.5,
+                 default_throughput=4 * 1024 * 1024, timeout_bytes_per_s=64 * 1024):
+        self.network = network
+        self.alpha = alpha
+        self.remote_penalty = remote_penalty
+        self.wireless_penalty = wireless_penalty
+        self.default_throughput = default_throughput
+        self.timeout_bytes_per_s = timeout_bytes_per_s
+        self._stats = {}
+        self._lock = threading.Lock()
+        network.peers.subscribe(self._on_peer_change)
+
+    def _on_peer_change(self, event, info):
+        if event in ('expired', 'removed'):
+            self.forget(info.ip)
+
+    def _get(self, peer_ip):
+        stats = self._stats.get(peer_ip)
+        if stats is None:
+            stats = self._stats[peer_ip] = PeerStats()
+        return stats
+
+    def _sample(self, stats, rate):
+        if stats.throughput is None:
+            stats.throughput = rate
+        else:
+            stats.throughput = (1 - self.alpha) * stats.throughput + self.alpha * rate
+        stats.last_update = time.monotonic()
+
+    def on_request(self, peer_ip):
+        with self._lock:
+            self._get(peer_ip).outstanding += 1
+
+    def on_response(self, peer_ip, nbytes, elapsed):
+        """Record a chunk that arrived ``elapsed`` seconds after we asked for it"""
+        with self._lock:
+            stats = self._get(peer_ip)
+            stats.outstanding = max(0, stats.outstanding - 1)
+            self._sample(stats, nbytes / max(elapsed, 1e-4))
+
+    def on_failure(self, peer_ip):
+        """Record a request that failed or timed out"""
+        with self._lock:
+            stats = self._get(peer_ip)
+            stats.outstanding = max(0, stats.outstanding - 1)
+            stats.timeouts += 1
+            self._sample(stats, self.timeout_bytes_per_s)
+
+    def on_cancel(self, peer_ip):
+        """Record a request we withdrew because another peer answered first"""
+        with self._lock:
+            stats = self._get(peer_ip)
+            stats.outstanding = max(0, stats.outstanding - 1)
+
+    def forget(self, peer_ip):
+        with self._lock:
+            self._stats.pop(peer_ip, None)
+
+    def expected_time(self, peer_ip, nbytes=None):
+        """Estimated seconds for ``peer_ip`` to deliver ``nbytes`` (one chunk by default)"""
+        nbytes = nbytes or self.network.chunk_size
+        info = self.network.peers.get(peer_ip)
+        rtt = info.srtt if info is not None and info.srtt is not None else 0.05
+        with self._lock:
+            stats = self._stats.get(peer_ip)
+            known = [s.throughput for s in self._stats.values() if s.throughput]
+            throughput = stats.throughput if stats is not None and stats.throughput else (
+                max(known) if known else self.default_throughput)
+            outstanding = stats.outstanding if stats is not None else 0
+        estimate = (rtt + nbytes / throughput) * (1 + outstanding)
+        if self.network.interfaces.for_ip(peer_ip) is None and not peer_ip.startswith('127.'):
+            estimate *= self.remote_penalty
+        if info is not None and info.interface and info.link_rank[0]:
+            estimate *= self.wireless_penalty
+        return estimate
+
+    def best(self, peers, count=1, nbytes=None):
+        """The ``count`` peers expected to deliver soonest, best first"""
+        candidates = [ip for ip in dict.fromkeys(peers) if self.network.peers.is_reachable(ip)]
+        candidates.sort(key=lambda ip: self.expected_time(ip, nbytes))
+        return candidates[:count]
+
+    def snapshot(self):
+        with self._lock:
+            return {ip: {'throughput': s.throughput, 'outstanding': s.outstanding, 'timeouts': s.timeouts}
+                    for ip, s in self._stats.items()}
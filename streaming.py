@@ -0,0 +1,148 @@
+import mimetypes
+import re
+import threading
+from urllib.parse import quote, unquote
+
+from netlog import get_logger
+
+log = get_logger('streaming')
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def is_media(file_name):
+    """Whether a player could start on the file before it has fully arrived"""
+    kind = mimetypes.guess_type(file_name)[0] or ''
+    return kind.startswith(('video/', 'audio/'))
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range ``Range`` header, None for the whole
+    file, or ValueError if the range can't be satisfied"""
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None  # unsupported (e.g. multiple ranges): serve the whole file
+    first, last = match.group(1), match.group(2)
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"range {header} outside {size} bytes")
+    return start, end
+
+
+class StreamServer:
+    """Serves swarm files to a local media player over HTTP with Range support.
+
+    ``url_for(name)`` gives ``http://127.0.0.1:<port>/files/<name>``. A player
+    opening it gets the file while it is still downloading: each response is
+    written chunk by chunk through ``ChunkSwarm.read_range``, which waits for
+    the chunks and moves the playhead, so a seek in the player becomes a
+    Range request that re-prioritises the download from the new position.
+
+    The server only binds to loopback; it is for the player on this machine.
+    """
+
+    def __init__(self, swarm, host='127.0.0.1', port=0, read_timeout=30.0):
+        self.swarm = swarm
+        self.host = host
+        self.port = port
+        self.read_timeout = read_timeout
+        self._server = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start serving (once) from a daemon thread; returns self"""
+        with self._lock:
+            if self._server is not None:
+                return self
+            from http.server import ThreadingHTTPServer
+
+            self._server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, name='p2p-stream', daemon=True).start()
+        log.info("stream_server_started", host=self.host, port=self.port)
+        return self
+
+    def stop(self):
+        with self._lock:
+            server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    def url_for(self, file_name):
+        self.start()
+        return f"http://{self.host}:{self.port}/files/{quote(file_name)}"
+
+    def _handler_class(self):
+        from http.server import BaseHTTPRequestHandler
+
+        stream = self
+
+        class StreamHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self._serve(body=False)
+
+            def do_GET(self):
+                self._serve(body=True)
+
+            def _serve(self, body):
+                if not self.path.startswith('/files/'):
+                    self.send_error(404)
+                    return
+                file_name = unquote(self.path[len('/files/'):].split('?', 1)[0])
+                size = stream.swarm.file_size(file_name)
+                if size is None:
+                    self.send_error(404)
+                    return
+                try:
+                    byte_range = parse_range(self.headers.get('Range'), size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{size}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, end = byte_range or (0, size - 1)
+                self.send_response(206 if byte_range else 200)
+                self.send_header('Content-Type', mimetypes.guess_type(file_name)[0] or 'application/octet-stream')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(max(0, end - start + 1)))
+                if byte_range:
+                    self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+                self.end_headers()
+                if body:
+                    stream._write_range(self, file_name, start, end)
+
+            def log_message(self, format, *args):
+                pass
+
+        return StreamHandler
+
+    def _write_range(self, handler, file_name, start, end):
+        chunk_size = self.swarm.network.chunk_size
+        position = start
+        try:
+            while position <= end:
+                # One chunk (or what's left of it) per read, so the player gets data as it lands
+                length = min(chunk_size - position % chunk_size, end - position + 1)
+                data = self.swarm.read_range(file_name, position, length, timeout=self.read_timeout)
+                if not data:
+                    break
+                handler.wfile.write(data)
+                position += len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # Players drop the connection when they seek
+            log.debug("stream_closed", file=file_name, position=position)
+        except TimeoutError as e:
+            log.warning("stream_stalled", file=file_name, position=position, error=e)
+            handler.close_connection = True
@@ -0,0 +1,725 @@
+import base64
+import json
+import os
+import threading
+import time
+from itertools import chain
+from pathlib import Path
+
+from catalog import is_safe_file_name
+from delivery import STATE_PREFIX, decode_chunk_set, encode_chunk_set
+from netlog import get_logger
+from scoring import PeerScorer
+from choking import UploadScheduler
+
+log = get_logger('swarm')
+
+DEFAULT_SAVE_DIR = Path.home() / "Downloads" / "GEHU_P2P_Received"
+
+CATALOG_PREFIX = "CATALOG|"
+
+
+class ChunkSwarm:
+    """Chunk bookkeeping for swarm downloads, independent of any UI.
+
+    Tracks which chunks of each file we hold, which peers announced the rest,
+    answers REQUEST_CHUNK from other peers and assembles files once complete.
+    Chunks are held in memory only until then: a saved file is served and
+    read from disk through the network's ChunkCache.
+    Progress lines go to ``on_event(text)`` and finished files to
+    ``on_file_complete(file_name, path, size, sender_ip)``.
+
+    Each missing chunk is requested from the ``sources_per_chunk`` best holders
+    according to ``scorer`` (a PeerScorer) and not asked for again until
+    ``request_timeout`` passes without an answer, at which point the next-best
+    holder gets the request and the slow one is marked down in the scores.
+
+    Once no more than ``endgame_chunks`` chunks are missing, the swarm is in
+    endgame: each remaining chunk is requested from up to ``endgame_sources``
+    holders at once, and the others get CANCEL_CHUNK as soon as one copy lands,
+    so the download doesn't wait on the slowest holder. While chunks are in
+    flight a timer re-checks the file every ``request_timeout`` seconds, so the
+    last requests are retried even when no other traffic arrives. Between those
+    checks an arriving chunk only looks at the chunks not yet requested.
+
+    Requests from other peers are served through ``uploads`` (an
+    UploadScheduler), which caps concurrent uploads at ``upload_slots``.
+
+    Progress and completion are acknowledged to the node a file came from
+    (its ``origin``, which relays pass along), batched by the network's
+    AckBatcher, so the sender can track who has what.
+
+    With ``catch_up`` on, every peer we discover is asked for its catalog
+    (the files it holds and which chunks of each) and the chunks we lack are
+    pulled from those holders like any other missing chunk. A student who
+    joins late thus gets the files shared so far from the other students,
+    without the teacher sending anything again. Nodes that should not be
+    caught up from (the teacher) pass ``serve_catalog=False`` and don't answer
+    catalog requests at all. With ``auto_fetch`` off, catalog files are pulled
+    this way only once asked for with ``fetch``; the rest are just remembered
+    as available. Files that were pushed rather than published are not in the
+    catalog to be asked for, so they are still caught up on.
+
+    ``share(path)`` serves a local file from disk and publishes its manifest
+    in the network's FileCatalog; ``fetch(name)`` downloads a catalog file on
+    demand. Chunks of catalog files are checked against the manifest's hashes
+    as they arrive. A file's origin (the teacher who published or sent it) is
+    asked for a chunk only when no other holder can send it, and never for an
+    endgame duplicate, so students serve each other and the teacher's uplink
+    is left for what only it has.
+
+    ``read_range(name, offset, length)`` returns bytes of a file that may still
+    be downloading, waiting for the chunks that cover them. It moves the file's
+    playhead (see ``seek``): from then on missing chunks are requested in order
+    from the playhead onwards, at most ``stream_window`` at a time, so what a
+    media player needs next arrives first and the rest follows behind it.
+    """
+
+    def __init__(self, network, save_dir=None, on_event=None, on_file_complete=None,
+                 sources_per_chunk=1, request_timeout=5.0, upload_slots=4,
+                 endgame_chunks=4, endgame_sources=3, catch_up=True, auto_fetch=True,
+                 stream_window=8, serve_catalog=True):
+        self.network = network
+        self.save_dir = Path(save_dir) if save_dir else DEFAULT_SAVE_DIR
+        self.on_event = on_event
+        self.on_file_complete = on_file_complete
+        self.sources_per_chunk = sources_per_chunk
+        self.request_timeout = request_timeout
+        self.endgame_chunks = endgame_chunks
+        self.endgame_sources = endgame_sources
+        self.catch_up = catch_up
+        self.auto_fetch = auto_fetch
+        self.stream_window = stream_window
+        self.scorer = PeerScorer(network)
+        self.uploads = UploadScheduler(network, slots=upload_slots)
+
+        self.received_chunks = {}
+        self.expected_chunks = {}
+        self.received_files = {}
+        self.chunk_registry = {}
+        self._origins = {}  # file_name -> ip of the node that sent the file
+        self._wanted = set()  # files asked for with fetch
+        self._playheads = {}  # file_name -> chunk a reader is waiting for (streaming)
+        self._inflight = {}  # file_name -> {chunk_index: {peer_ip: requested_at}}
+        self._requested = {}  # file_name -> chunks with a request that has not timed out
+        self._missing = {}  # file_name -> chunks someone holds that we lack and haven't requested
+        self._timers = {}
+        self._lock = threading.RLock()
+        self._arrived = threading.Condition(self._lock)
+        network.register_request_handler(STATE_PREFIX, self._chunk_state)
+        if serve_catalog:
+            network.register_request_handler(CATALOG_PREFIX, lambda message, addr: json.dumps(self.catalog()))
+        network.peers.subscribe(self._on_peer_change)
+
+    def _emit(self, text):
+        if self.on_event:
+            self.on_event(text)
+
+    def handle_peer_message(self, message, sender_address):
+        """Handle swarm protocol messages, returning False for anything else"""
+        ip = sender_address[0]
+        try:
+            if message.startswith("CHUNK_ANNOUNCE"):
+                _, filename, chunk_idx = message.split("|")
+                chunk_idx = int(chunk_idx)
+                with self._lock:
+                    self._add_holder(filename, chunk_idx, ip)
+                self._emit(f"📣 {ip} has chunk {chunk_idx} of {filename}")
+
+            elif message.startswith("REQUEST_CHUNK"):
+                _, filename, chunk_idx = message.split("|")
+                chunk_idx = int(chunk_idx)
+                if self._holds(filename, chunk_idx):
+                    self.uploads.submit(ip, lambda: self._upload_chunk(ip, filename, chunk_idx),
+                                        key=(filename, chunk_idx))
+
+            elif message.startswith("CANCEL_CHUNK"):
+                _, filename, chunk_idx = message.split("|")
+                self.uploads.cancel(ip, (filename, int(chunk_idx)))
+
+            elif message.startswith("CHUNK_DATA"):
+                _, filename, chunk_idx, chunk_data_b64 = message.split("|", 3)
+                chunk_idx = int(chunk_idx)
+                if not is_safe_file_name(filename):
+                    log.warning("file_name_rejected", peer=ip, file=filename)
+                    return True
+                if not self._index_valid(filename, chunk_idx):
+                    log.warning("chunk_index_invalid", peer=ip, file=filename, chunk=chunk_idx)
+                    return True
+                chunk_data = base64.b64decode(chunk_data_b64)
+                if not self._verify(filename, chunk_idx, chunk_data, ip):
+                    return True
+                with self._lock:
+                    if self.received_files.get(filename):
+                        return True  # a late copy of a chunk of a file already saved
+                    self.received_chunks.setdefault(filename, {})[chunk_idx] = chunk_data
+                    self._arrived.notify_all()
+                    complete = (filename in self.expected_chunks
+                                and len(self.received_chunks[filename]) == self.expected_chunks[filename])
+                self._chunk_arrived(filename, chunk_idx, ip, len(chunk_data))
+                self._ack_progress(filename)
+                self._emit(f"📥 Received missing chunk {chunk_idx} of {filename} from {ip}")
+                if complete:
+                    self.assemble_file(filename, ip)
+                else:
+                    self.request_missing(filename)
+            else:
+                return False
+        except Exception as e:
+            self._emit(f"❌ Error handling peer message: {e}")
+        return True
+
+    def _chunk_state(self, message, sender_address):
+        """Answer CHUNK_STATE|file with the chunks we hold, for the sender's repair"""
+        file_name = message[len(STATE_PREFIX):]
+        with self._lock:
+            info = self.received_files.get(file_name)
+            if info and os.path.exists(info['path']):
+                return json.dumps({'complete': True, 'total': self.expected_chunks.get(file_name)})
+            total = self.expected_chunks.get(file_name)
+            have = list(self.received_chunks.get(file_name, {}))
+        if total is None:
+            return json.dumps({'total': None, 'have': ''})
+        return json.dumps({'total': total, 'have': encode_chunk_set(have, total)})
+
+    def _verify(self, file_name, index, data, peer_ip):
+        if self.network.catalog.verify(file_name, index, data):
+            return True
+        log.warning("chunk_hash_mismatch", peer=peer_ip, file=file_name, chunk=index)
+        self._emit(f"❌ Chunk {index} of {file_name} from {peer_ip} failed its hash check")
+        with self._lock:
+            self._drop_request(file_name, index, peer_ip)
+        self.scorer.on_failure(peer_ip)
+        return False
+
+    def _read_chunk(self, file_name, index):
+        """A chunk we hold, from memory or from the saved file; None if we don't have it"""
+        with self._lock:
+            chunk = self.received_chunks.get(file_name, {}).get(index)
+            info = self.received_files.get(file_name)
+        if chunk is not None or not info:
+            return chunk
+        try:
+            return self.network.chunk_cache.chunk(info['path'], index)
+        except OSError as e:
+            log.warning("chunk_read_failed", file=file_name, chunk=index, error=e)
+            return None
+
+    def catalog(self):
+        """The files we can serve: {file_name: {'total', 'have' or 'complete', 'origin', 'published'}}"""
+        entries = {}
+        with self._lock:
+            for file_name, chunks in self.received_chunks.items():
+                total = self.expected_chunks.get(file_name)
+                if total and chunks:
+                    entries[file_name] = {'total': total, 'have': encode_chunk_set(chunks, total),
+                                          'origin': self._origins.get(file_name)}
+            for file_name, info in self.received_files.items():
+                if info:
+                    total = self.expected_chunks.get(file_name) or -(-info['size'] // self.network.chunk_size)
+                    entries[file_name] = {'total': total, 'complete': True,
+                                          'origin': self._origins.get(file_name, info['sender'])}
+        for file_name, entry in entries.items():
+            entry['published'] = self.network.catalog.manifest(file_name) is not None
+        return entries
+
+    def _on_peer_change(self, event, info):
+        if self.catch_up and event in ('added', 'up'):
+            threading.Thread(target=self.catch_up_from, args=(info.ip,), daemon=True).start()
+
+    def catch_up_from(self, peer_ip):
+        """Learn which files a peer holds and pull the chunks of them we lack"""
+        try:
+            catalog = json.loads(self.network.request(peer_ip, CATALOG_PREFIX) or '{}')
+        except Exception as e:
+            log.debug("catalog_unavailable", peer=peer_ip, error=e)
+            return []
+        wanted = []
+        published = set()
+        with self._lock:
+            for file_name, entry in catalog.items():
+                total = entry.get('total')
+                if not total or file_name in self.received_files or not is_safe_file_name(file_name):
+                    continue
+                if self.expected_chunks.setdefault(file_name, total) != total:
+                    continue
+                held = range(total) if entry.get('complete') else decode_chunk_set(entry.get('have'), total)
+                for index in held:
+                    self._add_holder(file_name, index, peer_ip)
+                self.received_chunks.setdefault(file_name, {})
+                if entry.get('origin'):
+                    self._origins.setdefault(file_name, entry['origin'])
+                if entry.get('published'):
+                    published.add(file_name)
+                wanted.append(file_name)
+        if not self.auto_fetch:
+            # Published files wait to be fetched; pushed ones can't be, so pull those anyway
+            published.update(file_name for file_name in wanted
+                             if self.network.catalog.manifest(file_name) is not None)
+            with self._lock:
+                wanted = [file_name for file_name in wanted
+                          if file_name in self._wanted or file_name not in published]
+        if wanted:
+            log.info("catching_up", peer=peer_ip, files=len(wanted))
+        for file_name in wanted:
+            self._emit(f"🔄 Catching up on {file_name} from {peer_ip}")
+            self.request_missing(file_name)
+        return wanted
+
+    def _holds(self, file_name, index):
+        with self._lock:
+            info = self.received_files.get(file_name)
+            if info:
+                return 0 <= index * self.network.chunk_size < info['size']
+            return index in self.received_chunks.get(file_name, {})
+
+    def _upload_chunk(self, peer_ip, file_name, index):
+        with self._lock:
+            chunk = self.received_chunks.get(file_name, {}).get(index)
+            info = self.received_files.get(file_name)
+        if chunk is not None:
+            size, chunk_data = len(chunk), base64.b64encode(chunk).decode('utf-8')
+        elif info:
+            # Files on disk are encoded once in the shared cache, however many peers ask
+            try:
+                chunk_data = self.network.chunk_cache.encoded(info['path'], index)
+            except OSError as e:
+                log.warning("chunk_read_failed", file=file_name, chunk=index, error=e)
+                return 0
+            if chunk_data is None:
+                return 0
+            size = min(self.network.chunk_size, info['size'] - index * self.network.chunk_size)
+        else:
+            return 0
+        if self.network.send_message(peer_ip, f"CHUNK_DATA|{file_name}|{index}|{chunk_data}"):
+            return size
+        return 0
+
+    def _index_valid(self, file_name, index, total=None):
+        """Whether a chunk number fits the file, so a bad one can't stall its assembly"""
+        with self._lock:
+            total = self.expected_chunks.get(file_name, total)
+        return isinstance(index, int) and index >= 0 and (total is None or index < total)
+
+    def handle_file_chunk(self, chunk_info, sender_address):
+        """Handle a chunk from send_file_chunks (or a whole file from send_file)"""
+        try:
+            if not is_safe_file_name(chunk_info.get('file_name')):
+                log.warning("file_name_rejected", peer=sender_address[0], file=chunk_info.get('file_name'))
+                return
+            if chunk_info.get('type') == 'file_transfer':
+                self.save_file(chunk_info['file_name'], chunk_info['file_data'], sender_address[0])
+                return
+
+            required_keys = ['file_name', 'chunk_index', 'total_chunks', 'data']
+            for key in required_keys:
+                if key not in chunk_info:
+                    self._emit(f"❌ Missing key in chunk_info: {key}")
+                    return
+
+            file_name = chunk_info['file_name']
+            index = chunk_info['chunk_index']
+            total = chunk_info['total_chunks']
+            data = chunk_info['data']
+            sender_ip = sender_address[0]
+            if not isinstance(total, int) or not self._index_valid(file_name, index, total):
+                log.warning("chunk_index_invalid", peer=sender_ip, file=file_name, chunk=index, total=total)
+                return
+            if not self._verify(file_name, index, data, sender_ip):
+                return
+
+            with self._lock:
+                if self.received_files.get(file_name):
+                    return  # a late copy of a chunk of a file already saved
+                if file_name not in self.received_chunks:
+                    self.received_chunks[file_name] = {}
+                self.expected_chunks.setdefault(file_name, total)
+                self._origins.setdefault(file_name, chunk_info.get('origin') or sender_ip)
+
+                self.received_chunks[file_name][index] = data
+                self._arrived.notify_all()
+                self._add_holder(file_name, index, sender_ip)
+                complete = len(self.received_chunks[file_name]) >= total
+
+            self._chunk_arrived(file_name, index, sender_ip, len(data))
+            self._ack_progress(file_name)
+            self._emit(f" Received chunk {index + 1}/{total} of {file_name} from {sender_ip}")
+
+            for peer_ip in self.network.peers:
+                if peer_ip != sender_ip:
+                    self.network.send_message(peer_ip, f"CHUNK_ANNOUNCE|{file_name}|{index}")
+
+            if complete:
+                self.assemble_file(file_name, sender_ip)
+            else:
+                self.request_missing(file_name)
+
+        except Exception as e:
+            self._emit(f"❌ Error handling chunk: {e}")
+
+    def _chunk_arrived(self, file_name, index, peer_ip, nbytes):
+        """Settle the requests for a chunk that just arrived, cancelling redundant ones"""
+        now = time.monotonic()
+        with self._lock:
+            requested = self._inflight.get(file_name, {}).pop(index, {})
+            self._requested.get(file_name, set()).discard(index)
+            self._missing.get(file_name, set()).discard(index)
+        self.uploads.record_download(peer_ip, nbytes)
+        if requested.get(peer_ip, float('inf')) != float('inf'):
+            self.scorer.on_response(peer_ip, nbytes, now - requested[peer_ip])
+        for other, requested_at in requested.items():
+            if other == peer_ip:
+                continue
+            if requested_at != float('inf'):
+                self.scorer.on_cancel(other)
+            self.network.send_message(other, f"CANCEL_CHUNK|{file_name}|{index}")
+
+    def _ack_progress(self, file_name):
+        with self._lock:
+            origin = self._origins.get(file_name)
+            have = len(self.received_chunks.get(file_name, {}))
+            total = self.expected_chunks.get(file_name)
+        if origin and file_name not in self.received_files:
+            self.network.send_file_ack(origin, file_name, 'partial', have, total)
+
+    def request_missing(self, file_name, rescan=False):
+        """Ask the best-scored holders for missing chunks that are not already on their way.
+
+        Only the chunks not yet requested are looked at, so a chunk arriving
+        costs nothing per chunk still in flight. Requests in flight are checked
+        for timeouts on ``rescan`` (the recheck timer) and in endgame, when few
+        chunks are left.
+        """
+        now = time.monotonic()
+        plan = []
+        timed_out = []
+        # Pick sources and mark them in flight under the lock, so chunk handlers
+        # running concurrently don't request the same chunk twice
+        with self._lock:
+            total = self.expected_chunks.get(file_name)
+            if total is None or file_name in self.received_files:
+                return
+            have = self.received_chunks.get(file_name, {})
+            registry = self.chunk_registry.get(file_name, {})
+            origin = self._origins.get(file_name)
+            inflight = self._inflight.setdefault(file_name, {})
+            requested = self._requested.setdefault(file_name, set())
+            missing = self._missing.get(file_name)
+            if missing is None:
+                missing = self._missing[file_name] = {
+                    m for m, holders in registry.items() if holders and m not in have and m not in requested}
+            endgame = total - len(have) <= self.endgame_chunks
+            sources = self.endgame_sources if endgame else self.sources_per_chunk
+            scan = missing | inflight.keys() if rescan or endgame else missing
+            budget = None
+            playhead = self._playheads.get(file_name)
+            if playhead is None:
+                order = sorted(scan)
+            else:
+                # Streaming: sequential from the playhead, a bounded window in flight
+                budget = self.stream_window - len(requested)
+                order = self._from_playhead(scan, playhead, total)
+            settled, unsettled = [], []
+            for m in order:
+                if budget is not None and budget <= 0 and m != playhead:
+                    break
+                holders = registry.get(m)
+                if m in have or not holders or not 0 <= m < total:
+                    settled.append(m)
+                    continue
+                pending = inflight.get(m, {})
+                stale = [ip for ip, t in pending.items() if now - t >= self.request_timeout]
+                for peer_ip in stale:
+                    # Keep the slow peer out of the candidates for this chunk for a while
+                    pending[peer_ip] = float('inf')
+                    timed_out.append((m, peer_ip))
+                live = [ip for ip, t in pending.items() if t != float('inf')]
+                picked = []
+                wanted = sources - len(live)
+                if wanted > 0:
+                    candidates = [ip for ip in holders if ip not in pending]
+                    if not candidates and not live:
+                        candidates = list(holders)  # every holder timed out once; try them again
+                    others = [ip for ip in candidates if ip != origin]
+                    if others:
+                        picked = self.scorer.best(others, count=wanted)
+                    elif not live:
+                        picked = self.scorer.best(candidates, count=1)  # only the origin can send it
+                for peer_ip in picked:
+                    inflight.setdefault(m, pending)[peer_ip] = now
+                    self.scorer.on_request(peer_ip)
+                    plan.append((m, peer_ip))
+                if live or picked:
+                    settled.append(m)
+                    requested.add(m)
+                else:
+                    unsettled.append(m)
+                    requested.discard(m)
+                if budget is not None and picked and not live:
+                    budget -= 1
+            missing.difference_update(settled)
+            missing.update(unsettled)
+            waiting = bool(inflight)
+            if waiting and file_name not in self._timers:
+                timer = self._timers[file_name] = threading.Timer(self.request_timeout, self._recheck, (file_name,))
+                timer.daemon = True
+                timer.start()
+
+        if endgame and plan:
+            log.debug("endgame_requests", file=file_name, missing=total - len(have), requests=len(plan))
+        for m, peer_ip in timed_out:
+            self.scorer.on_failure(peer_ip)
+            log.debug("chunk_request_timeout", peer=peer_ip, file=file_name, chunk=m)
+        for m, peer_ip in plan:
+            self._request_chunk(file_name, m, peer_ip)
+
+    def _recheck(self, file_name):
+        with self._lock:
+            self._timers.pop(file_name, None)
+        self.request_missing(file_name, rescan=True)
+
+    def _request_chunk(self, file_name, index, peer_ip):
+        if not self.network.send_message(peer_ip, f"REQUEST_CHUNK|{file_name}|{index}"):
+            self.scorer.on_failure(peer_ip)
+            with self._lock:
+                self._drop_request(file_name, index, peer_ip)
+
+    @staticmethod
+    def _from_playhead(chunks, playhead, total):
+        """``chunks`` in the order a stream reads them: from the playhead to the end, then the start"""
+        left = len(chunks)
+        for m in chain(range(playhead, total), range(playhead)):
+            if not left:
+                return
+            if m in chunks:
+                left -= 1
+                yield m
+
+    def _add_holder(self, file_name, index, peer_ip):
+        """Record that a peer holds a chunk; the caller holds the lock"""
+        holders = self.chunk_registry.setdefault(file_name, {}).setdefault(index, [])
+        if peer_ip not in holders:
+            holders.append(peer_ip)
+        missing = self._missing.get(file_name)
+        if (missing is not None and index not in self.received_chunks.get(file_name, {})
+                and index not in self._requested.get(file_name, ())):
+            missing.add(index)
+
+    def _drop_request(self, file_name, index, peer_ip):
+        """Forget a request that failed, so the chunk is asked for again; the caller holds the lock"""
+        pending = self._inflight.get(file_name, {}).get(index)
+        if pending is None:
+            return
+        pending.pop(peer_ip, None)
+        if not pending:
+            del self._inflight[file_name][index]
+        if not any(t != float('inf') for t in pending.values()):
+            self._requested.get(file_name, set()).discard(index)
+            missing = self._missing.get(file_name)
+            if missing is not None and index not in self.received_chunks.get(file_name, {}):
+                missing.add(index)
+
+    def assemble_file(self, file_name, sender_ip):
+        if not is_safe_file_name(file_name):
+            raise ValueError(f"unsafe file name {file_name!r}")
+        with self._lock:
+            chunks = self.received_chunks.get(file_name, {})
+            if len(chunks) != self.expected_chunks.get(file_name) or file_name in self.received_files:
+                return
+            # Claim the file so concurrent last chunks don't assemble it twice
+            self.received_files[file_name] = None
+
+        file_path = self.save_dir / file_name
+        try:
+            with self._lock:
+                ordered = [chunks[i] for i in range(len(chunks))]
+            self.save_dir.mkdir(parents=True, exist_ok=True)
+            with self.network.assembly_seconds.time():
+                with open(file_path, 'wb') as f:
+                    for chunk in ordered:
+                        f.write(chunk)
+        except (KeyError, OSError) as e:
+            # Release the claim so the file can still be completed or fetched again
+            with self._lock:
+                if self.received_files.get(file_name, False) is None:
+                    del self.received_files[file_name]
+                total = self.expected_chunks.get(file_name, 0)
+                for index in [i for i in chunks if not 0 <= i < total]:
+                    del chunks[index]
+            log.error("assembly_failed", file=file_name, path=str(file_path), error=e)
+            self._emit(f"❌ Could not assemble {file_name}: {e}")
+            return
+
+        self._complete(file_name, file_path, sender_ip)
+
+    def save_file(self, file_name, data, sender_ip):
+        """Store a file that arrived in one piece"""
+        if not is_safe_file_name(file_name):
+            raise ValueError(f"unsafe file name {file_name!r}")
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        file_path = self.save_dir / file_name
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        self._emit(f" 📥 Received file: {file_name} ({len(data)} bytes) from {sender_ip}")
+        self._complete(file_name, file_path, sender_ip)
+
+    def _complete(self, file_name, file_path, sender_ip):
+        file_size = os.path.getsize(file_path)
+        with self._lock:
+            self.received_files[file_name] = {
+                'path': str(file_path),
+                'size': file_size,
+                'sender': sender_ip,
+                'completed': time.time()
+            }
+            origin = self._origins.get(file_name, sender_ip)
+            total = self.expected_chunks.get(file_name)
+            self._wanted.discard(file_name)
+            self._playheads.pop(file_name, None)
+            self._requested.pop(file_name, None)
+            self._missing.pop(file_name, None)
+            # The file on disk serves its chunks from now on (see _read_chunk and _upload_chunk)
+            self.received_chunks.pop(file_name, None)
+            self._arrived.notify_all()
+        # Chunks came from several peers, none of which sent the whole file
+        self.network.progress.finish_file('receive', file_name)
+        self.network.catalog.hold(file_name)
+        if origin:
+            self.network.send_file_ack(origin, file_name, 'complete', total, total)
+        log.info("file_complete", file=file_name, size=file_size, sender=sender_ip)
+        if self.on_file_complete:
+            self.on_file_complete(file_name, str(file_path), file_size, sender_ip)
+
+    def add_local_file(self, file_path):
+        """Serve a local file's chunks to peers that request them (seeding).
+
+        Chunks are read from the file as they are requested rather than held in memory.
+        """
+        file_path = Path(file_path)
+        size = file_path.stat().st_size
+        with self._lock:
+            self.expected_chunks[file_path.name] = -(-size // self.network.chunk_size)
+            self.received_files[file_path.name] = {
+                'path': str(file_path),
+                'size': size,
+                'sender': None,
+                'completed': time.time()
+            }
+        return file_path.name
+
+    def share(self, file_path):
+        """Seed a local file and publish it in the catalog; returns its manifest"""
+        self.add_local_file(file_path)
+        return self.network.catalog.publish(file_path)
+
+    def has_or_wants(self, file_name):
+        """Whether a file is complete here or already being fetched"""
+        with self._lock:
+            return bool(self.received_files.get(file_name)) or file_name in self._wanted
+
+    def fetch(self, file_name):
+        """Download a catalog file on demand; returns False if nobody is known to have it"""
+        entry = self.network.catalog.get(file_name)
+        if entry is None:
+            return False
+        manifest = entry['manifest']
+        total = manifest['total_chunks']
+        with self._lock:
+            if file_name in self.received_files:
+                return True
+            if self.expected_chunks.get(file_name, total) != total:
+                # Left over from an older version of the file
+                self.received_chunks.pop(file_name, None)
+                self.chunk_registry.pop(file_name, None)
+                self._inflight.pop(file_name, None)
+                self._requested.pop(file_name, None)
+                self._missing.pop(file_name, None)
+            self._wanted.add(file_name)
+            self.expected_chunks[file_name] = total
+            self.received_chunks.setdefault(file_name, {})
+            if entry['publisher']:
+                self._origins.setdefault(file_name, entry['publisher'])
+            # Sources hold the whole file; other students may have parts of it
+            for peer_ip in entry['sources']:
+                for index in range(total):
+                    self._add_holder(file_name, index, peer_ip)
+        log.info("fetch_started", file=file_name, chunks=total, sources=len(entry['sources']))
+        self._emit(f"⬇️ Downloading {file_name} from {len(entry['sources'])} peer(s)")
+        if total == 0:
+            self.assemble_file(file_name, entry['publisher'])
+            return True
+        self.request_missing(file_name)
+        others = [ip for ip in self.network.peers if ip not in entry['sources']]
+        if others:
+            threading.Thread(target=self.network.fan_out, args=(self.catch_up_from, others), daemon=True).start()
+        return True
+
+    def file_size(self, file_name):
+        """Size in bytes of a file we hold or that is in the catalog, None if unknown"""
+        with self._lock:
+            info = self.received_files.get(file_name)
+        if info:
+            return info['size']
+        manifest = self.network.catalog.manifest(file_name)
+        return manifest['size'] if manifest else None
+
+    def seek(self, file_name, index):
+        """Make chunk ``index`` the next one fetched, downloading the file if needed"""
+        with self._lock:
+            if file_name in self.received_files:
+                return
+            self._playheads[file_name] = index
+            fetching = file_name in self._wanted or (self.auto_fetch and file_name in self.expected_chunks)
+        if not fetching and self.fetch(file_name):
+            return  # fetch already requested from the playhead
+        self.request_missing(file_name)
+
+    def read_range(self, file_name, offset, length, timeout=30.0):
+        """Bytes ``offset`` to ``offset + length`` of a file, waiting for missing chunks.
+
+        Raises TimeoutError if the chunks don't arrive within ``timeout`` seconds.
+        """
+        chunk_size = self.network.chunk_size
+        size = self.file_size(file_name)
+        if size is not None:
+            length = max(0, min(length, size - offset))
+        if length <= 0:
+            return b''
+        first, last = offset // chunk_size, (offset + length - 1) // chunk_size
+        deadline = time.monotonic() + timeout
+        parts = []
+        for index in range(first, last + 1):
+            chunk = self._read_chunk(file_name, index)
+            if chunk is None:
+                self.seek(file_name, index)
+            while chunk is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"chunk {index} of {file_name} did not arrive")
+                with self._arrived:
+                    if index not in self.received_chunks.get(file_name, {}) and not self.received_files.get(file_name):
+                        self._arrived.wait(min(remaining, self.request_timeout))
+                chunk = self._read_chunk(file_name, index)
+                if chunk is None:
+                    self.request_missing(file_name)
+            start = offset - index * chunk_size if index == first else 0
+            end = offset + length - index * chunk_size if index == last else len(chunk)
+            parts.append(chunk[start:end])
+        return b''.join(parts)
+
+    def discard(self, file_name):
+        """Forget everything held in memory about a file"""
+        with self._lock:
+            self.received_chunks.pop(file_name, None)
+            self.expected_chunks.pop(file_name, None)
+            self.chunk_registry.pop(file_name, None)
+            self._origins.pop(file_name, None)
+            self._playheads.pop(file_name, None)
+            self.received_files.pop(file_name, None)
+            self._inflight.pop(file_name, None)
+            self._requested.pop(file_name, None)
+            self._missing.pop(file_name, None)
+            timer = self._timers.pop(file_name, None)
+        if timer is not None:
+            timer.cancel()
+        self.network.progress.finish_file('receive', file_name, "discarded")
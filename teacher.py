@@ -1,17 +1,22 @@
+from startup import STARTUP
 import sys
 import threading
 import os
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QTextEdit, QLineEdit, QPushButton, 
-                             QLabel, QFileDialog, QMessageBox, QGroupBox, QListWidget)
-from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
-from network import PeerNetwork
+                             QLabel, QFileDialog, QMessageBox, QGroupBox, QListView,
+                             QProgressBar)
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+from delivery import DeliveryTracker
+from models import PeerListModel, LogModel, follow_tail
+from guibridge import GuiBridge
+
+STARTUP.mark('imports')
 
 class SignalHandler(QObject):
     
-    peer_discovered = pyqtSignal(str)
-    status_update = pyqtSignal(str)
     show_message_box = pyqtSignal(str, str, int) 
+    broadcast_finished = pyqtSignal(int, int)
 
 class TeacherWindow(QMainWindow):
     def __init__(self):
@@ -21,19 +26,31 @@ class TeacherWindow(QMainWindow):
         
         # Initialize signal handler
         self.signal_handler = SignalHandler()
-        self.signal_handler.peer_discovered.connect(self.add_peer_to_list)
-        self.signal_handler.status_update.connect(self.update_status)
         self.signal_handler.show_message_box.connect(self.display_message_box)
+        self.signal_handler.broadcast_finished.connect(self.on_broadcast_finished)
+        self.transfers = {}
+
+        # Frequent network events reach the widgets in batches, 20 times a second
+        self.ui = GuiBridge(rate=20, parent=self)
+        self.ui.subscribe('peer', self.update_peers)
+        self.ui.subscribe('status', self.update_status)
+        self.ui.subscribe('progress', self.update_progress)
+        self.ui.subscribe('delivery', self.update_delivery)
         
-        # Initialize network
-        self.network = PeerNetwork(
-            port=8080,
-            file_port=8081,
-            on_peer_discovered=self.on_peer_discovered
-        )
+        # Who has which file, from the students' acks
+        self.delivery = DeliveryTracker(
+            on_change=lambda file_name, summary: self.ui.latest('delivery', file_name, summary))
+        self.last_file = None
+        
+        # The network, relay tree and swarm are created once the window is up (see _bring_up_network)
+        self.network = None
+        self.distributor = None
+        self.swarm = None
         
         self.init_ui()
-        self.start_listening()
+        STARTUP.mark('window_built')
+        # Open sockets and broadcast only after the window has been shown
+        QTimer.singleShot(0, self.start_network)
     
     def init_ui(self):
         # Main widget and layout
@@ -44,7 +61,10 @@ class TeacherWindow(QMainWindow):
         peers_group = QGroupBox("Connected Peers")
         peers_layout = QVBoxLayout(peers_group)
         
-        self.peers_list = QListWidget()
+        self.peers_model = PeerListModel(self)
+        self.peers_list = QListView()
+        self.peers_list.setUniformItemSizes(True)
+        self.peers_list.setModel(self.peers_model)
         peers_layout.addWidget(self.peers_list)
         
         refresh_btn = QPushButton("Refresh Peers")
@@ -85,54 +105,164 @@ class TeacherWindow(QMainWindow):
         send_file_btn.setStyleSheet("background-color: #6C63FF; color: white;")
         file_layout.addWidget(send_file_btn, 1)
         
+        publish_btn = QPushButton("Publish")
+        publish_btn.setToolTip("List the file in the catalog; students download it when they open it")
+        publish_btn.clicked.connect(self.publish_thread)
+        file_layout.addWidget(publish_btn, 1)
+        
+        resend_btn = QPushButton("Resend to Stragglers")
+        resend_btn.clicked.connect(self.resend_thread)
+        file_layout.addWidget(resend_btn, 1)
+        
         main_layout.addWidget(file_group)
         
         # Status bar for feedback
         status_group = QGroupBox("Status")
         status_layout = QVBoxLayout(status_group)
         
-        self.status_text = QTextEdit()
-        self.status_text.setReadOnly(True)
+        self.status_model = LogModel(parent=self)
+        self.status_text = QListView()
+        self.status_text.setUniformItemSizes(True)
+        self.status_text.setModel(self.status_model)
+        follow_tail(self.status_text)
         self.status_text.setMaximumHeight(100)
         status_layout.addWidget(self.status_text)
         
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        status_layout.addWidget(self.progress_bar)
+        
+        self.progress_label = QLabel("Idle")
+        status_layout.addWidget(self.progress_label)
+        
+        self.delivery_label = QLabel("No files sent yet")
+        status_layout.addWidget(self.delivery_label)
+        
         main_layout.addWidget(status_group)
         
         self.setCentralWidget(central_widget)
     
+    def showEvent(self, event):
+        super().showEvent(event)
+        if STARTUP.elapsed('window_shown') is None:
+            STARTUP.mark('window_shown')
+    
+    def start_network(self):
+        """Bring up the network off the GUI thread, once the window is interactive"""
+        STARTUP.mark('interactive')
+        threading.Thread(target=self._bring_up_network, name='p2p-startup', daemon=True).start()
+    
+    def _bring_up_network(self):
+        """Import and start the network stack; the window is usable meanwhile"""
+        from network import PeerNetwork
+        from relay import TreeDistributor
+        from swarm import ChunkSwarm
+        
+        network = PeerNetwork(
+            port=8080,
+            file_port=8081,
+            on_peer_discovered=self.on_peer_discovered,
+            on_peer_lost=self.on_peer_lost,
+            on_message_received=self.handle_peer_message,
+            on_file_ack=lambda file_name, status, addr: self.delivery.record(file_name, addr[0], status),
+            on_transfer_progress=lambda snapshot: self.ui.latest('progress', snapshot['transfer_id'], snapshot)
+        )
+        # Large classes get the file through a relay tree so our uplink only feeds a few students
+        self.distributor = TreeDistributor(network, fanout=3)
+        # Serves the chunks of published files to the students who open them; it
+        # doesn't answer catalog requests, so late joiners catch up from the students
+        self.swarm = ChunkSwarm(network, catch_up=False, auto_fetch=False, serve_catalog=False)
+        self.network = network
+        self.start_listening()
+        metrics_port = os.environ.get('GEHU_P2P_METRICS_PORT')
+        if metrics_port:
+            self.network.start_metrics_server(int(metrics_port))
+        STARTUP.mark('network_ready')
+        STARTUP.finish('teacher')
+    
     def start_listening(self):
-        """Start listening for incoming peers (UDP)"""
+        """Start listening for incoming peers (UDP), student messages and acks"""
         threading.Thread(target=self.network.listen_for_peers, daemon=True).start()
+        threading.Thread(target=self.network.listen_for_messages, daemon=True).start()
+        # Older student clients still acknowledge files on the ack port
+        threading.Thread(target=self.network.listen_for_acks, daemon=True).start()
         
         # Broadcast presence to find peers
         self.refresh_peers()
     
+    def network_ready(self):
+        """Whether the network is up; asks the teacher to wait if it isn't"""
+        if self.network is not None:
+            return True
+        self.signal_handler.show_message_box.emit("Starting Up", "The network is still starting, try again in a moment.", QMessageBox.Warning)
+        return False
+    
     def refresh_peers(self):
         """Broadcast to discover peers"""
+        if not self.network_ready():
+            return
         self.network.discover_peers()
-        self.signal_handler.status_update.emit("Searching for peers...")
+        self.ui.post('status', "Searching for peers...")
     
     def on_peer_discovered(self, message, address):
         """Callback when a peer is discovered"""
         ip_address = address[0]
-        self.signal_handler.peer_discovered.emit(ip_address)
-    
-    @pyqtSlot(str)
-    def add_peer_to_list(self, ip_address):
-        """Add discovered peer to the UI list"""
-        # Check if already in the list widget
-        items = [self.peers_list.item(i).text() for i in range(self.peers_list.count())]
-        if ip_address not in items:
-            self.peers_list.addItem(ip_address)
-            self.signal_handler.status_update.emit(f"New peer discovered: {ip_address}")
-    
-    @pyqtSlot(str)
-    def update_status(self, message):
-        """Update status text"""
-        self.status_text.append(message)
-        # Scroll to bottom
-        scrollbar = self.status_text.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
+        self.ui.post('peer', (ip_address, True))
+    
+    def on_peer_lost(self, ip_address):
+        self.delivery.forget_peer(ip_address)
+        self.ui.post('peer', (ip_address, False))
+    
+    def handle_peer_message(self, message, address):
+        """Record acks and serve chunk requests for published files"""
+        if not self.delivery.handle_peer_message(message, address):
+            self.swarm.handle_peer_message(message, address)
+    
+    def update_delivery(self, summaries):
+        """Show how many students have the most recently sent file"""
+        for summary in summaries:
+            if summary['file_name'] != self.last_file:
+                continue
+            stragglers = summary['peers'] - summary['complete']
+            text = f"{summary['file_name']}: {summary['complete']}/{summary['peers']} student(s) have it"
+            if stragglers:
+                text += f", {stragglers} still missing ({summary['percent']:.0f}% delivered)"
+            self.delivery_label.setText(text)
+    
+    def update_peers(self, events):
+        """Apply a batch of (ip, joined) peer events to the list"""
+        lines = []
+        for ip_address, joined in events:
+            if joined and self.peers_model.add(ip_address):
+                lines.append(f"New peer discovered: {ip_address}")
+            elif not joined:
+                self.peers_model.remove(ip_address)
+                lines.append(f"Peer left: {ip_address}")
+        self.update_status(lines)
+    
+    def update_status(self, lines):
+        """Append a batch of lines to the status log"""
+        self.status_model.append(lines)
+    
+    def update_progress(self, snapshots):
+        """Show combined progress of the files currently being sent"""
+        for snapshot in snapshots:
+            if snapshot['direction'] == 'send':
+                self.transfers[snapshot['transfer_id']] = snapshot
+        if not self.transfers:
+            return
+        active = [t for t in self.transfers.values() if not t['done']]
+        if not active:
+            self.transfers.clear()
+            self.progress_bar.setValue(100)
+            self.progress_label.setText("Idle")
+            return
+        done = sum(t['bytes_done'] for t in active)
+        total = sum(t['total_bytes'] or 0 for t in active)
+        rate = sum(t['rate'] for t in active)
+        self.progress_bar.setValue(int(done * 100 / total) if total else 0)
+        eta = max((t['eta'] or 0) for t in active)
+        self.progress_label.setText(f"Sending to {len(active)} peer(s): {rate / 1024:.0f} KB/s, ETA {eta:.0f}s")
     
     @pyqtSlot(str, str, int)
     def display_message_box(self, title, message, icon_type=QMessageBox.Information):
@@ -155,22 +285,23 @@ class TeacherWindow(QMainWindow):
             self.signal_handler.show_message_box.emit("Empty Message", "Please enter a message to broadcast.", QMessageBox.Warning)
             return
             
+        if not self.network_ready():
+            return
         if not self.network.peers:
             self.signal_handler.show_message_box.emit("No Peers", "No peers connected to send message to.", QMessageBox.Warning)
             return
             
-        success_count = 0
-        failed_count = 0
-        
-        for peer in self.network.peers:
-            peer_ip = peer[0] if isinstance(peer, tuple) else peer
-            if self.network.send_message(peer_ip, message):
-                success_count += 1
-            else:
-                failed_count += 1
-        
+        # Sent from the network's worker threads; the result comes back through a signal
+        future = self.network.broadcast(message)
+        future.add_done_callback(
+            lambda f: self.signal_handler.broadcast_finished.emit(len(f.result().succeeded), len(f.result().failed)))
+        self.ui.post('status', f"Broadcasting message to {len(self.network.peers)} peer(s)...")
+    
+    @pyqtSlot(int, int)
+    def on_broadcast_finished(self, success_count, failed_count):
+        """Report the outcome of broadcast_message"""
         status = f"Message sent to {success_count} peer(s), failed for {failed_count} peer(s)"
-        self.signal_handler.status_update.emit(status)
+        self.ui.post('status', status)
         
         if success_count > 0:
             self.message_entry.clear()
@@ -186,37 +317,90 @@ class TeacherWindow(QMainWindow):
         """Send selected file to all peers"""
         file_path = self.file_path_entry.text()
         if not file_path or not os.path.isfile(file_path):
-            self.signal_handler.status_update.emit(" Invalid file selected")
+            self.ui.post('status', " Invalid file selected")
             self.signal_handler.show_message_box.emit("Warning", "Please select a valid file to send", QMessageBox.Warning)
             return
         
+        if not self.network_ready():
+            return
         if not self.network.peers:
-            self.signal_handler.status_update.emit(" No peers discovered")
+            self.ui.post('status', " No peers discovered")
             self.signal_handler.show_message_box.emit("No Peers", "No peers discovered to send the file to.", QMessageBox.Warning)
             return
         
         file_name = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
-        self.signal_handler.status_update.emit(f"Sending {file_name} ({file_size} bytes) to {len(self.network.peers)} peer(s)...")
+        self.ui.post('status', f"Sending {file_name} ({file_size} bytes) to {len(self.network.peers)} peer(s)...")
+        self.last_file = file_name
+        self.delivery.expect(file_name, list(self.network.peers))
         
         successful_sends, failed_sends = 0, 0
-        for peer in self.network.peers:
-            peer_ip = peer[0] if isinstance(peer, tuple) else peer
-            try:
-                if self.network.send_file(file_path, peer_ip):
-                    successful_sends += 1
-                    self.signal_handler.status_update.emit(f" Sent to {peer_ip}")
-                else:
-                    failed_sends += 1
-                    self.signal_handler.status_update.emit(f" Failed sending to {peer_ip}")
-            except Exception as e:
+        if len(self.network.peers) > self.distributor.fanout:
+            results = self.distributor.distribute(file_path)
+            self.ui.post('status', f" Relayed through {len(results)} peer(s)")
+        else:
+            # Send to every peer in parallel so an unreachable laptop only delays itself
+            results = self.network.fan_out(lambda peer_ip: self.network.send_file(file_path, peer_ip))
+        for peer_ip, outcome in results.items():
+            if outcome is True:
+                successful_sends += 1
+                self.ui.post('status', f" Sent to {peer_ip}")
+            elif isinstance(outcome, Exception):
                 failed_sends += 1
-                self.signal_handler.status_update.emit(f" Error sending to {peer_ip}: {str(e)}")
+                self.ui.post('status', f" Error sending to {peer_ip}: {str(outcome)}")
+            else:
+                failed_sends += 1
+                self.ui.post('status', f" Failed sending to {peer_ip}")
         
         result = f"File successfully sent to {successful_sends} peer(s), failed for {failed_sends}."
-        self.signal_handler.status_update.emit(result)
+        self.ui.post('status', result)
         
         self.signal_handler.show_message_box.emit("File Sent", result, QMessageBox.Information)
+    
+    def publish_thread(self):
+        threading.Thread(target=self.publish_file, daemon=True).start()
+    
+    def publish_file(self):
+        """Add the selected file to the session catalog without sending it to anyone"""
+        file_path = self.file_path_entry.text()
+        if not file_path or not os.path.isfile(file_path):
+            self.signal_handler.show_message_box.emit("Warning", "Please select a valid file to publish", QMessageBox.Warning)
+            return
+        if not self.network_ready():
+            return
+        try:
+            manifest = self.swarm.share(file_path)
+        except Exception as e:
+            self.ui.post('status', f" Failed to publish {os.path.basename(file_path)}: {e}")
+            return
+        self.last_file = manifest['name']
+        self.delivery.expect(manifest['name'], [])
+        self.ui.post('status', f"Published {manifest['name']} ({manifest['size']} bytes, {manifest['total_chunks']} chunks); "
+                               f"students download it on demand")
+    
+    def resend_thread(self):
+        threading.Thread(target=self.resend_to_stragglers, daemon=True).start()
+    
+    def resend_to_stragglers(self):
+        """Send the chunks of the last file that the unacknowledged students still lack"""
+        file_path = self.file_path_entry.text()
+        file_name = os.path.basename(file_path) if file_path else None
+        if not file_name or file_name != self.last_file or not os.path.isfile(file_path):
+            self.signal_handler.show_message_box.emit("Nothing to Resend", "Send a file first.", QMessageBox.Warning)
+            return
+        if not self.network_ready():
+            return
+        
+        stragglers = [ip for ip in self.delivery.stragglers(file_name) if self.network.peers.is_reachable(ip)]
+        if not stragglers:
+            self.ui.post('status', f"Every reachable student has {file_name}")
+            return
+        
+        self.ui.post('status', f"Repairing {file_name} on {len(stragglers)} straggler(s)...")
+        self.delivery.expect(file_name, stragglers)
+        results = self.network.repair(file_path, peers=stragglers)
+        sent = sum(1 for outcome in results.values() if outcome is True)
+        self.ui.post('status', f"Resent {file_name} to {sent}/{len(stragglers)} straggler(s)")
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,192 @@
+import threading
+import time
+from netlog import get_logger
+
+log = get_logger('telemetry')
+
+
+class TransferStats:
+    """Progress of a single file transfer to or from one peer"""
+
+    def __init__(self, transfer_id, direction, peer, file_name, total_bytes=None, total_chunks=None):
+        self.transfer_id = transfer_id
+        self.direction = direction
+        self.peer = peer
+        self.file_name = file_name
+        self.total_bytes = total_bytes
+        self.total_chunks = total_chunks
+        self.bytes_done = 0
+        self.chunks_done = 0
+        self.started = time.monotonic()
+        self.updated = self.started
+        self.finished = None
+        self.error = None
+        self.rate = 0.0
+        self._sample_time = self.started
+        self._sample_bytes = 0
+        self._last_emit = 0.0
+        self._chunks_seen = set()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def fraction(self):
+        if self.total_bytes:
+            return min(1.0, self.bytes_done / self.total_bytes)
+        if self.total_chunks:
+            return min(1.0, self.chunks_done / self.total_chunks)
+        return 1.0 if self.done else 0.0
+
+    def _sample(self, now):
+        # Smoothed rate over windows of at least 100 ms so single recv() calls don't make it jump around
+        elapsed = now - self._sample_time
+        if elapsed >= 0.1:
+            instant = (self.bytes_done - self._sample_bytes) / elapsed
+            self.rate = instant if not self.rate else 0.7 * self.rate + 0.3 * instant
+            self._sample_time = now
+            self._sample_bytes = self.bytes_done
+
+    def snapshot(self):
+        now = self.finished or time.monotonic()
+        elapsed = now - self.started
+        fraction = self.fraction()
+        eta = None
+        if self.done:
+            eta = 0.0
+        elif 0 < fraction and self.rate > 0 and self.total_bytes:
+            eta = (self.total_bytes - self.bytes_done) / self.rate
+        elif 0 < fraction:
+            eta = elapsed * (1 - fraction) / fraction
+        return {
+            'transfer_id': self.transfer_id,
+            'direction': self.direction,
+            'peer': self.peer,
+            'file_name': self.file_name,
+            'bytes_done': self.bytes_done,
+            'total_bytes': self.total_bytes,
+            'chunks_done': self.chunks_done,
+            'total_chunks': self.total_chunks,
+            'percent': round(fraction * 100, 1),
+            'rate': self.rate if not self.done else (self.bytes_done / elapsed if elapsed > 0 else 0.0),
+            'elapsed': elapsed,
+            'eta': eta,
+            'done': self.done,
+            'error': self.error,
+        }
+
+
+class ProgressTracker:
+    """Thread-safe registry of active transfers with throttled progress callbacks.
+
+    The callback receives a snapshot dict at most once per ``interval`` seconds per
+    transfer, plus a final one when the transfer finishes, so a GUI can bind it
+    straight to a progress bar without being flooded on every recv().
+    """
+
+    def __init__(self, callback=None, interval=0.25, keep_finished=100):
+        self.callback = callback
+        self.interval = interval
+        self.keep_finished = keep_finished
+        self._transfers = {}
+        self._lock = threading.Lock()
+
+    def start(self, direction, peer, file_name, total_bytes=None, total_chunks=None):
+        """Register a transfer (or return the active one for the same peer and file)"""
+        transfer_id = f"{direction}:{peer}:{file_name}"
+        with self._lock:
+            stats = self._transfers.get(transfer_id)
+            if stats is None or stats.done:
+                stats = TransferStats(transfer_id, direction, peer, file_name, total_bytes, total_chunks)
+                self._transfers[transfer_id] = stats
+                self._prune()
+        return transfer_id
+
+    def update(self, transfer_id, nbytes=0, chunks=0, chunk=None):
+        """Add progress to a transfer.
+
+        ``chunk`` is the index of the chunk that arrived; a chunk already counted
+        (a retry, repair or endgame duplicate) adds nothing.
+        """
+        with self._lock:
+            stats = self._transfers.get(transfer_id)
+            if stats is None or stats.done:
+                return
+            now = time.monotonic()
+            stats.updated = now
+            if chunk is not None:
+                if chunk in stats._chunks_seen:
+                    return
+                stats._chunks_seen.add(chunk)
+            stats.bytes_done += nbytes
+            stats.chunks_done += chunks
+            stats._sample(now)
+            if now - stats._last_emit < self.interval:
+                return
+            stats._last_emit = now
+            snapshot = stats.snapshot()
+        self._emit(snapshot)
+
+    def finish(self, transfer_id, error=None):
+        with self._lock:
+            stats = self._transfers.get(transfer_id)
+            if stats is None or stats.done:
+                return
+            stats.finished = time.monotonic()
+            stats.error = error
+            snapshot = stats.snapshot()
+        self._emit(snapshot)
+
+    def finish_file(self, direction, file_name, error=None):
+        """Finish every active transfer of a file in one direction, e.g. once it is assembled"""
+        with self._lock:
+            ids = [s.transfer_id for s in self._transfers.values()
+                   if s.direction == direction and s.file_name == file_name and not s.done]
+        for transfer_id in ids:
+            self.finish(transfer_id, error)
+
+    def expire(self, idle):
+        """Finish transfers that made no progress for ``idle`` seconds as stalled"""
+        cutoff = time.monotonic() - idle
+        with self._lock:
+            ids = [s.transfer_id for s in self._transfers.values() if not s.done and s.updated < cutoff]
+        for transfer_id in ids:
+            self.finish(transfer_id, f"stalled for {idle:.0f}s")
+        return len(ids)
+
+    def get(self, transfer_id):
+        with self._lock:
+            stats = self._transfers.get(transfer_id)
+            return stats.snapshot() if stats else None
+
+    def transfers(self, active_only=False):
+        with self._lock:
+            return [s.snapshot() for s in self._transfers.values() if not (active_only and s.done)]
+
+    def peer_totals(self):
+        """Aggregate bytes, current rate and active transfer count per peer"""
+        totals = {}
+        for snap in self.transfers():
+            peer = totals.setdefault(snap['peer'], {
+                'bytes_sent': 0, 'bytes_received': 0, 'rate': 0.0, 'active': 0
+            })
+            key = 'bytes_sent' if snap['direction'] == 'send' else 'bytes_received'
+            peer[key] += snap['bytes_done']
+            if not snap['done']:
+                peer['rate'] += snap['rate']
+                peer['active'] += 1
+        return totals
+
+    def _prune(self):
+        finished = [s for s in self._transfers.values() if s.done]
+        if len(finished) > self.keep_finished:
+            finished.sort(key=lambda s: s.finished)
+            for stats in finished[:len(finished) - self.keep_finished]:
+                del self._transfers[stats.transfer_id]
+
+    def _emit(self, snapshot):
+        if self.callback:
+            try:
+                self.callback(snapshot)
+            except Exception as e:
+                log.error("progress_callback_failed", transfer=snapshot['transfer_id'], error=e)
@@ -0,0 +1,48 @@
+import itertools
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Loopback nodes each bind their own 127.0.0.x address on these ports
+PORTS = dict(port=19080, file_port=19081, message_port=19008, ack_port=19010)
+_hosts = (f"127.0.0.{n}" for n in itertools.cycle(range(100, 250)))
+
+
+@pytest.fixture
+def node(tmp_path):
+    """Factory for listening loopback PeerNetworks, with a ChunkSwarm when ``swarm`` options are given"""
+    from network import PeerNetwork
+    from swarm import ChunkSwarm
+
+    def make(swarm=None, **options):
+        host = next(_hosts)
+        network = PeerNetwork(host=host, peer_cache=False, **dict(PORTS, **options))
+        if swarm is not None:
+            network.swarm = ChunkSwarm(network, save_dir=tmp_path / host, **swarm)
+            network.on_message_received = network.swarm.handle_peer_message
+            network.on_file_received = network.swarm.handle_file_chunk
+        for listener in (network.listen_for_files, network.listen_for_messages):
+            threading.Thread(target=listener, daemon=True).start()
+        return network
+
+    return make
+
+
+@pytest.fixture
+def wait():
+    """wait(predicate, timeout) polls until the predicate holds, returning whether it did"""
+
+    def until(predicate, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    return until
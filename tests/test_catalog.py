@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from catalog import MANIFESTS_PREFIX, PUBLISH_PREFIX, build_manifest
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return str(path), data
+
+
+def test_build_manifest_hashes_the_file_and_each_chunk(tmp_path):
+    path, data = write_file(tmp_path / 'f.bin', 2500)
+    blocks = []
+    manifest = build_manifest(path, 1000, on_block=lambda index, block: blocks.append(index))
+    assert manifest['name'] == 'f.bin'
+    assert manifest['size'] == 2500 and manifest['total_chunks'] == 3
+    assert manifest['sha256'] == hashlib.sha256(data).hexdigest()
+    assert manifest['chunks'][2] == hashlib.sha256(data[2000:]).hexdigest()
+    assert blocks == [0, 1, 2]
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path, _ = write_file(tmp_path / 'f.bin', 3000)
+    return build_manifest(path, 512 * 1024)
+
+
+def test_add_collects_sources_and_reports_changes(node, manifest):
+    changes = []
+    catalog = node(on_catalog_change=changes.append).catalog
+    assert catalog.add(manifest, '10.0.0.2')
+    assert catalog.add(manifest, '10.0.0.3')
+    assert not catalog.add(manifest, '10.0.0.3')
+    entry = catalog.get('f.bin')
+    assert entry['publisher'] == '10.0.0.2'
+    assert entry['sources'] == {'10.0.0.2', '10.0.0.3'}
+    assert len(changes) == 2
+    entry['sources'].clear()
+    assert catalog.get('f.bin')['sources'] == {'10.0.0.2', '10.0.0.3'}
+
+
+@pytest.mark.parametrize('bad', [{'name': '../f.bin', 'total_chunks': 1}, {'name': 'f.bin'}, {}])
+def test_add_rejects_invalid_manifests(node, bad):
+    catalog = node().catalog
+    assert not catalog.add(bad, '10.0.0.2')
+    assert catalog.entries() == []
+
+
+def test_newer_version_replaces_older_one(node, manifest):
+    catalog = node().catalog
+    catalog.add(manifest, '10.0.0.2')
+    older = dict(manifest, sha256='0' * 64, published=manifest['published'] - 10)
+    assert not catalog.add(older, '10.0.0.3')
+    newer = dict(manifest, sha256='1' * 64, published=manifest['published'] + 10)
+    assert catalog.add(newer, '10.0.0.3')
+    entry = catalog.get('f.bin')
+    assert entry['manifest']['sha256'] == '1' * 64 and entry['sources'] == {'10.0.0.3'}
+
+
+def test_verify_checks_chunks_against_the_manifest(node, tmp_path):
+    network = node()
+    path, data = write_file(tmp_path / 'f.bin', 3000)
+    network.catalog.add(build_manifest(path, network.chunk_size), '10.0.0.2')
+    assert network.catalog.verify('f.bin', 0, data)
+    assert not network.catalog.verify('f.bin', 0, data[:-1] + b'?')
+    assert network.catalog.verify('other.bin', 0, b'anything')
+
+
+def test_peers_list_only_published_and_held_files(node, manifest, tmp_path):
+    network = node()
+    path, _ = write_file(tmp_path / 'mine.bin', 100)
+    network.catalog.publish(path)
+    network.catalog.add(manifest, '10.0.0.2')
+    listed = lambda: [m['name'] for m in json.loads(network.catalog._list_manifests(MANIFESTS_PREFIX, None))]
+    assert listed() == ['mine.bin']
+    assert network.catalog.hold('f.bin')
+    assert sorted(listed()) == ['f.bin', 'mine.bin']
+    assert not network.catalog.hold('unknown.bin')
+    assert network.catalog.handle_peer_message(PUBLISH_PREFIX + 'not json', ('10.0.0.2', 1))
+    assert not network.catalog.handle_peer_message('HELLO', ('10.0.0.2', 1))
+
+
+def count_uploads(network):
+    uploads = []
+    upload = network.swarm._upload_chunk
+    network.swarm._upload_chunk = lambda peer_ip, *args: (uploads.append(peer_ip), upload(peer_ip, *args))[1]
+    return uploads
+
+
+def test_students_fetch_from_each_other_before_the_teacher(node, wait, tmp_path):
+    teacher = node(swarm={'catch_up': False, 'serve_catalog': False})
+    a = node(swarm={'auto_fetch': False})
+    for network in (teacher, a):
+        network.chunk_size = 64 * 1024
+    a.add_peer(teacher.host)
+    teacher.add_peer(a.host)
+    path, data = write_file(tmp_path / 'lecture.bin', 6 * 64 * 1024)
+    teacher.swarm.share(path)
+    assert wait(lambda: a.catalog.get('lecture.bin'))
+    assert a.swarm.received_files == {}  # nothing is downloaded until asked for
+    assert a.swarm.fetch('lecture.bin')
+    assert wait(lambda: a.swarm.received_files.get('lecture.bin'))
+
+    teacher_uploads = count_uploads(teacher)
+    b = node(swarm={'auto_fetch': False})
+    b.chunk_size = 64 * 1024
+    # Heard of from a student first, the file is still the teacher's
+    b.add_peer(a.host)
+    assert wait(lambda: b.catalog.get('lecture.bin'))
+    b.add_peer(teacher.host)
+    assert wait(lambda: b.catalog.get('lecture.bin')['sources'] == {a.host, teacher.host})
+    assert b.catalog.get('lecture.bin')['publisher'] == teacher.host
+    assert b.swarm.fetch('lecture.bin')
+    assert wait(lambda: b.swarm.received_files.get('lecture.bin'))
+    with open(b.swarm.received_files['lecture.bin']['path'], 'rb') as f:
+        assert f.read() == data
+    assert teacher_uploads == []
+
+
+def test_without_auto_fetch_pushed_files_are_still_caught_up(node, wait, tmp_path):
+    teacher = node(swarm={'catch_up': False, 'serve_catalog': False})
+    a = node(swarm={'auto_fetch': False})
+    teacher.add_peer(a.host)
+    a.add_peer(teacher.host)
+    pushed, _ = write_file(tmp_path / 'pushed.bin', 1000)
+    published, _ = write_file(tmp_path / 'published.bin', 1000)
+    teacher.send_file_chunks(pushed, a.host)
+    teacher.swarm.share(published)
+    assert wait(lambda: a.catalog.get('published.bin'))
+    assert a.swarm.fetch('published.bin')
+    assert wait(lambda: len([info for info in a.swarm.received_files.values() if info]) == 2)
+
+    b = node(swarm={'auto_fetch': False})
+    b.add_peer(a.host)
+    assert wait(lambda: b.swarm.received_files.get('pushed.bin'))
+    assert wait(lambda: b.catalog.get('published.bin'))
+    assert 'published.bin' not in b.swarm.received_files
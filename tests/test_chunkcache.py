@@ -0,0 +1,132 @@
+import base64
+import os
+import threading
+import time
+
+import pytest
+
+import chunkcache
+from chunkcache import ChunkCache
+from metrics import MetricsRegistry
+
+
+class FakeNetwork:
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.metrics = MetricsRegistry()
+
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / 'f.bin'
+    path.write_bytes(os.urandom(2500))
+    return path
+
+
+def rewrite(path, data):
+    """Replace a file's contents with a newer mtime, as an editor saving it would"""
+    stat = os.stat(path)
+    path.write_bytes(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_version_is_path_mtime_size_and_chunk_size(file):
+    network = FakeNetwork()
+    cache = ChunkCache(network)
+    stat = os.stat(file)
+    assert cache.version(str(file)) == (str(file), stat.st_mtime_ns, stat.st_size, 1000)
+    network.chunk_size = 500
+    assert cache.version(str(file))[3] == 500
+
+
+def test_chunks_are_read_once_and_served_from_memory(file):
+    cache = ChunkCache(FakeNetwork())
+    data = file.read_bytes()
+    assert cache.chunk(str(file), 2) == data[2000:]
+    assert cache.chunk(str(file), 2) == data[2000:]
+    assert cache.encoded(str(file), 1) == base64.b64encode(data[1000:2000]).decode()
+    assert cache.chunk(str(file), 3) is None
+    assert cache.chunk(str(file), -1) is None
+    assert cache.misses.value(kind='chunk') == 2
+    assert cache.hits.value(kind='chunk') == 1
+
+
+def test_edited_file_is_read_afresh(file):
+    cache = ChunkCache(FakeNetwork())
+    old = cache.chunk(str(file), 0)
+    manifest = cache.manifest(str(file))
+    rewrite(file, b'x' * 2500)  # same size, newer mtime
+    assert cache.chunk(str(file), 0) == b'x' * 1000 != old
+    assert cache.manifest(str(file))['sha256'] != manifest['sha256']
+    rewrite(file, b'y' * 10)
+    assert cache.chunk(str(file), 0) == b'y' * 10
+    assert cache.chunk(str(file), 1) is None
+
+
+def test_chunk_size_change_is_a_new_version(file):
+    network = FakeNetwork()
+    cache = ChunkCache(network)
+    assert len(cache.chunk(str(file), 0)) == 1000
+    network.chunk_size = 2000
+    assert len(cache.chunk(str(file), 0)) == 2000
+    assert cache.manifest(str(file))['total_chunks'] == 2
+
+
+def test_manifest_is_built_once_and_keeps_the_chunks_it_read(file):
+    cache = ChunkCache(FakeNetwork())
+    manifest = cache.manifest(str(file))
+    assert cache.manifest(str(file)) is manifest
+    assert manifest['total_chunks'] == 3
+    cache.chunk(str(file), 1)
+    assert cache.misses.value(kind='chunk') == 0
+
+
+def test_budget_evicts_least_recently_used(file):
+    cache = ChunkCache(FakeNetwork(), budget=2000)
+    cache.chunk(str(file), 0)
+    cache.chunk(str(file), 1)
+    cache.chunk(str(file), 0)
+    cache.chunk(str(file), 2)  # 500 bytes: evicts chunk 1, the least recently used
+    assert cache._size <= 2000
+    assert cache.evictions.value() == 1
+    misses = cache.misses.value(kind='chunk')
+    cache.chunk(str(file), 0)
+    assert cache.misses.value(kind='chunk') == misses
+    cache.chunk(str(file), 1)
+    assert cache.misses.value(kind='chunk') == misses + 1
+
+
+def test_chunk_larger_than_the_budget_is_still_served(file):
+    cache = ChunkCache(FakeNetwork(), budget=100)
+    assert cache.chunk(str(file), 0) == file.read_bytes()[:1000]
+    assert cache._size == 0
+
+
+def test_concurrent_callers_share_one_manifest_build(file, monkeypatch):
+    builds = []
+    build = chunkcache.build_manifest
+
+    def slow_build(*args, **kwargs):
+        builds.append(1)
+        time.sleep(0.2)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(chunkcache, 'build_manifest', slow_build)
+    cache = ChunkCache(FakeNetwork())
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.manifest(str(file)))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_failed_load_lets_the_next_caller_retry(file, monkeypatch):
+    cache = ChunkCache(FakeNetwork())
+    monkeypatch.setattr(chunkcache, 'build_manifest', lambda *a, **k: (_ for _ in ()).throw(OSError("disk")))
+    with pytest.raises(OSError):
+        cache.manifest(str(file))
+    monkeypatch.undo()
+    assert cache.manifest(str(file))['size'] == 2500
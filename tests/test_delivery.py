@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+import delivery
+from delivery import (ACK_PREFIX, AckBatcher, DeliveryTracker, decode_chunk_set,
+                      encode_chunk_set)
+from metrics import MetricsRegistry
+
+
+class FakeNetwork:
+    def __init__(self):
+        self.metrics = MetricsRegistry()
+        self.sent = []
+        self.up = True
+
+    def send_message(self, peer_ip, message):
+        if not self.up:
+            return False
+        assert message.startswith(ACK_PREFIX)
+        self.sent.append((peer_ip, json.loads(message[len(ACK_PREFIX):])))
+        return True
+
+
+@pytest.fixture
+def batcher():
+    # A long delay keeps the background flush out of the way; the tests flush by hand
+    return AckBatcher(FakeNetwork(), delay=3600)
+
+
+def test_acks_for_a_peer_go_out_as_one_message_with_the_newest_status(batcher):
+    for have in range(1, 6):
+        batcher.ack('10.0.0.2', 'a.bin', 'partial', have, 10)
+    batcher.ack('10.0.0.2', 'b.bin', 'complete', 3, 3)
+    batcher.ack('10.0.0.3', 'a.bin', 'partial', 1, 10)
+    batcher.flush()
+    sent = dict(batcher.network.sent)
+    assert len(batcher.network.sent) == 2
+    assert [(e['file'], e['status'], e['have']) for e in sent['10.0.0.2']] == [
+        ('a.bin', 'partial', 5), ('b.bin', 'complete', 3)]
+    assert len(sent['10.0.0.3']) == 1
+    batcher.flush()
+    assert len(batcher.network.sent) == 2
+
+
+def test_legacy_statuses_are_normalised(batcher):
+    batcher.ack('10.0.0.2', 'a.bin', 'success')
+    batcher.ack('10.0.0.2', 'b.bin', 'failed: disk full')
+    batcher.flush()
+    a, b = batcher.network.sent[0][1]
+    assert a['status'] == 'complete' and 'reason' not in a
+    assert b['status'] == 'failed' and b['reason'] == 'failed: disk full'
+
+
+def test_undelivered_acks_are_retried_unless_superseded(batcher):
+    batcher.network.up = False
+    batcher.ack('10.0.0.2', 'a.bin', 'partial', 1, 4)
+    batcher.ack('10.0.0.2', 'b.bin', 'partial', 1, 4)
+    batcher.flush()
+    assert batcher.network.sent == []
+    batcher.ack('10.0.0.2', 'a.bin', 'complete', 4, 4)
+    batcher.network.up = True
+    batcher.flush()
+    [(peer_ip, batch)] = batcher.network.sent
+    assert {e['file']: e['status'] for e in batch} == {'a.bin': 'complete', 'b.bin': 'partial'}
+
+
+def test_undelivered_acks_expire(batcher, monkeypatch):
+    batcher.network.up = False
+    batcher.ack('10.0.0.2', 'a.bin', 'partial', 1, 4)
+    now = delivery.time.time()
+    monkeypatch.setattr(delivery.time, 'time', lambda: now + batcher.max_age + 1)
+    batcher.flush()
+    assert batcher._pending == {}
+
+
+def test_tracker_follows_acks_from_expect_to_complete():
+    changes = []
+    tracker = DeliveryTracker(on_change=lambda name, summary: changes.append(summary))
+    tracker.expect('a.bin', ['10.0.0.2', '10.0.0.3', '10.0.0.4'])
+    batch = [{'file': 'a.bin', 'status': 'partial', 'have': 2, 'total': 4}]
+    assert tracker.handle_peer_message(ACK_PREFIX + json.dumps(batch), ('10.0.0.2', 1))
+    tracker.record('a.bin', '10.0.0.3', 'complete', total=4)
+    tracker.record('a.bin', '10.0.0.3', 'partial', 3, 4)  # late progress ack
+    assert tracker.matrix()['a.bin'] == {'10.0.0.2': 'partial', '10.0.0.3': 'complete', '10.0.0.4': 'pending'}
+    assert tracker.completion('a.bin') == pytest.approx((0.5 + 1) / 3)
+    assert tracker.stragglers('a.bin') == ['10.0.0.2', '10.0.0.4']
+    assert changes[-1]['complete'] == 1 and changes[-1]['pending'] == 1
+    tracker.forget_peer('10.0.0.4')
+    assert tracker.stragglers('a.bin') == ['10.0.0.2']
+    assert not tracker.handle_peer_message("HELLO", ('10.0.0.2', 1))
+
+
+def test_expect_keeps_peers_that_already_have_the_file():
+    tracker = DeliveryTracker()
+    tracker.expect('a.bin', ['10.0.0.2', '10.0.0.3'])
+    tracker.record('a.bin', '10.0.0.2', 'complete')
+    tracker.expect('a.bin', ['10.0.0.2', '10.0.0.3'])
+    assert tracker.matrix()['a.bin'] == {'10.0.0.2': 'complete', '10.0.0.3': 'pending'}
+
+
+def test_chunk_set_round_trip():
+    indices = {0, 3, 8, 9, 20}
+    encoded = encode_chunk_set(indices | {-1, 21, 99}, 21)
+    assert decode_chunk_set(encoded, 21) == indices
+    assert decode_chunk_set('', 5) == set()
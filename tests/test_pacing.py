@@ -0,0 +1,105 @@
+import pytest
+
+import pacing
+from pacing import AIMDPacer, FixedPacer, make_pacer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(pacing.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_unpaced_until_congestion():
+    pacer = AIMDPacer()
+    pacer.on_ack(512 * 1024, 0.01)
+    assert pacer.rate == float('inf')
+    assert pacer.delay(512 * 1024, 0.0) == 0.0
+
+
+def test_slow_start_doubles_the_rate(clock):
+    pacer = AIMDPacer(initial_rate=100_000)
+    pacer.on_ack(512 * 1024, 0.01)
+    assert pacer.rate == 200_000
+    pacer.on_ack(512 * 1024, 0.01)
+    assert pacer.rate == 400_000
+
+
+def test_rate_capped_near_delivery_rate_and_max_rate(clock):
+    pacer = AIMDPacer(initial_rate=3_000_000)
+    pacer.on_ack(10_000, 0.01)  # delivers 1 MB/s, already well below the rate
+    assert pacer.rate == 3_000_000
+    capped = AIMDPacer(initial_rate=100_000, max_rate=150_000)
+    capped.on_ack(512 * 1024, 0.01)
+    assert capped.rate == 150_000
+
+
+def test_inflated_rtt_halves_the_rate_once_per_rtt(clock):
+    pacer = AIMDPacer(initial_rate=1_000_000)
+    pacer.on_ack(512 * 1024, 0.01)
+    rate = pacer.rate
+    for _ in range(10):
+        pacer.on_ack(512 * 1024, 0.5)
+    assert pacer.rate == rate * 0.5
+    assert not pacer.slow_start
+    clock[0] += 1.0
+    pacer.on_ack(512 * 1024, 0.5)
+    assert pacer.rate == rate * 0.25
+
+
+def test_additive_increase_after_slow_start(clock):
+    pacer = AIMDPacer(initial_rate=1_000_000, increase=1000)
+    pacer.on_ack(512 * 1024, 0.01)
+    pacer.on_loss()
+    rate = pacer.rate
+    pacer.on_ack(512 * 1024, 0.01)
+    assert pacer.rate == rate + 1000
+
+
+def test_loss_on_an_unpaced_sender_cuts_from_the_delivery_rate(clock):
+    pacer = AIMDPacer()
+    pacer.on_ack(1_000_000, 0.1)
+    pacer.on_loss()
+    assert pacer.rate == pytest.approx(5_000_000)
+    floor = AIMDPacer(min_rate=64 * 1024)
+    floor.on_loss()
+    assert floor.rate == 64 * 1024
+
+
+def test_idle_reset_forgets_the_rtt_history(clock):
+    pacer = AIMDPacer(initial_rate=1_000_000, idle_reset=10.0)
+    pacer.on_ack(512 * 1024, 0.01)
+    clock[0] += 30.0
+    rate = pacer.rate
+    pacer.on_ack(512 * 1024, 0.2)  # a slower path, not a queue: no cut
+    assert pacer.min_rtt == 0.2
+    assert pacer.rate > rate
+
+
+def test_delay_spaces_chunks_at_the_rate():
+    pacer = AIMDPacer(initial_rate=1_000_000)
+    assert pacer.delay(500_000, 0.1) == pytest.approx(0.4)
+    assert pacer.delay(500_000, 1.0) == 0.0
+
+
+def test_make_pacer_options():
+    assert isinstance(make_pacer(None), AIMDPacer)
+    assert isinstance(make_pacer('adaptive'), AIMDPacer)
+    assert make_pacer('fixed').interval == 0.1
+    assert make_pacer('none').delay(1, 0) == 0
+    custom = FixedPacer(0.3)
+    assert make_pacer(custom) is custom
+    with pytest.raises(ValueError):
+        make_pacer('turbo')
+
+
+def test_network_keeps_one_adaptive_pacer_per_peer(node):
+    network = node()
+    pacer = network._pacer_for('10.0.0.5')
+    assert network._pacer_for('10.0.0.5', 'adaptive') is pacer
+    assert network._pacer_for('10.0.0.6') is not pacer
+    assert isinstance(network._pacer_for('10.0.0.5', 'fixed'), FixedPacer)
+    network.add_peer('10.0.0.5')
+    network.peers.remove('10.0.0.5')
+    assert network._pacer_for('10.0.0.5') is not pacer
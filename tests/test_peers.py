@@ -0,0 +1,151 @@
+from types import SimpleNamespace
+
+import pytest
+
+import peers
+from discovery import DiscoveryService
+from interfaces import Interface, InterfaceTable
+from metrics import MetricsRegistry
+from peers import PeerTable
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(peers.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def table():
+    table = PeerTable(expiry=20.0)
+    table.events = []
+    table.subscribe(lambda event, info: table.events.append((event, info.ip)))
+    return table
+
+
+def test_touch_adds_once_and_refreshes(clock, table):
+    assert table.touch('10.0.0.2') is True
+    clock[0] += 5
+    assert table.touch('10.0.0.2', port=8080) is False
+    assert table.get('10.0.0.2').port == 8080
+    assert table.get('10.0.0.2').age() == 0
+    assert table.events == [('added', '10.0.0.2')]
+    assert table.refresh('10.0.0.3') is False
+    assert '10.0.0.3' not in table
+
+
+def test_silent_peers_expire(clock, table):
+    table.touch('10.0.0.2')
+    table.touch('10.0.0.3')
+    clock[0] += 15
+    table.refresh('10.0.0.3')
+    clock[0] += 10
+    assert table.expire() == ['10.0.0.2']
+    assert list(table) == ['10.0.0.3']
+    assert ('expired', '10.0.0.2') in table.events
+    assert table.expire() == []
+
+
+def test_remove_notifies(table):
+    table.touch('10.0.0.2')
+    assert table.remove('10.0.0.2') is True
+    assert table.remove('10.0.0.2') is False
+    assert table.events[-1] == ('removed', '10.0.0.2')
+    assert not table
+
+
+def test_multi_homed_peer_listed_once_on_its_best_link(table):
+    wired = Interface('eth0', '10.0.0.1', '255.255.255.0')
+    wifi = Interface('wlan0', '192.168.1.1', '255.255.255.0', wireless=True)
+    table.touch('192.168.1.7', node_id='abc', interface=wifi)
+    table.touch('10.0.0.7', node_id='abc', interface=wired)
+    table.touch('10.0.0.8', node_id='def', interface=wired)
+    assert sorted(table) == ['10.0.0.7', '10.0.0.8']
+    assert len(table.ips(include_down=True)) == 3
+
+
+def test_failing_listener_does_not_stop_the_others(table):
+    seen = []
+    table._listeners.insert(0, lambda event, info: 1 / 0)
+    table.subscribe(lambda event, info: seen.append(event))
+    table.touch('10.0.0.2')
+    assert seen == ['added']
+
+
+def test_heartbeat_broadcasts_once_per_subnet():
+    sent = []
+    interfaces = InterfaceTable()
+    interfaces._interfaces = [Interface('eth0', '10.0.0.1', '255.255.255.0')]
+    interfaces._loaded = float('inf')
+    network = SimpleNamespace(
+        host='', port=8080, peers=PeerTable(), interfaces=interfaces, metrics=MetricsRegistry(),
+        socket=SimpleNamespace(sendto=lambda payload, target: sent.append((payload, target))))
+    for n in range(2, 40):
+        network.peers.touch(f"10.0.0.{n}")
+    network.peers.touch('172.16.5.9')  # routed, added by hand
+    discovery = DiscoveryService(network)
+
+    assert discovery.heartbeat() == 2
+    assert sorted(target for _, target in sent) == [('10.0.0.255', 8080), ('172.16.5.9', 8080)]
+    assert all(payload == f"HEARTBEAT|{discovery.node_id}".encode() for payload, _ in sent)
+
+
+def test_breaker_opens_after_repeated_failures(clock, table):
+    table.touch('10.0.0.2')
+    assert table.record_failure('10.0.0.2') is False
+    assert table.record_failure('10.0.0.2') is True
+    assert table.record_failure('10.0.0.2') is False  # already open
+    assert not table.is_reachable('10.0.0.2')
+    assert list(table) == []
+    assert '10.0.0.2' in table
+    assert table.events[-1] == ('down', '10.0.0.2')
+
+
+def test_breaker_closes_on_discovery_after_hold_down(clock, table):
+    table.touch('10.0.0.2')
+    table.record_failure('10.0.0.2')
+    table.record_failure('10.0.0.2')
+    clock[0] += 1
+    table.touch('10.0.0.2')
+    assert not table.is_reachable('10.0.0.2')
+    clock[0] += table.hold_down
+    table.touch('10.0.0.2')
+    assert table.is_reachable('10.0.0.2')
+    assert table.get('10.0.0.2').failures == 0
+    assert table.events[-1] == ('up', '10.0.0.2')
+
+
+def test_successful_connect_closes_the_breaker(table):
+    table.touch('10.0.0.2')
+    table.record_failure('10.0.0.2')
+    table.record_failure('10.0.0.2')
+    table.record_rtt('10.0.0.2', 0.002)
+    assert table.is_reachable('10.0.0.2')
+    assert table.events[-1] == ('up', '10.0.0.2')
+
+
+def test_connect_timeout_floor_and_cap(table):
+    assert table.connect_timeout('10.0.0.2', 5) == 5
+    table.touch('10.0.0.2')
+    table.record_rtt('10.0.0.2', 0.001)
+    assert table.connect_timeout('10.0.0.2', 5) == 1.0
+    table.touch('10.0.0.3')
+    table.record_rtt('10.0.0.3', 3.0)
+    assert table.connect_timeout('10.0.0.3', 5) == 5
+    table.record_rtt('10.0.0.3', 1.0)
+    assert table.connect_timeout('10.0.0.3', 10) == pytest.approx(2.75 + 4 * 1.625)
+
+
+def test_network_refuses_peers_behind_an_open_breaker(node):
+    from peers import PeerUnreachableError
+
+    network = node()
+    dead = '127.0.0.254'  # nothing listens here
+    network.add_peer(dead)
+    for _ in range(network.peers.failure_threshold):
+        with pytest.raises(OSError):
+            network._connect(dead, 1, 1, 'test')
+    with pytest.raises(PeerUnreachableError):
+        network._connect(dead, 1, 1, 'test')
+    assert network.fan_out(lambda ip: True) == {}
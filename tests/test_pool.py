@@ -0,0 +1,124 @@
+import socket
+import threading
+
+import pytest
+
+from pool import (FRAME_MESSAGE, FRAME_REQUEST, MAGIC, ConnectionPool, SocketReader,
+                  StaleConnectionError, _PooledConnection, encode_reply, gather)
+
+
+class FakeNetwork:
+    """Hands the pool one end of a socketpair per connect; ``serve(reader, sock)`` plays the peer"""
+
+    message_port = 50008
+
+    def __init__(self, serve):
+        self.serve = serve
+        self.connects = 0
+        self.frames = []
+
+    def _connect(self, peer_ip, port, timeout, purpose):
+        self.connects += 1
+        ours, theirs = socket.socketpair()
+        threading.Thread(target=self._peer, args=(theirs,), daemon=True).start()
+        return ours
+
+    def _peer(self, sock):
+        reader = SocketReader(sock)
+        assert reader.read_exact(len(MAGIC)) == MAGIC
+        self.serve(self, reader, sock)
+
+
+def echo(network, reader, sock):
+    with sock:
+        while True:
+            try:
+                frame = reader.read_frame()
+            except OSError:
+                return
+            if frame is None:
+                return
+            network.frames.append(frame)
+            sock.sendall(encode_reply(frame[1].upper() if frame[0] == FRAME_REQUEST else b''))
+
+
+def test_sequential_exchanges_reuse_one_connection():
+    network = FakeNetwork(echo)
+    pool = ConnectionPool(network)
+    assert pool.exchange('10.0.0.2', FRAME_REQUEST, b'ping') == b'PING'
+    assert pool.exchange('10.0.0.2', FRAME_MESSAGE, b'hello') == b''
+    assert network.connects == 1
+    pool.drop('10.0.0.2')
+    pool.exchange('10.0.0.2', FRAME_REQUEST, b'again')
+    assert network.connects == 2
+
+
+def test_connection_closed_by_the_peer_is_resent_once_on_a_fresh_one():
+    def close_after_first(network, reader, sock):
+        if network.connects > 1:
+            return echo(network, reader, sock)
+        network.frames.append(reader.read_frame())
+        sock.sendall(encode_reply(b'ok'))
+        sock.close()  # the peer restarted while the connection sat idle
+
+    network = FakeNetwork(close_after_first)
+    pool = ConnectionPool(network)
+    pool.exchange('10.0.0.2', FRAME_REQUEST, b'one')
+    assert pool.exchange('10.0.0.2', FRAME_REQUEST, b'two') == b'TWO'
+    assert network.connects == 2
+    assert network.frames == [(FRAME_REQUEST, b'one'), (FRAME_REQUEST, b'two')]
+
+
+def test_timeout_on_a_reused_connection_is_not_resent():
+    def slow_second(network, reader, sock):
+        network.frames.append(reader.read_frame())
+        sock.sendall(encode_reply(b'ok'))
+        network.frames.append(reader.read_frame())  # handled, but never answered in time
+        threading.Event().wait(2)
+        sock.close()
+
+    network = FakeNetwork(slow_second)
+    pool = ConnectionPool(network)
+    pool.exchange('10.0.0.2', FRAME_REQUEST, b'one')
+    with pytest.raises(TimeoutError):
+        pool.exchange('10.0.0.2', FRAME_REQUEST, b'two', timeout=0.2)
+    assert network.connects == 1
+    assert len(network.frames) == 2
+
+
+def test_reply_cut_short_is_not_stale():
+    ours, theirs = socket.socketpair()
+    conn = _PooledConnection(ours)
+
+    def reply_in_part():
+        SocketReader(theirs).read_frame()
+        theirs.sendall(encode_reply(b'complete reply')[:6])
+        theirs.close()
+
+    threading.Thread(target=reply_in_part, daemon=True).start()
+    with pytest.raises(ConnectionError) as caught:
+        conn.exchange(FRAME_REQUEST, b'x', timeout=1)
+    assert not isinstance(caught.value, StaleConnectionError)
+
+
+def test_close_without_reply_is_stale():
+    ours, theirs = socket.socketpair()
+    conn = _PooledConnection(ours)
+    theirs.close()
+    with pytest.raises(StaleConnectionError):
+        conn.exchange(FRAME_MESSAGE, b'x', timeout=1)
+
+
+def test_gather_reports_each_peer():
+    from concurrent.futures import Future
+
+    futures = {ip: Future() for ip in ('a', 'b', 'c')}
+    combined = gather(futures)
+    futures['a'].set_result(True)
+    futures['b'].set_result(False)
+    assert not combined.done()
+    futures['c'].set_exception(ConnectionRefusedError())
+    result = combined.result(timeout=1)
+    assert result.succeeded == ['a']
+    assert set(result.failed) == {'b', 'c'}
+    assert gather({}).result(timeout=1).succeeded == []
@@ -0,0 +1,130 @@
+import os
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from streaming import StreamServer, is_media, parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=5-', (5, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=-500', (0, 99)),
+    ('bytes=90-500', (90, 99)),
+    ('bytes=1-2,5-6', None),
+    ('items=0-1', None),
+    ('bytes=-', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=50-10'])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_is_media():
+    assert is_media('lecture.mp4') and is_media('talk.mp3')
+    assert not is_media('notes.pdf') and not is_media('README')
+
+
+class FakeSwarm:
+    """Serves one in-memory file the way ChunkSwarm.read_range does"""
+
+    def __init__(self, name, data, chunk_size=1000):
+        self.name, self.data = name, data
+        self.network = SimpleNamespace(chunk_size=chunk_size)
+        self.reads = []
+
+    def file_size(self, file_name):
+        return len(self.data) if file_name == self.name else None
+
+    def read_range(self, file_name, offset, length, timeout=30.0):
+        self.reads.append((offset, length))
+        return self.data[offset:offset + length]
+
+
+@pytest.fixture(scope='module')
+def server():
+    swarm = FakeSwarm('my lecture.mp4', os.urandom(4500))
+    server = StreamServer(swarm)
+    yield swarm, server.url_for(swarm.name)
+    server.stop()
+
+
+@pytest.fixture
+def served(server):
+    server[0].reads.clear()
+    return server
+
+
+def fetch(url, method='GET', **headers):
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, method=method, headers=headers), timeout=5)
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, b''
+    with response:
+        return response.status, response.headers, response.read()
+
+
+def test_range_request_is_served_chunk_by_chunk(served):
+    swarm, url = served
+    status, headers, body = fetch(url, Range='bytes=900-2099')
+    assert status == 206
+    assert headers['Content-Range'] == 'bytes 900-2099/4500'
+    assert headers['Content-Length'] == '1200'
+    assert headers['Content-Type'] == 'video/mp4'
+    assert body == swarm.data[900:2100]
+    assert swarm.reads == [(900, 100), (1000, 1000), (2000, 100)]
+
+
+def test_whole_file_and_head(served):
+    swarm, url = served
+    status, headers, body = fetch(url)
+    assert status == 200 and body == swarm.data
+    assert headers['Accept-Ranges'] == 'bytes'
+    swarm.reads.clear()
+    status, headers, body = fetch(url, method='HEAD')
+    assert status == 200 and headers['Content-Length'] == '4500'
+    assert swarm.reads == []
+
+
+def test_unsatisfiable_range_and_unknown_file(served):
+    swarm, url = served
+    status, headers, _ = fetch(url, Range='bytes=4500-')
+    assert status == 416 and headers['Content-Range'] == 'bytes */4500'
+    assert fetch(url.replace('my%20lecture', 'other'))[0] == 404
+    assert fetch(url.replace('/files/', '/elsewhere/'))[0] == 404
+
+
+def test_streams_a_published_file_before_it_is_downloaded(node, wait, tmp_path):
+    teacher = node(swarm={'catch_up': False, 'serve_catalog': False})
+    student = node(swarm={'auto_fetch': False})
+    for network in (teacher, student):
+        network.chunk_size = 64 * 1024
+    teacher.add_peer(student.host)
+    student.add_peer(teacher.host)
+    data = os.urandom(10 * 64 * 1024 + 5)
+    path = tmp_path / 'lecture.mp4'
+    path.write_bytes(data)
+    teacher.swarm.share(str(path))
+    assert wait(lambda: student.catalog.get('lecture.mp4'))
+
+    server = StreamServer(student.swarm)
+    try:
+        url = server.url_for('lecture.mp4')
+        status, _, body = fetch(url, Range='bytes=400000-400099')
+        assert status == 206 and body == data[400000:400100]
+        assert wait(lambda: student.swarm.received_files.get('lecture.mp4'))
+        # Saved files are read back from disk, not kept in memory
+        assert 'lecture.mp4' not in student.swarm.received_chunks
+        status, _, body = fetch(url, Range='bytes=-70000')
+        assert status == 206 and body == data[-70000:]
+    finally:
+        server.stop()
@@ -0,0 +1,204 @@
+import base64
+import os
+
+import pytest
+
+from catalog import is_safe_file_name
+
+
+@pytest.mark.parametrize('name', ['lecture.mp4', 'notes v2.pdf', '..hidden', 'a..b'])
+def test_safe_file_names(name):
+    assert is_safe_file_name(name)
+
+
+@pytest.mark.parametrize('name', ['', '.', '..', '../evil', '/etc/passwd', 'dir/file', 'a\\b', 'a\0b', None, 7])
+def test_unsafe_file_names(name):
+    assert not is_safe_file_name(name)
+
+
+def test_chunks_with_unsafe_names_are_dropped(node, tmp_path):
+    network = node(swarm={})
+    swarm = network.swarm
+    for name in ('../escaped.bin', '/tmp/escaped.bin'):
+        swarm.handle_file_chunk({'file_name': name, 'chunk_index': 0, 'total_chunks': 1, 'data': b'x'},
+                                ('10.0.0.2', 1))
+        swarm.handle_file_chunk({'type': 'file_transfer', 'file_name': name, 'file_data': b'x'}, ('10.0.0.2', 1))
+        swarm.handle_peer_message(f"CHUNK_DATA|{name}|0|{base64.b64encode(b'x').decode()}", ('10.0.0.2', 1))
+    assert swarm.received_chunks == {}
+    assert swarm.received_files == {}
+    assert not os.path.exists(tmp_path / 'escaped.bin')
+    assert not os.path.exists('/tmp/escaped.bin')
+    with pytest.raises(ValueError):
+        swarm.save_file('../escaped.bin', b'x', '10.0.0.2')
+    with pytest.raises(ValueError):
+        swarm.assemble_file('../escaped.bin', '10.0.0.2')
+
+
+def test_out_of_range_chunks_are_dropped(node):
+    swarm = node(swarm={}).swarm
+    swarm.handle_file_chunk({'file_name': 'a.bin', 'chunk_index': 0, 'total_chunks': 2, 'data': b'x'}, ('10.0.0.2', 1))
+    for index in (2, -1):
+        swarm.handle_file_chunk({'file_name': 'a.bin', 'chunk_index': index, 'total_chunks': 2, 'data': b'y'},
+                                ('10.0.0.2', 1))
+    assert list(swarm.received_chunks['a.bin']) == [0]
+
+
+def test_pushed_chunks_are_assembled(node):
+    swarm = node(swarm={}).swarm
+    data = [os.urandom(100), os.urandom(100), os.urandom(7)]
+    for index in (2, 0, 1):
+        swarm.handle_file_chunk({'file_name': 'a.bin', 'chunk_index': index, 'total_chunks': 3, 'data': data[index]},
+                                ('10.0.0.2', 1))
+    info = swarm.received_files['a.bin']
+    assert info['size'] == 207 and info['sender'] == '10.0.0.2'
+    with open(info['path'], 'rb') as f:
+        assert f.read() == b''.join(data)
+
+
+def write_file(path, size):
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return str(path), data
+
+
+def test_repair_sends_only_the_missing_chunks(node, wait, tmp_path):
+    sender, receiver = node(), node(swarm={'catch_up': False})
+    sender.chunk_size = receiver.chunk_size = 64 * 1024
+    path, data = write_file(tmp_path / 'f.bin', 5 * 64 * 1024 + 10)
+    sender.add_peer(receiver.host)
+    arrived = []
+    handle = receiver.on_file_received
+    receiver.on_file_received = lambda info, addr: (arrived.append(info['chunk_index']), handle(info, addr))
+
+    assert sender.send_file_chunks(path, receiver.host, indices=[0, 2, 3])
+    assert wait(lambda: len(receiver.swarm.received_chunks.get('f.bin', {})) == 3)
+    assert sender.missing_chunks(receiver.host, path) == {1, 4, 5}
+
+    assert sender.repair(path, peers=[receiver.host]) == {receiver.host: True}
+    assert wait(lambda: receiver.swarm.received_files.get('f.bin'))
+    assert sorted(arrived) == [0, 1, 2, 3, 4, 5]
+    with open(receiver.swarm.received_files['f.bin']['path'], 'rb') as f:
+        assert f.read() == data
+
+    # A peer that has the whole file gets nothing more
+    assert sender.missing_chunks(receiver.host, path) == set()
+    assert sender.repair(path, peers=[receiver.host]) == {receiver.host: True}
+    assert len(arrived) == 6
+
+
+def test_repair_reports_unreachable_peers(node, tmp_path):
+    sender = node()
+    path, _ = write_file(tmp_path / 'f.bin', 1000)
+    dead = '127.0.0.253'  # nothing listens here
+    sender.add_peer(dead)
+    assert isinstance(sender.repair(path, peers=[dead])[dead], OSError)
+
+
+def test_late_joiner_catches_up_from_other_students(node, wait, tmp_path):
+    teacher, a, c = node(), node(swarm={}), node(swarm={})
+    path, data = write_file(tmp_path / 'f.bin', 6 * 64 * 1024)
+    for network in (teacher, a, c):
+        network.chunk_size = 64 * 1024
+    teacher.send_file_chunks(path, a.host, indices=[0, 1, 2])
+    teacher.send_file_chunks(path, c.host, indices=[3, 4, 5])
+    assert wait(lambda: len(a.swarm.received_chunks.get('f.bin', {})) == 3
+                and len(c.swarm.received_chunks.get('f.bin', {})) == 3)
+
+    b = node(swarm={})
+    b.chunk_size = 64 * 1024
+    b.add_peer(a.host)
+    b.add_peer(c.host)
+    assert wait(lambda: b.swarm.received_files.get('f.bin'))
+    with open(b.swarm.received_files['f.bin']['path'], 'rb') as f:
+        assert f.read() == data
+    assert b.swarm._origins['f.bin'] == teacher.host
+
+
+def test_nodes_without_a_catalog_are_not_caught_up_from(node, tmp_path):
+    path, _ = write_file(tmp_path / 'f.bin', 1000)
+    teacher = node(swarm={'catch_up': False, 'serve_catalog': False})
+    teacher.swarm.add_local_file(path)
+    student = node(swarm={'catch_up': False})
+    assert student.swarm.catch_up_from(teacher.host) == []
+    assert 'f.bin' not in student.swarm.expected_chunks
+
+
+def test_catalog_entries_with_unsafe_names_are_skipped(node, tmp_path):
+    path, _ = write_file(tmp_path / 'f.bin', 1000)
+    holder = node(swarm={'catch_up': False})
+    holder.swarm.add_local_file(path)
+    holder.swarm.received_files['../f.bin'] = holder.swarm.received_files['f.bin']
+    student = node(swarm={'catch_up': False})
+    assert student.swarm.catch_up_from(holder.host) == ['f.bin']
+    assert '../f.bin' not in student.swarm.expected_chunks
+
+
+@pytest.fixture
+def requests(node, monkeypatch):
+    """A swarm whose REQUEST_CHUNK messages are recorded instead of sent, and its clock"""
+    import swarm as swarm_module
+
+    network = node(swarm={'catch_up': False, 'request_timeout': 3600, 'endgame_chunks': 0})
+    sent = []
+    now = [1000.0]
+    monkeypatch.setattr(network, 'send_message', lambda peer_ip, message: sent.append((peer_ip, message)) or True)
+    monkeypatch.setattr(swarm_module.time, 'monotonic', lambda: now[0])
+    network.swarm.sent, network.swarm.clock = sent, now
+    return network.swarm
+
+
+def holders_of(swarm, file_name, total, holders):
+    with swarm._lock:
+        swarm.expected_chunks[file_name] = total
+        for index in range(total):
+            for peer_ip in holders(index):
+                swarm._add_holder(file_name, index, peer_ip)
+
+
+def requested(swarm):
+    chunks = [(peer_ip, int(message.rsplit('|', 1)[1])) for peer_ip, message in swarm.sent
+              if message.startswith('REQUEST_CHUNK')]
+    swarm.sent.clear()
+    return chunks
+
+
+def test_each_missing_chunk_is_requested_once(requests):
+    swarm = requests
+    holders_of(swarm, 'f.bin', 4, lambda index: ['10.0.0.2'])
+    swarm.request_missing('f.bin')
+    assert sorted(index for _, index in requested(swarm)) == [0, 1, 2, 3]
+    swarm.request_missing('f.bin')
+    assert requested(swarm) == []
+    assert swarm._missing['f.bin'] == set() and swarm._requested['f.bin'] == {0, 1, 2, 3}
+
+    swarm._chunk_arrived('f.bin', 1, '10.0.0.2', 10)
+    assert 1 not in swarm._requested['f.bin']
+    # A chunk announced later is requested on the next pass
+    with swarm._lock:
+        swarm.expected_chunks['f.bin'] = 5
+        swarm._add_holder('f.bin', 4, '10.0.0.3')
+    swarm.request_missing('f.bin')
+    assert requested(swarm) == [('10.0.0.3', 4)]
+
+
+def test_timed_out_requests_move_to_the_next_holder(requests):
+    swarm = requests
+    holders_of(swarm, 'f.bin', 2, lambda index: ['10.0.0.2', '10.0.0.3'])
+    swarm.request_missing('f.bin')
+    first = dict((index, peer_ip) for peer_ip, index in requested(swarm))
+    swarm.clock[0] += swarm.request_timeout
+    swarm.request_missing('f.bin')
+    assert requested(swarm) == []  # timeouts are only checked on the recheck pass
+    swarm.request_missing('f.bin', rescan=True)
+    again = dict((index, peer_ip) for peer_ip, index in requested(swarm))
+    assert set(again) == {0, 1}
+    assert all(again[index] != first[index] for index in again)
+
+
+def test_origin_is_asked_only_for_chunks_nobody_else_has(requests):
+    swarm = requests
+    swarm._origins['f.bin'] = '10.0.0.1'
+    holders_of(swarm, 'f.bin', 4, lambda index: ['10.0.0.1'] + (['10.0.0.2'] if index < 2 else []))
+    swarm.endgame_chunks, swarm.endgame_sources = 4, 3
+    swarm.request_missing('f.bin')
+    assert sorted(requested(swarm)) == [('10.0.0.1', 2), ('10.0.0.1', 3), ('10.0.0.2', 0), ('10.0.0.2', 1)]